@@ -1,3 +1,4 @@
+import time
 import zmq
 import cbor2
 from dectris.compression import decompress
@@ -27,31 +28,35 @@ def decode_dectris_compression(tag):
     return decompress(encoded, algorithm, elem_size=elem_size)
 
 
+typed_array_dtypes = {
+    64: "u1",
+    65: ">u2",
+    66: ">u4",
+    67: ">u8",
+    68: "u1",
+    69: "<u2",
+    70: "<u4",
+    71: "<u8",
+    72: "i1",
+    73: ">i2",
+    74: ">i4",
+    75: ">i8",
+    77: "<i2",
+    78: "<i4",
+    79: "<i8",
+    80: ">f2",
+    81: ">f4",
+    82: ">f8",
+    83: ">f16",
+    84: "<f2",
+    85: "<f4",
+    86: "<f8",
+    87: "<f16",
+}
+
 tag_decoders = {
     40: lambda tag: decode_multi_dim_array(tag, column_major=False),
-    64: lambda tag: decode_typed_array(tag, dtype="u1"),
-    65: lambda tag: decode_typed_array(tag, dtype=">u2"),
-    66: lambda tag: decode_typed_array(tag, dtype=">u4"),
-    67: lambda tag: decode_typed_array(tag, dtype=">u8"),
-    68: lambda tag: decode_typed_array(tag, dtype="u1"),
-    69: lambda tag: decode_typed_array(tag, dtype="<u2"),
-    70: lambda tag: decode_typed_array(tag, dtype="<u4"),
-    71: lambda tag: decode_typed_array(tag, dtype="<u8"),
-    72: lambda tag: decode_typed_array(tag, dtype="i1"),
-    73: lambda tag: decode_typed_array(tag, dtype=">i2"),
-    74: lambda tag: decode_typed_array(tag, dtype=">i4"),
-    75: lambda tag: decode_typed_array(tag, dtype=">i8"),
-    77: lambda tag: decode_typed_array(tag, dtype="<i2"),
-    78: lambda tag: decode_typed_array(tag, dtype="<i4"),
-    79: lambda tag: decode_typed_array(tag, dtype="<i8"),
-    80: lambda tag: decode_typed_array(tag, dtype=">f2"),
-    81: lambda tag: decode_typed_array(tag, dtype=">f4"),
-    82: lambda tag: decode_typed_array(tag, dtype=">f8"),
-    83: lambda tag: decode_typed_array(tag, dtype=">f16"),
-    84: lambda tag: decode_typed_array(tag, dtype="<f2"),
-    85: lambda tag: decode_typed_array(tag, dtype="<f4"),
-    86: lambda tag: decode_typed_array(tag, dtype="<f8"),
-    87: lambda tag: decode_typed_array(tag, dtype="<f16"),
+    **{t: (lambda tag, dt=dt: decode_typed_array(tag, dtype=dt)) for t, dt in typed_array_dtypes.items()},
     1040: lambda tag: decode_multi_dim_array(tag, column_major=True),
     56500: lambda tag: decode_dectris_compression(tag),
 }
@@ -62,6 +67,228 @@ def tag_hook(decoder, tag):
     return tag_decoder(tag) if tag_decoder else tag
 
 
+# ---------------------------------------------------------------------------
+# Fast path for image messages
+#
+# cbor2.loads() builds every key, string and nested container of a message
+# before the image is reached. The functions below walk the raw CBOR instead,
+# skip over whatever the display does not need and only materialise
+# type / image_id / series_id and the pixel data of data.default.
+# ---------------------------------------------------------------------------
+
+SELF_DESCRIBED_CBOR = 55799
+DECTRIS_COMPRESSION = 56500
+_BREAK = 0xff
+
+
+class FastDecodeError(ValueError):
+    """Raised when a message does not have the layout the fast path expects."""
+
+
+class ImageMessage:
+    __slots__ = ("image_id", "series_id", "data")
+
+    def __init__(self, image_id, series_id, data):
+        self.image_id = image_id
+        self.series_id = series_id
+        self.data = data  # np.ndarray of the detector dtype, shaped as in the message
+
+
+class _Cursor:
+    """Minimal CBOR reader over a memoryview, just enough to walk and skip items."""
+    __slots__ = ("buf", "pos")
+
+    def __init__(self, msg):
+        self.buf = memoryview(msg)
+        self.pos = 0
+
+    def head(self):
+        """Read an item head, returns (major type, argument); argument is None for indefinite lengths."""
+        b = self.buf[self.pos]
+        self.pos += 1
+        major, info = b >> 5, b & 0x1f
+        if info < 24:
+            return major, info
+        if info == 31:
+            return major, None
+        if info > 27:
+            raise FastDecodeError(f"reserved additional info {info}")
+        n = 1 << (info - 24)
+        arg = int.from_bytes(self.buf[self.pos:self.pos + n], "big")
+        self.pos += n
+        return major, arg
+
+    def at_break(self):
+        if self.buf[self.pos] == _BREAK:
+            self.pos += 1
+            return True
+        return False
+
+    def skip(self):
+        major, arg = self.head()
+        if major in (0, 1, 7):
+            return
+        if major in (2, 3):
+            if arg is None:
+                while not self.at_break():
+                    self.skip()
+            else:
+                self.pos += arg
+        elif major in (4, 5):
+            per_entry = 2 if major == 5 else 1
+            if arg is None:
+                while not self.at_break():
+                    for _ in range(per_entry):
+                        self.skip()
+            else:
+                for _ in range(arg * per_entry):
+                    self.skip()
+        else:  # tag, skip its content
+            self.skip()
+
+    def expect(self, major):
+        m, arg = self.head()
+        if m != major:
+            raise FastDecodeError(f"expected major type {major}, got {m}")
+        return arg
+
+    def read_uint(self):
+        m, arg = self.head()
+        if m == 0:
+            return arg
+        if m == 1:
+            return -1 - arg
+        raise FastDecodeError(f"expected integer, got major type {m}")
+
+    def read_text(self):
+        n = self.expect(3)
+        if n is None:
+            raise FastDecodeError("indefinite-length text not supported")
+        text = bytes(self.buf[self.pos:self.pos + n]).decode()
+        self.pos += n
+        return text
+
+    def read_bytes(self):
+        """Byte string as a zero-copy view on the message (joined only if sent in chunks)."""
+        n = self.expect(2)
+        if n is None:
+            chunks = []
+            while not self.at_break():
+                chunks.append(self.read_bytes())
+            return b"".join(chunks)
+        view = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return view
+
+    def read_tag(self):
+        tag = self.expect(6)
+        while tag == SELF_DESCRIBED_CBOR:
+            tag = self.expect(6)
+        return tag
+
+    def iter_map(self):
+        """Yield the keys of a map, the caller consumes (or skips) each value before the next key."""
+        n = self.expect(5)
+        if n is None:
+            while not self.at_break():
+                yield self.read_text()
+        else:
+            for _ in range(n):
+                yield self.read_text()
+
+    def enter_message(self):
+        if self.buf[self.pos] >> 5 == 6:
+            self.read_tag()
+        return self.iter_map()
+
+
+def peek_message_type(msg):
+    """Return the 'type' field of a message without decoding the rest, None if it cannot be found."""
+    try:
+        cur = _Cursor(msg)
+        for key in cur.enter_message():
+            if key == "type":
+                return cur.read_text()
+            cur.skip()
+    except (FastDecodeError, IndexError, UnicodeDecodeError):
+        pass
+    return None
+
+
+def _read_typed_array(cur, stamps=None):
+    dtype = typed_array_dtypes.get(cur.read_tag())
+    if dtype is None:
+        raise FastDecodeError("expected a typed array")
+    if cur.buf[cur.pos] >> 5 == 6:
+        if cur.read_tag() != DECTRIS_COMPRESSION:
+            raise FastDecodeError("unknown tag inside typed array")
+        if cur.expect(4) != 3:
+            raise FastDecodeError("malformed compressed payload")
+        algorithm = cur.read_text()
+        elem_size = cur.read_uint()
+        t0 = time.perf_counter_ns()
+        payload = decompress(cur.read_bytes(), algorithm, elem_size=elem_size)
+        if stamps is not None:
+            stamps["decompress"] = time.perf_counter_ns() - t0
+    else:
+        payload = cur.read_bytes()
+    return np.frombuffer(payload, dtype=dtype)
+
+
+def _read_image_data(cur, stamps=None):
+    """data.default: tag 40/1040 [dims, typed array (possibly wrapping a dectris compressed payload)]"""
+    tag = cur.read_tag()
+    if tag not in (40, 1040):
+        raise FastDecodeError(f"expected a multi-dimensional array, got tag {tag}")
+    if cur.expect(4) != 2:
+        raise FastDecodeError("malformed multi-dimensional array")
+    ndim = cur.expect(4)
+    dims = [cur.read_uint() for _ in range(ndim)]
+    array = _read_typed_array(cur, stamps)
+    return array.reshape(dims, order="F" if tag == 1040 else "C")
+
+
+def decode_image_message(msg, channel="default", stamps=None):
+    """
+    Decode an image message without going through cbor2.
+
+    Returns an ImageMessage, or None if `msg` is not an image message.
+    The pixel data is a view on `msg` for uncompressed frames and on the
+    decompressed bytes otherwise; no other field of the message is built.
+    Raises FastDecodeError if the layout is not the one of a Jungfraujoch image message.
+    The time spent decompressing is stored in `stamps["decompress"]` (ns) if a dict is given.
+    """
+    cur = _Cursor(msg)
+    msg_type = image_id = series_id = data = None
+    try:
+        for key in cur.enter_message():
+            if key == "type":
+                msg_type = cur.read_text()
+                if msg_type != "image":
+                    return None
+            elif key == "image_id":
+                image_id = cur.read_uint()
+            elif key == "series_id":
+                series_id = cur.read_uint()
+            elif key == "data":
+                for name in cur.iter_map():
+                    if name == channel and data is None:
+                        data = _read_image_data(cur, stamps)
+                    else:
+                        cur.skip()
+            else:
+                cur.skip()
+            if msg_type is not None and image_id is not None and series_id is not None and data is not None:
+                break  # Everything needed is there, the trailing metadata is never walked
+    except IndexError:
+        raise FastDecodeError("truncated message")
+    if msg_type != "image":
+        return None
+    if data is None or image_id is None:
+        raise FastDecodeError("image message without image_id or data")
+    return ImageMessage(image_id, series_id, data)
+
+
 
 if __name__ == "__main__":
     # Set up argument parser
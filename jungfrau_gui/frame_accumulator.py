@@ -0,0 +1,197 @@
+import os
+import logging
+import threading
+import numpy as np
+
+# Float frames hold counts converted from int32; anything at or above 2**31 was max_int32 (saturated)
+INT32_LIMIT = np.float32(2**31)
+
+
+def available_memory():
+    """Bytes of memory available (psutil), or of free physical pages when psutil is not installed; None if unknown"""
+    try:
+        import psutil
+    except ImportError:
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            return None
+    return psutil.virtual_memory().available
+
+
+def max_depth(shape, limit=1000, memory_fraction=0.25):
+    """Longest rolling window of `shape` frames whose rings fit in `memory_fraction` of the available memory, at most `limit`"""
+    available = available_memory()
+    if available is None:
+        return limit
+    frame_bytes = int(np.prod(shape)) * (np.dtype(np.int32).itemsize + np.dtype(bool).itemsize)
+    return int(max(1, min(limit, memory_fraction * available // frame_bytes)))
+
+
+class FrameAccumulator:
+    """
+    Rolling N-frame sum of the displayed frames, plus running per-pixel statistics.
+
+    The last `depth` frames are kept as int32 in a ring. Pushing a frame
+    subtracts the oldest one from the int64 sum and adds the new one, in place,
+    so the sum costs O(1) frames per update whatever N is. Masked pixels (NaN,
+    or saturated) are stored as 0 and counted out of the per-pixel number of
+    valid samples: read_sum() is NaN where a frame of the window was masked,
+    as the sum of the frames themselves would be, and read_mean() is
+    NaN-aware, NaN only where no frame was valid.
+
+    With track_variance=True the mean and variance of every pixel since the
+    last reset() are also updated with Welford's algorithm (float64, NaN-aware).
+
+    The rings (depth x frame as int32 + bool) are only allocated while the
+    window is on: depth 0 keeps no frames, push() then only updates the
+    statistics, and resize(0) frees the rings again.
+
+    push() and the readers all take the same lock: readers fill a caller-supplied
+    array (or get a fresh one) that is consistent with a single point in time.
+    """
+    def __init__(self, shape, depth=0, track_variance=False):
+        self.shape = tuple(shape)
+        self.track_variance = track_variance
+        self._lock = threading.Lock()
+        # Scratch, reused for every push
+        self._valid = np.empty(self.shape, dtype=bool)
+        self._delta = np.empty(self.shape, dtype=np.float64) if track_variance else None
+        self._tmp = np.empty(self.shape, dtype=np.float64) if track_variance else None
+        self.max_depth = max_depth(self.shape)
+        self.resize(depth)
+
+    def resize(self, depth):
+        """Change the window length (0: off, rings freed); clears the accumulated frames."""
+        depth = max(int(depth), 0)
+        if depth > self.max_depth:
+            logging.warning(f"Rolling window of {depth} frames would not fit in memory, keeping {self.max_depth}")
+            depth = self.max_depth
+        if depth == getattr(self, 'depth', None):
+            self.reset()
+            return
+        with self._lock:
+            # Drop the old rings first, the new ones are allocated outside the lock the reader pushes under
+            self.depth, self._ring, self._ring_valid = 0, None, None
+            self._reset_locked()
+        if depth == 0:
+            return
+        ring = np.zeros((depth,) + self.shape, dtype=np.int32)
+        ring_valid = np.zeros((depth,) + self.shape, dtype=bool)
+        with self._lock:
+            self.depth, self._ring, self._ring_valid = depth, ring, ring_valid
+            self._reset_locked()
+
+    def reset(self):
+        with self._lock:
+            self._reset_locked()
+
+    def _reset_locked(self):
+        if self._ring is not None:
+            self._ring[:] = 0
+            self._ring_valid[:] = False
+        self._sum = np.zeros(self.shape, dtype=np.int64)
+        self._nvalid = np.zeros(self.shape, dtype=np.int32)
+        self._head = 0
+        self.frames = 0  # Frames currently in the window
+        self.pushed = 0  # Frames pushed since the last reset
+        if self.track_variance:
+            self._w_n = np.zeros(self.shape, dtype=np.int64)
+            self._w_mean = np.zeros(self.shape, dtype=np.float64)
+            self._w_m2 = np.zeros(self.shape, dtype=np.float64)
+
+    def push(self, image):
+        """Add a float frame (NaN for masked pixels) to the window, dropping the oldest one if full."""
+        with self._lock:
+            if self._ring is None:
+                if self.track_variance:
+                    np.less(image, INT32_LIMIT, out=self._valid)
+                    self._welford_update(image)
+                self.pushed += 1
+                return
+            slot = self._ring[self._head]
+            slot_valid = self._ring_valid[self._head]
+            if self.frames == self.depth:
+                # Subtract-oldest
+                np.subtract(self._sum, slot, out=self._sum)
+                np.subtract(self._nvalid, slot_valid, out=self._nvalid, casting='unsafe')
+            else:
+                self.frames += 1
+
+            # NaN compares False, so this also drops masked pixels
+            np.less(image, INT32_LIMIT, out=self._valid)
+            slot.fill(0)
+            np.copyto(slot, image, casting='unsafe', where=self._valid)
+            np.copyto(slot_valid, self._valid)
+
+            # Add-newest
+            np.add(self._sum, slot, out=self._sum)
+            np.add(self._nvalid, slot_valid, out=self._nvalid, casting='unsafe')
+            self._head = (self._head + 1) % self.depth
+            self.pushed += 1
+
+            if self.track_variance:
+                self._welford_update(image)
+
+    def _welford_update(self, image):
+        valid, n, mean, m2 = self._valid, self._w_n, self._w_mean, self._w_m2
+        delta, tmp = self._delta, self._tmp
+        np.add(n, valid, out=n, casting='unsafe')
+        # delta = x - mean, zero on masked pixels so they leave mean and m2 untouched
+        delta.fill(0)
+        np.subtract(image, mean, out=delta, where=valid)
+        # mean += delta / n
+        tmp.fill(0)
+        np.divide(delta, n, out=tmp, where=valid)
+        mean += tmp
+        # m2 += delta * (x - new mean)
+        tmp.fill(0)
+        np.subtract(image, mean, out=tmp, where=valid)
+        tmp *= delta
+        m2 += tmp
+
+    def read_sum(self, out=None, dtype=np.float32):
+        """
+        Rolling sum of the window, written into `out` if given (e.g. the displayed frame buffer);
+        NaN where any frame of the window was masked or saturated.
+        """
+        with self._lock:
+            if out is None:
+                out = np.empty(self.shape, dtype=dtype)
+            np.copyto(out, self._sum, casting='unsafe')
+            np.less(self._nvalid, self.frames, out=self._valid)  # The push scratch, free under the lock
+            np.copyto(out, np.nan, where=self._valid)
+            return out
+
+    def read_mean(self, out=None):
+        """Per-pixel mean over the window; NaN where no frame of the window had a valid value."""
+        with self._lock:
+            if out is None:
+                out = np.empty(self.shape, dtype=np.float32)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.divide(self._sum, self._nvalid, out=out, casting='unsafe')
+            return out
+
+    def read_statistics(self):
+        """(n, mean, variance) per pixel since the last reset, from the Welford accumulators."""
+        if not self.track_variance:
+            raise RuntimeError("FrameAccumulator created without track_variance")
+        with self._lock:
+            n = self._w_n.copy()
+            mean = self._w_mean.copy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                variance = np.where(n > 1, self._w_m2 / (n - 1), np.nan)
+            mean[n == 0] = np.nan
+            return n, mean, variance
+
+    @property
+    def full(self):
+        return self.depth > 0 and self.frames == self.depth
+
+    @property
+    def nbytes(self):
+        """Memory held by the rings"""
+        return 0 if self._ring is None else self._ring.nbytes + self._ring_valid.nbytes
+
+    def __str__(self) -> str:
+        return f"FrameAccumulator({self.frames}/{self.depth} frames)"
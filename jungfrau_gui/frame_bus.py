@@ -0,0 +1,305 @@
+"""
+Shared-memory frame bus.
+
+One publisher process subscribes to the Jungfraujoch stream, decodes each
+image it keeps (only the newest of a backlog, like the ingest thread) and
+writes it into a ring of float frames in a multiprocessing.shared_memory
+block. Any number of readers, in the GUI or in worker processes, attach to
+the block by name and read the frames in place: nothing is pickled and the
+stream is decoded once for all of them.
+
+Every slot carries a sequence number used as a seqlock. The writer makes it
+odd while the slot is being filled and sets it to 2*n once frame n is
+complete, n being the running count of published frames. A reader checks the
+sequence number before and after using the data; if it changed, the slot was
+overwritten meanwhile and the data must be discarded.
+
+Layout: [header: HEADER_LEN int64][slot headers: nslots x SLOT_LEN int64][padding][nslots frames]
+
+Frames are floats (masked pixels are NaN) of the itemsize in the header, so
+processes attaching to a bus take its dtype from there.
+"""
+
+import time
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import zmq
+import cbor2
+
+from .decoder import tag_hook, decode_image_message, peek_message_type, FastDecodeError
+from .frame_pool import convert_frame
+
+
+MAGIC = 0x4A46425553  # "JFBUS"
+HEADER_LEN = 8
+H_MAGIC, H_NSLOTS, H_NROW, H_NCOL, H_ITEMSIZE, H_HEAD, H_RECEIVED, H_SKIPPED = range(HEADER_LEN)
+SLOT_LEN = 4
+S_SEQ, S_FRAME_NR, S_TIME_NS = range(3)
+ALIGN = 64
+
+
+def _data_offset(nslots):
+    offset = (HEADER_LEN + nslots * SLOT_LEN) * 8
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+class FrameView:
+    """A frame of the bus read in place; valid only as long as reader.is_valid(view) holds."""
+    __slots__ = ("seq", "frame_nr", "time_ns", "array")
+
+    def __init__(self, seq, frame_nr, time_ns, array):
+        self.seq = seq
+        self.frame_nr = frame_nr
+        self.time_ns = time_ns
+        self.array = array
+
+
+class _FrameBusBase:
+    def _map(self, shm, nslots, shape, dtype):
+        self.shm = shm
+        self.nslots = nslots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=shm.buf)
+        self.slots = np.ndarray((nslots, SLOT_LEN), dtype=np.int64, buffer=shm.buf, offset=HEADER_LEN * 8)
+        self.frames = np.ndarray((nslots,) + self.shape, dtype=self.dtype, buffer=shm.buf, offset=_data_offset(nslots))
+
+    def _map_existing(self, name, dtype=None):
+        """Attach to the bus `name` and map it with the dtype of its header; `dtype`, if given, must match it."""
+        shm = _attach(name)
+        header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=shm.buf)
+        magic, itemsize = int(header[H_MAGIC]), int(header[H_ITEMSIZE])
+        nslots, nrow, ncol = int(header[H_NSLOTS]), int(header[H_NROW]), int(header[H_NCOL])
+        del header
+        if magic != MAGIC:
+            shm.close()
+            raise ValueError(f"Shared memory block {name} is not a frame bus")
+        if dtype is None:
+            dtype = np.dtype(f"f{itemsize}")
+        elif np.dtype(dtype).itemsize != itemsize:
+            shm.close()
+            raise ValueError(f"Frame bus {name} holds {itemsize}-byte frames, not {np.dtype(dtype)}")
+        self._map(shm, nslots, (nrow, ncol), dtype)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def published(self):
+        return int(self.header[H_HEAD])
+
+    def close(self):
+        # Views on the buffer must be gone before the mapping can be closed
+        self.header = self.slots = self.frames = None
+        self.shm.close()
+
+
+class FrameBusWriter(_FrameBusBase):
+    """
+    Single writer of the ring. With create=True it owns the shared memory block and unlinks it on close;
+    the frames are float32 if `dtype` is None. With create=False it attaches to the bus `name`, with the
+    dtype of the bus.
+    """
+    def __init__(self, name=None, shape=None, dtype=None, nslots=8, create=True, chunk_rows=32):
+        if create:
+            dtype = np.dtype(np.float32 if dtype is None else dtype)
+            if dtype.kind != 'f':
+                raise ValueError(f"Frame bus frames are floats (masked pixels are NaN), not {dtype}")
+            size = _data_offset(nslots) + nslots * int(np.prod(shape)) * np.dtype(dtype).itemsize
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._map(shm, nslots, shape, dtype)
+            self.header[:] = 0
+            self.slots[:] = 0
+            self.header[H_NSLOTS] = nslots
+            self.header[H_NROW], self.header[H_NCOL] = self.shape
+            self.header[H_ITEMSIZE] = self.dtype.itemsize
+            self.header[H_MAGIC] = MAGIC
+        else:
+            self._map_existing(name, dtype)
+        self.owner = create
+        self._mask = np.empty((min(chunk_rows, self.shape[0]), self.shape[1]), dtype=bool)
+
+    def publish(self, raw_data, frame_nr):
+        """Convert `raw_data` into the next slot of the ring and make it visible to readers"""
+        n = int(self.header[H_HEAD]) + 1
+        i = (n - 1) % self.nslots
+        slot = self.slots[i]
+        slot[S_SEQ] = 2 * n - 1  # Odd: being written
+        convert_frame(self.frames[i], raw_data, self._mask)
+        slot[S_FRAME_NR] = frame_nr
+        slot[S_TIME_NS] = time.time_ns()
+        slot[S_SEQ] = 2 * n
+        self.header[H_HEAD] = n
+        return n
+
+    def count(self, received=0, skipped=0):
+        self.header[H_RECEIVED] += received
+        self.header[H_SKIPPED] += skipped
+
+    def close(self):
+        name = self.shm.name
+        super().close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            logging.info(f"Frame bus {name} removed")
+
+
+class FrameBusReader(_FrameBusBase):
+    """Zero-copy reader attached to an existing bus by name, with the dtype of the bus (`dtype`, if given, must match it)."""
+    def __init__(self, name, dtype=None):
+        self._map_existing(name, dtype)
+
+    @property
+    def received(self):
+        return int(self.header[H_RECEIVED])
+
+    @property
+    def skipped(self):
+        return int(self.header[H_SKIPPED])
+
+    def latest(self, after=0):
+        """Newest complete frame with a count above `after`, or None."""
+        for _ in range(self.nslots):
+            n = int(self.header[H_HEAD])
+            if n <= after:
+                return None
+            slot = self.slots[(n - 1) % self.nslots]
+            frame_nr, time_ns = int(slot[S_FRAME_NR]), int(slot[S_TIME_NS])
+            if slot[S_SEQ] == 2 * n:
+                return FrameView(n, frame_nr, time_ns, self.frames[(n - 1) % self.nslots])
+            # Overwritten between reading the head and the slot, try the new head
+        return None
+
+    def frame(self, seq):
+        """Frame number `seq` of the bus if its slot still holds it, or None."""
+        if seq < 1:
+            return None
+        slot = self.slots[(seq - 1) % self.nslots]
+        frame_nr, time_ns = int(slot[S_FRAME_NR]), int(slot[S_TIME_NS])
+        if slot[S_SEQ] != 2 * seq:
+            return None
+        return FrameView(seq, frame_nr, time_ns, self.frames[(seq - 1) % self.nslots])
+
+    def wait_latest(self, after=0, timeout=1.0, poll_s=0.001):
+        """Block until a frame with a count above `after` is published, None on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            view = self.latest(after)
+            if view is not None or time.monotonic() >= deadline:
+                return view
+            time.sleep(poll_s)
+
+    def is_valid(self, view):
+        """True if the slot of `view` still holds the same frame, i.e. what was read from it is consistent"""
+        return self.slots[(view.seq - 1) % self.nslots][S_SEQ] == 2 * view.seq
+
+    def copy_into(self, view, out):
+        """Copy the frame of `view` into `out`. Returns False if it was overwritten during the copy."""
+        np.copyto(out, view.array)
+        return self.is_valid(view)
+
+
+def _attach(name):
+    # Attaching registers the block with the resource tracker again. Processes started through
+    # multiprocessing share the tracker of the GUI, so the block is still unlinked exactly once,
+    # by the FrameBus that created it.
+    return shared_memory.SharedMemory(name=name, create=False)
+
+
+def _frame_bus_publisher(name, endpoint, timeout_ms, hwm, stop_event):
+    """Publisher process: subscribe to the stream, decode once, write into the bus."""
+    logging.info(f"Frame bus publisher starting on {endpoint} -> {name}")
+    writer = FrameBusWriter(name=name, create=False)
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.RCVTIMEO, timeout_ms)
+    socket.setsockopt(zmq.RCVHWM, hwm)
+    socket.connect(endpoint)
+    socket.setsockopt(zmq.SUBSCRIBE, b"")
+
+    def recv(flags=0):
+        try:
+            return socket.recv(flags=flags)
+        except zmq.error.Again:
+            return None
+
+    while not stop_event.is_set():
+        try:
+            msg = recv()
+            if msg is None:
+                continue
+            received, skipped = 1, 0
+            # Keep only the newest image message of the backlog
+            while True:
+                newer = recv(zmq.NOBLOCK)
+                if newer is None:
+                    break
+                received += 1
+                if peek_message_type(newer) == "image":
+                    skipped += peek_message_type(msg) == "image"
+                    msg = newer
+            writer.count(received, skipped)
+
+            try:
+                image = decode_image_message(msg)
+                if image is None:
+                    continue
+                raw_data, frame_nr = image.data, image.image_id
+            except FastDecodeError:
+                msg = cbor2.loads(msg, tag_hook=tag_hook)
+                if msg['type'] != "image":
+                    continue
+                raw_data, frame_nr = msg['data']['default'], msg['image_id']
+            writer.publish(raw_data, frame_nr)
+        except Exception as e:
+            logging.error(f"Frame bus publisher: {e}")
+
+    socket.close()
+    context.term()
+    writer.close()
+    logging.info("Frame bus publisher stopped")
+
+
+class FrameBus:
+    """
+    Owner of a frame bus: creates the shared memory ring and runs the publisher process.
+
+    Readers attach with FrameBusReader(bus.name), also from other processes.
+    """
+    def __init__(self, endpoint, shape, dtype=np.float32, nslots=8, timeout_ms=100, hwm=2):
+        self.endpoint = endpoint
+        self.timeout_ms = timeout_ms
+        self.hwm = hwm
+        self.writer = FrameBusWriter(shape=shape, dtype=dtype, nslots=nslots, create=True)
+        self.name = self.writer.name
+        self.stop_event = mp.Event()
+        self.process = None
+
+    def start(self):
+        if self.process is None or not self.process.is_alive():
+            self.stop_event.clear()
+            self.process = mp.Process(target=_frame_bus_publisher,
+                                      args=(self.name, self.endpoint, self.timeout_ms, self.hwm, self.stop_event),
+                                      name="FrameBusPublisher",
+                                      daemon=True)
+            self.process.start()
+            logging.info(f"Frame bus {self.name} started ({self.writer.nslots} slots of {self.writer.shape})")
+
+    def stop(self):
+        if self.process is not None:
+            self.stop_event.set()
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                logging.warning("Frame bus publisher did not stop in time, terminating it")
+                self.process.terminate()
+                self.process.join()
+            self.process = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
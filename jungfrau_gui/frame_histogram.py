@@ -0,0 +1,84 @@
+import threading
+import numpy as np
+
+from .frame_accumulator import INT32_LIMIT
+
+
+class FrameHistogram:
+    """
+    Fixed-bin histogram of a frame, for auto-contrast and the HistogramLUTItem.
+
+    Bins are uniform in asinh(x / (2 * linear_width)): about `linear_width`
+    wide around zero (pedestal-subtracted data can be negative) and
+    logarithmic above, so a single set of bins covers the noise floor and
+    bright spots up to the int32 range with ~1.5 % relative resolution.
+    Masked (NaN) and saturated pixels are left out. Frames larger than
+    `target_size` pixels are subsampled on a regular grid.
+
+    compute() reuses scratch buffers under a lock (the reader thread computes
+    streamed frames, the GUI thread only static images); the counts it
+    returns are a new array that can be handed to any thread. percentiles()
+    and plot_data() cost O(bins).
+    """
+    def __init__(self, bins=2048, linear_width=4.0, low=-1e5, target_size=2**17):
+        self.bins = bins
+        self.target_size = target_size
+        self._c = 2 * linear_width
+        self._y0 = np.arcsinh(low / self._c)
+        self._y1 = np.arcsinh(float(INT32_LIMIT) / self._c)
+        self._per_bin = bins / (self._y1 - self._y0)
+        self.edges = self._c * np.sinh(np.linspace(self._y0, self._y1, bins + 1))
+        self._widths = np.diff(self.edges)
+        self._lock = threading.Lock()
+        self._shape = None
+
+    def _scratch(self, shape):
+        if self._shape != shape:
+            self._y = np.empty(shape, dtype=np.float32)
+            self._mask = np.empty(shape, dtype=bool)
+            self._index = np.empty(shape, dtype=np.intp)
+            self._shape = shape
+
+    def compute(self, image):
+        """Counts per bin of `image` (float, NaN for masked pixels)."""
+        rows, cols = image.shape
+        step = max(1, int(np.ceil(np.sqrt(rows * cols / self.target_size))))
+        sample = image[::step, ::step]
+        with self._lock:
+            self._scratch(sample.shape)
+            y, mask, index = self._y, self._mask, self._index
+            np.divide(sample, self._c, out=y)
+            np.arcsinh(y, out=y)
+            y -= self._y0
+            y *= self._per_bin
+            # Below the range goes to the first bin, saturated and NaN to the extra one dropped below
+            np.clip(y, 0, self.bins, out=y)
+            np.less(sample, INT32_LIMIT, out=mask)
+            np.logical_not(mask, out=mask)
+            np.copyto(y, self.bins, where=mask)
+            np.copyto(index, y, casting='unsafe')
+            counts = np.bincount(index.ravel(), minlength=self.bins + 1)
+        return counts[:self.bins]
+
+    def percentiles(self, counts, quantiles=(0.01, 0.99999)):
+        """Values at the given quantiles, linearly interpolated inside the bin they fall in."""
+        cdf = np.cumsum(counts)
+        total = cdf[-1]
+        if total == 0:
+            return None
+        values = []
+        for q in quantiles:
+            target = q * total
+            k = min(int(np.searchsorted(cdf, target)), self.bins - 1)
+            below = cdf[k - 1] if k > 0 else 0
+            frac = (target - below) / counts[k] if counts[k] else 0.0
+            values.append(self.edges[k] + frac * self._widths[k])
+        return tuple(values)
+
+    def plot_data(self, counts):
+        """(bin left edges, counts per unit value) for HistogramLUTItem, empty bins at both ends trimmed."""
+        nonzero = np.flatnonzero(counts)
+        if nonzero.size == 0:
+            return None, None
+        first, last = nonzero[0], nonzero[-1] + 1
+        return self.edges[first:last], counts[first:last] / self._widths[first:last]
@@ -0,0 +1,112 @@
+import logging
+import threading
+import numpy as np
+from collections import deque
+
+MIN_INT32 = np.iinfo(np.int32).min
+
+
+def convert_frame(out, raw_data, mask):
+    """
+    Cast raw detector data into the preallocated float array `out`, min_int32 pixels become NaN.
+
+    The conversion runs over blocks of len(mask) rows so that each block is
+    converted and masked while it is still in cache: a single pass over the
+    frame, without temporaries. `mask` is a (chunk_rows, ncol) bool scratch.
+    """
+    raw = raw_data.reshape(out.shape)
+    rows = out.shape[0]
+    step = mask.shape[0]
+    for r0 in range(0, rows, step):
+        r1 = min(r0 + step, rows)
+        src = raw[r0:r1]
+        dst = out[r0:r1]
+        m = mask[:r1 - r0]
+        np.copyto(dst, src, casting='unsafe')
+        np.equal(src, MIN_INT32, out=m)
+        np.copyto(dst, np.nan, where=m)
+    return out
+
+
+class FrameBuffer:
+    """
+    Reusable image buffer handed out by a FramePool.
+
+    Whoever holds a FrameBuffer owns one reference to it. Extra consumers
+    (fitter, accumulator, ...) call retain() and must call release() when
+    they are done; the buffer goes back to the pool once the last
+    reference is released.
+    """
+    __slots__ = ("pool", "array", "frame_nr", "stamps", "display", "display_levels", "histogram", "_refs")
+
+    def __init__(self, pool, shape, dtype):
+        self.pool = pool
+        self.array = np.empty(shape, dtype=dtype)
+        self.frame_nr = None
+        self.stamps = None  # perf_counter_ns() stamps along the display path, see latency.py
+        self.display = None  # uint8 display indices, allocated by FrameRenderer and kept with the buffer
+        self.display_levels = None  # Levels `display` was rendered with, None when it is not current
+        self.histogram = None  # FrameHistogram counts of `array`
+        self._refs = 0
+
+    def retain(self):
+        with self.pool._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self.pool._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            if self._refs < 0:
+                logging.error(f"FrameBuffer of frame {self.frame_nr} released more often than retained")
+                self._refs = 0
+                return
+            self.frame_nr = None
+            self.stamps = None
+            self.display_levels = None
+            self.histogram = None
+            self.pool._free.append(self)
+
+
+class FramePool:
+    """
+    Fixed-size set of preallocated FrameBuffers.
+
+    The ingest side acquires a buffer, converts the raw detector data into it
+    with fill() and passes it on. No frame-sized array is allocated once the
+    pool exists; when every buffer is still held by a consumer, acquire()
+    returns None and the frame is dropped rather than allocating a new one.
+    """
+    def __init__(self, shape, dtype=np.float32, size=6, chunk_rows=32):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self.chunk_rows = min(chunk_rows, self.shape[0])
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._free = deque(FrameBuffer(self, self.shape, self.dtype) for _ in range(size))
+        # Scratch for the sentinel mask, one chunk of rows only so it stays in cache
+        self._mask = np.empty((self.chunk_rows, self.shape[1]), dtype=bool)
+
+    def acquire(self):
+        """Get a free buffer holding one reference, or None if the pool is exhausted."""
+        with self._lock:
+            if not self._free:
+                self.misses += 1
+                return None
+            frame = self._free.popleft()
+            frame._refs = 1
+        return frame
+
+    def fill(self, frame, raw_data, frame_nr=None):
+        """Convert int32 detector data into `frame` in place (see convert_frame). Only the ingest thread may call fill()."""
+        convert_frame(frame.array, raw_data, self._mask)
+        frame.frame_nr = frame_nr
+        return frame
+
+    @property
+    def available(self):
+        with self._lock:
+            return len(self._free)
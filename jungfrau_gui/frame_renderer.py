@@ -0,0 +1,72 @@
+import numpy as np
+
+NCOLORS = 255  # Display indices 1..255 carry the colormap, index 0 is reserved for masked (NaN) pixels
+
+
+def color_table(lut, image=None):
+    """
+    256-entry ARGB32 color table for an index image made by FrameRenderer.
+
+    `lut` is whatever ImageItem.lut holds: None (grayscale), an (N, 3|4)
+    uint8 array, or the HistogramLUTItem callable. Entry 0 is transparent, as
+    NaN pixels are when pyqtgraph renders the float image itself.
+    """
+    if callable(lut):
+        lut = lut(image, 256)
+    if lut is None:
+        lut = np.arange(256, dtype=np.uint8)
+    lut = np.asarray(lut)
+    if lut.ndim == 1:
+        lut = np.repeat(lut[:, None], 3, axis=1)
+    lut = lut[np.linspace(0, len(lut) - 1, NCOLORS).round().astype(int)].astype(np.uint32)
+    alpha = lut[:, 3] if lut.shape[1] == 4 else np.full(NCOLORS, 255, dtype=np.uint32)
+    argb = (alpha << 24) | (lut[:, 0] << 16) | (lut[:, 1] << 8) | lut[:, 2]
+    return [0] + [int(c) for c in argb]
+
+
+class FrameRenderer:
+    """
+    Map float frames to uint8 display indices with the current levels, off the GUI thread.
+
+    The GUI sets `levels` (a (low, high) tuple, replaced as a whole so the
+    reader thread always sees a consistent pair). render() writes the indices
+    into frame.display, allocated once per pooled buffer, and records the
+    levels it used in frame.display_levels so the GUI can tell a stale
+    rendering. Only one thread may call render(): it shares its scratch rows.
+    """
+    def __init__(self, chunk_rows=32):
+        self.levels = None
+        self.chunk_rows = chunk_rows
+        self._scratch = None
+        self._mask = None
+
+    def render(self, frame):
+        levels = self.levels
+        if levels is None:
+            return False
+        image = frame.array
+        if frame.display is None or frame.display.shape != image.shape:
+            frame.display = np.empty(image.shape, dtype=np.uint8)
+        rows, cols = image.shape
+        step = min(self.chunk_rows, rows)
+        if self._scratch is None or self._scratch.shape != (step, cols):
+            self._scratch = np.empty((step, cols), dtype=np.float32)
+            self._mask = np.empty((step, cols), dtype=bool)
+
+        low, high = levels
+        scale = NCOLORS / (high - low) if high != low else 0.0
+        # Same blocking as convert_frame: each block of rows goes through every step while in cache
+        for r0 in range(0, rows, step):
+            r1 = min(r0 + step, rows)
+            src = image[r0:r1]
+            t = self._scratch[:r1 - r0]
+            m = self._mask[:r1 - r0]
+            np.subtract(src, low, out=t)
+            np.multiply(t, scale, out=t)
+            np.clip(t, 0, NCOLORS - 1, out=t)
+            t += 1  # Shift past the NaN index, the cast below floors as pyqtgraph does
+            np.isnan(src, out=m)
+            np.copyto(t, 0, where=m)
+            np.copyto(frame.display[r0:r1], t, casting='unsafe')
+        frame.display_levels = levels
+        return True
@@ -51,6 +51,7 @@ def get_git_info():
 
 cfg = ConfigurationClient()
 stream = "tcp://localhost:4545"
+framebus = None  # Name of the shared-memory frame bus, None if every consumer reads the stream itself
 tem_mode = True
 # jfj = False
 
@@ -66,9 +67,6 @@ cdtype = ctypes.c_float
 # fitterWorkerReady = mp.Value(ctypes.c_bool)
 # fitterWorkerReady.value = False
 
-accframes = 0
-acc_image = np.zeros((nrow,ncol), dtype = dtype)
-
 exit_flag = mp.Value(ctypes.c_bool)
 exit_flag.value = False
 
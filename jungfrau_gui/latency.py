@@ -0,0 +1,119 @@
+"""
+Per-frame latency bookkeeping, from the socket to pixels on screen.
+
+Each stage of the display path adds a time.perf_counter_ns() stamp to the
+`stamps` dict travelling with the frame (FrameBuffer.stamps). Once the frame
+has been painted, LatencyTracker turns the stamps into stage durations and
+keeps the last `window` frames for rolling percentiles and CSV export.
+
+Stamps (in order along the path):
+    recv           message returned by the socket (StreamIngest)
+    decode_start   decoder starts on the kept message (after draining the backlog)
+    decompress     [duration, ns] spent in dectris decompress, if any
+    decoded        CBOR walked and pixel data decompressed
+    converted      float conversion / NaN masking into the pooled buffer done
+    taken          Reader picked the frame from the latest-frame slot
+    rendered       histogram and display indices computed on the reader thread, if levels are set
+    gui            VisualizationPanel.updateUI entered on the GUI thread
+    set_image      ImageItem.setImage returned
+    painted        ImageItem.paint returned for this image
+"""
+
+import csv
+import time
+import threading
+import numpy as np
+
+STAGES = ("receive", "decode", "decompress", "convert", "queue", "render", "signal", "set_image", "paint", "total")
+
+
+def stage_durations(stamps):
+    """Stage durations in ms from the stamps of one frame, NaN where a stamp is missing"""
+    def span(a, b):
+        if a in stamps and b in stamps:
+            return (stamps[b] - stamps[a]) / 1e6
+        return np.nan
+    decompress = stamps.get("decompress", 0) / 1e6
+    decode = span("decode_start", "decoded") - decompress
+    end = "painted" if "painted" in stamps else "set_image"
+    handed = "rendered" if "rendered" in stamps else "taken"
+    return (
+        span("recv", "decode_start"),
+        decode,
+        decompress if "decoded" in stamps else np.nan,
+        span("decoded", "converted"),
+        span("converted", "taken"),
+        span("taken", "rendered"),
+        span(handed, "gui"),
+        span("gui", "set_image"),
+        span("set_image", "painted"),
+        span("recv", end),
+    )
+
+
+class LatencyTracker:
+    """
+    Rolling window of per-frame stage durations (ms).
+
+    record() may be called from any thread; summary() and dump_csv() take a
+    consistent snapshot under the same lock.
+    """
+    def __init__(self, window=2000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations = np.full((window, len(STAGES)), np.nan)
+        self._frame_nrs = np.zeros(window, dtype=np.int64)
+        self._wall = np.zeros(window)
+        self._count = 0
+
+    def record(self, frame_nr, stamps):
+        row = stage_durations(stamps)
+        with self._lock:
+            i = self._count % self.window
+            self._durations[i] = row
+            self._frame_nrs[i] = -1 if frame_nr is None else frame_nr
+            self._wall[i] = time.time()
+            self._count += 1
+
+    def reset(self):
+        with self._lock:
+            self._durations[:] = np.nan
+            self._count = 0
+
+    def _snapshot(self):
+        with self._lock:
+            n = min(self._count, self.window)
+            # Oldest first
+            order = (np.arange(n) + self._count - n) % self.window
+            return self._durations[order].copy(), self._frame_nrs[order].copy(), self._wall[order].copy()
+
+    @property
+    def count(self):
+        return self._count
+
+    def summary(self):
+        """{stage: (n, p50, p95, p99)} over the window, durations in ms"""
+        durations, _, _ = self._snapshot()
+        result = {}
+        for k, stage in enumerate(STAGES):
+            values = durations[:, k]
+            values = values[np.isfinite(values)]
+            if values.size:
+                p50, p95, p99 = np.percentile(values, (50, 95, 99))
+                result[stage] = (values.size, p50, p95, p99)
+            else:
+                result[stage] = (0, np.nan, np.nan, np.nan)
+        return result
+
+    def dump_csv(self, path):
+        durations, frame_nrs, wall = self._snapshot()
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "frame_nr"] + [f"{s}_ms" for s in STAGES])
+            for t, nr, row in zip(wall, frame_nrs, durations):
+                writer.writerow([f"{t:.6f}", nr] + ["" if np.isnan(v) else f"{v:.4f}" for v in row])
+        return len(frame_nrs)
+
+    def __str__(self) -> str:
+        summary = self.summary()
+        return ", ".join(f"{s} p50 {v[1]:.2f} ms" for s, v in summary.items() if v[0])
@@ -12,6 +12,7 @@ from PySide6.QtCore import QCoreApplication
 from . import globals
 from .ui_components import palette
 from .zmq_receiver import ZmqReceiver
+from .frame_bus import FrameBus
 from .ui_main_window import ApplicationWindow, get_gui_info
 
 from pathlib import Path
@@ -100,6 +101,7 @@ def main():
     parser.add_argument("-f", "--logfile", action="store_true", help="File-output of logging")
     parser.add_argument("-e", "--dev", action="store_true", help="Activate developing function")
     parser.add_argument("-v", "--version", action="store_true", help="Detailed version description")
+    parser.add_argument("-b", "--framebus", action="store_true", help="Decode the stream once in a separate process and share frames through shared memory")
 
     args = parser.parse_args()
 
@@ -147,7 +149,6 @@ def main():
     # Update the type of global variables
     globals.stream = args.stream 
     globals.dtype = args.dtype
-    globals.acc_image = np.zeros((globals.nrow,globals.ncol), dtype = args.dtype)
     globals.tem_mode = not args.playmode
     globals.tem_host = args.temhost
     globals.dev = args.dev
@@ -166,6 +167,13 @@ def main():
 
     Rcv = ZmqReceiver(endpoint=args.stream, dtype=args.dtype) 
 
+    if args.framebus:
+        # Display and beam fitter then read decoded frames from the bus instead of decoding the stream each
+        bus = FrameBus(args.stream, (globals.nrow, globals.ncol), dtype=args.dtype)
+        bus.start()
+        globals.framebus = bus.name
+        app.aboutToQuit.connect(bus.stop)
+
     viewer = ApplicationWindow(Rcv, app)
     app_palette = palette.get_palette("dark")
     viewer.setPalette(app_palette)
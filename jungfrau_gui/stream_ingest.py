@@ -0,0 +1,189 @@
+import time
+import logging
+import threading
+import zmq
+
+from . import globals
+from .decoder import peek_message_type
+from .frame_bus import FrameBusReader
+
+
+class IngestStats:
+    """
+    Frame counters of the ingest thread.
+
+    received: raw messages pulled from the SUB socket
+    decoded:  image messages decoded into a frame
+    skipped:  frames that never reached the display (drained over without
+              decoding, or overwritten in the latest slot before being read)
+    """
+    def __init__(self):
+        self.received = 0
+        self.decoded = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+
+    def as_dict(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "received": self.received,
+            "decoded": self.decoded,
+            "skipped": self.skipped,
+            "received_hz": self.received / elapsed,
+        }
+
+    def __str__(self) -> str:
+        return f"received {self.received}, decoded {self.decoded}, skipped {self.skipped}"
+
+
+class LatestFrameSlot:
+    """
+    Single-entry mailbox holding only the newest decoded frame.
+
+    The ingest thread publishes FrameBuffers into it, the display takes from
+    it without ever blocking on the stream. A frame published before the
+    previous one was taken replaces it (conflation) and the stale buffer is
+    released back to its pool.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+
+    def publish(self, frame):
+        """Store a new frame. Returns True if an unread frame was overwritten."""
+        with self._lock:
+            stale = self._frame
+            self._frame = frame
+        if stale is not None:
+            stale.release()
+        return stale is not None
+
+    def take(self):
+        """Return the new FrameBuffer (ownership passes to the caller), or None if nothing new arrived."""
+        with self._lock:
+            frame = self._frame
+            self._frame = None
+        return frame
+
+    def clear(self):
+        with self._lock:
+            stale = self._frame
+            self._frame = None
+        if stale is not None:
+            stale.release()
+
+
+class StreamIngest(threading.Thread):
+    """
+    Dedicated thread draining the ZMQ stream of a ZmqReceiver.
+
+    Each wake-up empties whatever is queued on the socket and decodes only the
+    newest message, so decode work follows the display and not the detector
+    frame rate. The decoded frame is left in `slot` for the display to pick up.
+    """
+    def __init__(self, receiver, slot=None):
+        super().__init__(name="StreamIngestThread", daemon=True)
+        self.receiver = receiver
+        self.slot = slot if slot is not None else LatestFrameSlot()
+        self.stats = IngestStats()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        logging.info("Stream ingest thread started")
+        while not self._stop_event.is_set() and not globals.exit_flag.value:
+            # Blocks for at most the receiver's RCVTIMEO so that stop() is honoured
+            msg = self.receiver.recv_message()
+            if msg is None:
+                continue
+            t_recv = time.perf_counter_ns()
+            self.stats.received += 1
+
+            # Drain the backlog, only the newest image message is worth decoding.
+            # Peeking at the type keeps a trailing start/end message from hiding the last image.
+            is_image = peek_message_type(msg) == "image"
+            while True:
+                newer = self.receiver.recv_message(zmq.NOBLOCK)
+                if newer is None:
+                    break
+                self.stats.received += 1
+                if peek_message_type(newer) != "image":
+                    self.receiver.decode_message(newer)  # start/end messages are only logged
+                    continue
+                if is_image:
+                    self.stats.skipped += 1
+                else:
+                    self.receiver.decode_message(msg)
+                msg, is_image = newer, True
+                t_recv = time.perf_counter_ns()
+
+            frame, _ = self.receiver.decode_message(msg, t_recv)
+            if frame is None:
+                continue
+            self.stats.decoded += 1
+            if self.slot.publish(frame):
+                self.stats.skipped += 1
+        logging.info(f"Stream ingest thread stopped ({self.stats})")
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.slot.clear()
+
+
+class FrameBusIngest(threading.Thread):
+    """
+    Counterpart of StreamIngest when the stream is decoded by a frame bus publisher.
+
+    Frames are already decoded in shared memory, the thread only copies the
+    newest one into a pooled buffer (no decode, no NaN masking) and leaves it
+    in `slot` for the display.
+    """
+    def __init__(self, bus_name, pool, slot=None, poll_timeout=0.1):
+        super().__init__(name="FrameBusIngestThread", daemon=True)
+        self.reader = FrameBusReader(bus_name)
+        self.pool = pool
+        self.slot = slot if slot is not None else LatestFrameSlot()
+        self.stats = IngestStats()
+        self.poll_timeout = poll_timeout
+        self._stop_event = threading.Event()
+
+    def run(self):
+        logging.info(f"Frame bus ingest thread started on {self.reader.name}")
+        last = self.reader.published
+        not_shown = 0  # Bus frames this thread never copied, or overwritten in the slot
+        while not self._stop_event.is_set() and not globals.exit_flag.value:
+            view = self.reader.wait_latest(after=last, timeout=self.poll_timeout)
+            if view is None:
+                continue
+            t_recv = time.perf_counter_ns()
+            frame = self.pool.acquire()
+            if frame is None:
+                # Every buffer still held by the display: drop this frame and wait for the next one
+                # (leaving `last` behind would hand back the same view at once and spin)
+                logging.debug(f"No free frame buffer, dropping bus frame #{view.seq} ({self.pool.misses} dropped so far)")
+                not_shown += view.seq - last
+                last = view.seq
+                self.stats.skipped = self.reader.skipped + not_shown
+                continue
+            if not self.reader.copy_into(view, frame.array):
+                frame.release()  # Overwritten while copying, the next one is already there
+                continue
+            frame.frame_nr = view.frame_nr
+            # Decoding happened in the publisher process, the copy stands for the conversion
+            frame.stamps = {"recv": t_recv, "decode_start": t_recv, "decoded": t_recv, "converted": time.perf_counter_ns()}
+            not_shown += view.seq - last - 1
+            last = view.seq
+            if self.slot.publish(frame):
+                not_shown += 1
+            self.stats.received = self.reader.received
+            self.stats.decoded += 1
+            self.stats.skipped = self.reader.skipped + not_shown
+        logging.info(f"Frame bus ingest thread stopped ({self.stats})")
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.slot.clear()
+        self.reader.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the image decode path.
+
+Compares, per frame, the generic `cbor2.loads(msg, tag_hook=tag_hook)` path
+followed by the float conversion the GUI used to do, with the fast path of
+decoder.py converting into a pooled frame buffer.
+
+    python -m jungfrau_gui.stream_tools.bench_decoder --shape 514 1030 -n 200
+"""
+import time
+import argparse
+import cbor2
+import numpy as np
+
+from ..decoder import tag_hook, decode_image_message, peek_message_type
+from ..frame_pool import FramePool
+from .encoder import encode_image_message
+
+MIN_INT32 = np.iinfo(np.int32).min
+
+
+def make_frame(shape, rng):
+    """Poisson background with a bright spot and a few invalid (min_int32) pixels"""
+    image = rng.poisson(3, shape).astype(np.int32)
+    rr, cc = np.ogrid[:shape[0], :shape[1]]
+    image += (2000 * np.exp(-((rr - shape[0] / 2) ** 2 + (cc - shape[1] / 2) ** 2) / (2 * 30 ** 2))).astype(np.int32)
+    image.flat[rng.integers(0, image.size, 500)] = MIN_INT32
+    return image
+
+
+def legacy_decode(msg):
+    msg = cbor2.loads(msg, tag_hook=tag_hook)
+    raw_data = msg['data']['default']
+    mask = (raw_data == MIN_INT32)
+    image = raw_data.astype(np.float32).reshape(raw_data.shape)
+    image[mask] = np.nan
+    return image, msg['image_id']
+
+
+def fast_decode(msg, pool):
+    image = decode_image_message(msg)
+    frame = pool.acquire()
+    pool.fill(frame, image.data, image.image_id)
+    frame.release()
+    return frame
+
+
+def timeit(func, messages, repeat):
+    for msg in messages[:5]:
+        func(msg)  # Warm-up, first calls pay for imports and page faults
+    times = []
+    for _ in range(repeat):
+        for msg in messages:
+            t0 = time.perf_counter()
+            func(msg)
+            times.append(time.perf_counter() - t0)
+    return np.array(times) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CBOR image decode paths")
+    parser.add_argument("--shape", type=int, nargs=2, default=[514, 1030], help="Frame shape (rows cols)")
+    parser.add_argument("-n", "--frames", type=int, default=50, help="Number of distinct frames")
+    parser.add_argument("-r", "--repeat", type=int, default=4, help="Passes over the frames")
+    parser.add_argument("--extra-keys", type=int, default=20, help="Metadata entries added to each message")
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    rng = np.random.default_rng(0)
+    frames = [make_frame(shape, rng) for _ in range(args.frames)]
+    extra = {f"meta_{i}": {"value": float(i), "unit": "au"} for i in range(args.extra_keys)}
+    pool = FramePool(shape, size=2)
+
+    print(f"{'payload':<14}{'path':<22}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'MB/s':>10}")
+    for compression in ("bslz4", None):
+        messages = [encode_image_message(f, i, compression=compression, **extra) for i, f in enumerate(frames)]
+
+        # Both paths must agree before their timings mean anything
+        ref, _ = legacy_decode(messages[0])
+        assert np.array_equal(ref, fast_decode(messages[0], pool).array, equal_nan=True)
+
+        label = compression or "uncompressed"
+        for name, func in (("cbor2 + tag_hook", legacy_decode),
+                           ("fast path + pool", lambda m: fast_decode(m, pool)),
+                           ("type peek only", peek_message_type)):
+            t = timeit(func, messages, args.repeat)
+            mbps = frames[0].nbytes / 1e6 / (t.mean() / 1e3)
+            print(f"{label:<14}{name:<22}{t.mean():>10.3f}{np.percentile(t, 50):>10.3f}{np.percentile(t, 99):>10.3f}{mbps:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
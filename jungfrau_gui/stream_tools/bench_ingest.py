@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Measure the receive pipeline of the GUI against a stream, without the GUI.
+
+Runs ZmqReceiver + StreamIngest (or FrameBusIngest with --framebus) on the
+endpoint and takes frames from the latest-frame slot at the display rate,
+as the Reader does. Use with stream_replayer.py or stream_generator.py:
+
+    python -m jungfrau_gui.stream_tools.stream_replayer session -b tcp://*:4545 --speed 4 &
+    python -m jungfrau_gui.stream_tools.bench_ingest -s tcp://localhost:4545 -t 20
+"""
+import time
+import logging
+import argparse
+
+from .. import globals
+from ..zmq_receiver import ZmqReceiver
+from ..frame_bus import FrameBus
+from ..stream_ingest import StreamIngest, FrameBusIngest
+
+
+def run(endpoint, duration_s, display_hz, use_framebus=False):
+    receiver = ZmqReceiver(endpoint)
+    bus = None
+    if use_framebus:
+        bus = FrameBus(endpoint, (globals.nrow, globals.ncol))
+        bus.start()
+        ingest = FrameBusIngest(bus.name, receiver.pool)
+    else:
+        ingest = StreamIngest(receiver)
+    ingest.start()
+
+    shown = 0
+    period = 1 / display_hz
+    t_end = time.monotonic() + duration_s
+    t_report = time.monotonic() + 1
+    while time.monotonic() < t_end:
+        frame = ingest.slot.take()
+        if frame is not None:
+            shown += 1
+            frame.release()
+        if time.monotonic() >= t_report:
+            t_report += 1
+            logging.info(f"{ingest.stats}, shown {shown}")
+        time.sleep(period)
+
+    stats = ingest.stats.as_dict()
+    ingest.stop()
+    if bus is not None:
+        bus.stop()
+    elapsed = time.monotonic() - ingest.stats.started_at
+    logging.info(f"Received {stats['received'] / elapsed:.0f} Hz, decoded {stats['decoded'] / elapsed:.0f} Hz, "
+                 f"displayed {shown / duration_s:.1f} Hz, pool misses {receiver.pool.misses}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GUI receive pipeline")
+    parser.add_argument("-s", "--stream", type=str, default="tcp://localhost:4545", help="zmq stream")
+    parser.add_argument("-t", "--duration", type=float, default=10, help="Seconds to run")
+    parser.add_argument("--display-hz", type=float, default=20, help="Rate at which frames are taken, as the display timer would")
+    parser.add_argument("--framebus", action="store_true", help="Go through the shared-memory frame bus")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    run(args.stream, args.duration, args.display_hz, args.framebus)
+
+
+if __name__ == "__main__":
+    main()
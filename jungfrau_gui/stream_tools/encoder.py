@@ -0,0 +1,59 @@
+import io
+import time
+import cbor2
+import h5py
+import hdf5plugin
+import numpy as np
+
+from ..decoder import typed_array_dtypes, DECTRIS_COMPRESSION
+
+# Reverse of decoder.typed_array_dtypes, native little-endian types only
+typed_array_tags = {np.dtype(dt): tag for tag, dt in typed_array_dtypes.items() if dt.startswith("<") or tag in (64, 72)}
+
+
+def compress_bslz4(array):
+    """
+    Bitshuffle/LZ4 compress `array` in the format of Jungfraujoch 'bslz4' payloads.
+
+    The stream payload is the chunk format of the HDF5 bitshuffle filter, so
+    the array is written as a single chunk of an in-memory HDF5 file and read
+    back raw.
+    """
+    array = np.ascontiguousarray(array)
+    bio = io.BytesIO()
+    with h5py.File(bio, "w") as f:
+        ds = f.create_dataset("data", data=array, chunks=array.shape, **hdf5plugin.Bitshuffle(cname="lz4"))
+        _, chunk = ds.id.read_direct_chunk((0,) * array.ndim)
+    return chunk
+
+
+def encode_image_array(array, compression="bslz4"):
+    """Wrap an image as Jungfraujoch does: tag 40 [dims, typed array (optionally dectris compressed)]"""
+    array = np.ascontiguousarray(array)
+    tag = typed_array_tags[array.dtype]
+    if compression is None:
+        payload = array.tobytes()
+    else:
+        payload = cbor2.CBORTag(DECTRIS_COMPRESSION, [compression, array.dtype.itemsize, compress_bslz4(array)])
+    return cbor2.CBORTag(40, [list(array.shape), cbor2.CBORTag(tag, payload)])
+
+
+def encode_image_message(array, image_id, series_id=0, compression="bslz4", **extra):
+    """Serialise a CBOR image message with the fields the GUI reads, plus any `extra` metadata"""
+    msg = {
+        "type": "image",
+        "series_id": series_id,
+        "image_id": image_id,
+        "timestamp": time.time_ns() // 1000,
+        **extra,
+        "data": {"default": encode_image_array(array, compression)},
+    }
+    return cbor2.dumps(msg)
+
+
+def encode_start_message(series_id=0, **extra):
+    return cbor2.dumps({"type": "start", "series_id": series_id, **extra})
+
+
+def encode_end_message(series_id=0, **extra):
+    return cbor2.dumps({"type": "end", "series_id": series_id, **extra})
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Synthetic Jungfraujoch stream: start / image / end CBOR messages on a ZMQ PUB socket.
+
+Images are one or more beams made with utils.create_gaussian on a Poisson
+background, with hot pixels and min_int32 (invalid) / max_int32 (saturated)
+sentinels, sent either bitshuffle-LZ4 compressed (tag 56500) or as plain
+typed arrays. A bank of distinct frames is encoded once up front and cycled,
+only image_id and timestamp being patched per message, so the publish rate
+is bound by ZMQ and not by image synthesis.
+
+    python -m jungfrau_gui.stream_tools.stream_generator -b tcp://*:4545 --rate 2000 -n 20000
+"""
+import time
+import logging
+import argparse
+import numpy as np
+import zmq
+
+from ..ui_components.utils import create_gaussian
+from .encoder import encode_image_message, encode_start_message, encode_end_message
+from .stream_replayer import wait_until
+
+MIN_INT32 = np.iinfo(np.int32).min
+MAX_INT32 = np.iinfo(np.int32).max
+_PLACEHOLDER = 2**63 - 1  # Always encoded on 8 bytes, so it can be patched in place
+
+
+def synthesize_frame(shape, rng, beams, background=2.0, hot_pixels=20, invalid_pixels=200, saturated_pixels=5):
+    """
+    One int32 frame.
+
+    `beams` is a list of dicts with the arguments of create_gaussian (amplitude,
+    sigma_x, sigma_y, theta) plus the centre (xo, yo) in pixels.
+    """
+    expected = np.full(shape, background, dtype=np.float32)
+    for beam in beams:
+        half = int(4 * max(beam["sigma_x"], beam["sigma_y"])) + 1
+        patch = create_gaussian(beam["amplitude"], 2 * half + 1, 2 * half + 1, beam["sigma_x"], beam["sigma_y"], beam["theta"])
+        xo, yo = int(round(beam["xo"])), int(round(beam["yo"]))
+        # Clip the patch to the frame
+        r0, r1 = max(yo - half, 0), min(yo + half + 1, shape[0])
+        c0, c1 = max(xo - half, 0), min(xo + half + 1, shape[1])
+        if r0 < r1 and c0 < c1:
+            expected[r0:r1, c0:c1] += patch[r0 - (yo - half):r1 - (yo - half), c0 - (xo - half):c1 - (xo - half)]
+    image = rng.poisson(expected).astype(np.int32)
+    image.flat[rng.integers(0, image.size, hot_pixels)] = rng.integers(10_000, 100_000, hot_pixels)
+    image.flat[rng.integers(0, image.size, invalid_pixels)] = MIN_INT32
+    image.flat[rng.integers(0, image.size, saturated_pixels)] = MAX_INT32
+    return image
+
+
+class ImageMessageTemplate:
+    """Encoded image message whose image_id and timestamp are rewritten in place for each send."""
+    def __init__(self, image, series_id, compression):
+        msg = encode_image_message(image, _PLACEHOLDER, series_id=series_id, compression=compression, timestamp=_PLACEHOLDER)
+        self.buf = bytearray(msg)
+        marker = b"\x1b" + _PLACEHOLDER.to_bytes(8, "big")
+        self._id_at = self.buf.index(b"\x68image_id" + marker) + 10
+        self._ts_at = self.buf.index(b"\x69timestamp" + marker) + 11
+
+    def render(self, image_id, timestamp_us):
+        self.buf[self._id_at:self._id_at + 8] = image_id.to_bytes(8, "big")
+        self.buf[self._ts_at:self._ts_at + 8] = timestamp_us.to_bytes(8, "big")
+        return self.buf
+
+
+class StreamGenerator:
+    def __init__(self, endpoint="tcp://*:4545", shape=(514, 1030), bank=16, compression="bslz4",
+                 beams=None, drift_px=2.0, seed=0, hwm=1000, **frame_kwargs):
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.bind(endpoint)
+        self.shape = tuple(shape)
+        self.compression = compression
+        rng = np.random.default_rng(seed)
+        if beams is None:
+            beams = [dict(amplitude=800, sigma_x=25, sigma_y=15, theta=0.3, xo=shape[1] / 2, yo=shape[0] / 2)]
+        # Random walk of the beam centre across the bank, so a fitter sees it move
+        self.frames = []
+        for i in range(bank):
+            moved = [dict(b, xo=b["xo"] + rng.normal(0, drift_px), yo=b["yo"] + rng.normal(0, drift_px)) for b in beams]
+            self.frames.append(synthesize_frame(self.shape, rng, moved, **frame_kwargs))
+        self.series_id = 0
+        self.templates = []
+
+    def prepare(self, series_id):
+        self.series_id = series_id
+        self.templates = [ImageMessageTemplate(f, series_id, self.compression) for f in self.frames]
+
+    def run_series(self, n_images, rate_hz=0, report_s=1.0):
+        """Publish start, n_images images at rate_hz (0: as fast as possible), end. Returns (sent, elapsed)"""
+        if not self.templates:
+            self.prepare(self.series_id)
+        self.socket.send(encode_start_message(self.series_id, image_size_x=self.shape[1], image_size_y=self.shape[0],
+                                              pixel_bit_depth=32, number_of_images=n_images))
+        period = 1 / rate_hz if rate_hz > 0 else 0
+        t_begin = time.perf_counter()
+        t_report, sent_report = t_begin + report_s, 0
+        for i in range(n_images):
+            if period:
+                wait_until(t_begin + i * period)
+            msg = self.templates[i % len(self.templates)].render(i, time.time_ns() // 1000)
+            self.socket.send(msg)
+            now = time.perf_counter()
+            if now >= t_report:
+                logging.info(f"Series {self.series_id}: {i + 1}/{n_images} images, {(i + 1 - sent_report) / (now - t_report + report_s):.0f} Hz")
+                t_report, sent_report = now + report_s, i + 1
+        elapsed = time.perf_counter() - t_begin
+        self.socket.send(encode_end_message(self.series_id, number_of_images=n_images))
+        self.series_id += 1
+        self.templates = []
+        return n_images, elapsed
+
+    def close(self):
+        self.socket.close(linger=1000)
+        self.context.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish a synthetic Jungfraujoch stream")
+    parser.add_argument("-b", "--bind", type=str, default="tcp://*:4545", help="PUB endpoint to bind")
+    parser.add_argument("--shape", type=int, nargs=2, default=[514, 1030], help="Frame shape (rows cols)")
+    parser.add_argument("-n", "--images", type=int, default=10000, help="Images per series")
+    parser.add_argument("--series", type=int, default=1, help="Number of series (start ... end sequences)")
+    parser.add_argument("-r", "--rate", type=float, default=1000, help="Target image rate in Hz, 0 for as fast as possible")
+    parser.add_argument("-c", "--compression", choices=["bslz4", "none"], default="bslz4", help="Payload encoding")
+    parser.add_argument("--bank", type=int, default=16, help="Distinct frames cycled through")
+    parser.add_argument("--amplitude", type=float, default=800, help="Beam peak counts")
+    parser.add_argument("--sigma", type=float, nargs=2, default=[25, 15], help="Beam sigma_x sigma_y in pixels")
+    parser.add_argument("--theta", type=float, default=0.3, help="Beam rotation in radians")
+    parser.add_argument("--beams", type=int, default=1, help="Number of beams, spread along the frame diagonal")
+    parser.add_argument("--drift", type=float, default=2.0, help="Std of the beam centre jitter between frames (px)")
+    parser.add_argument("--background", type=float, default=2.0, help="Mean Poisson background per pixel")
+    parser.add_argument("--hot", type=int, default=20, help="Hot pixels per frame")
+    parser.add_argument("--invalid", type=int, default=200, help="min_int32 pixels per frame")
+    parser.add_argument("--saturated", type=int, default=5, help="max_int32 pixels per frame")
+    parser.add_argument("--wait", type=float, default=1.0, help="Seconds to let subscribers connect before sending")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    rows, cols = args.shape
+    beams = [dict(amplitude=args.amplitude, sigma_x=args.sigma[0], sigma_y=args.sigma[1], theta=args.theta,
+                  xo=cols * (k + 1) / (args.beams + 1), yo=rows * (k + 1) / (args.beams + 1)) for k in range(args.beams)]
+    t0 = time.perf_counter()
+    generator = StreamGenerator(args.bind, (rows, cols), args.bank, None if args.compression == "none" else args.compression,
+                                beams, args.drift, background=args.background, hot_pixels=args.hot,
+                                invalid_pixels=args.invalid, saturated_pixels=args.saturated)
+    generator.prepare(0)
+    size = np.mean([len(t.buf) for t in generator.templates])
+    logging.info(f"Prepared {args.bank} frames in {time.perf_counter() - t0:.1f} s, {size / 1e3:.0f} kB per message")
+    time.sleep(args.wait)
+    try:
+        for _ in range(args.series):
+            sent, elapsed = generator.run_series(args.images, args.rate)
+            logging.info(f"Sent {sent} images in {elapsed:.2f} s: {sent / max(elapsed, 1e-9):.0f} Hz "
+                         f"(target {args.rate:.0f} Hz), {sent * size / 1e6 / max(elapsed, 1e-9):.0f} MB/s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Record a Jungfraujoch ZMQ stream to disk, message by message.
+
+The raw CBOR messages are appended untouched to `<name>.cbor` and, for each of
+them, an index record (offset, size, arrival time in ns) to `<name>.idx`.
+Both files are append-only, so a recording cut short is still readable up to
+the last complete message. Replay with stream_replayer.py.
+
+    python -m jungfrau_gui.stream_tools.stream_recorder -s tcp://noether:5501 -o session -t 30
+"""
+import os
+import time
+import mmap
+import logging
+import argparse
+import numpy as np
+import zmq
+
+from ..decoder import peek_message_type
+
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("size", "<u8"), ("t_ns", "<i8")])
+
+
+def recording_paths(name):
+    base = os.fspath(name)
+    for ext in (".cbor", ".idx"):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base + ".cbor", base + ".idx"
+
+
+class StreamRecorder:
+    """Appends raw messages with their arrival time to a recording."""
+    def __init__(self, name):
+        self.data_path, self.index_path = recording_paths(name)
+        self._data = open(self.data_path, "ab")
+        self._index = open(self.index_path, "ab")
+        self._offset = self._data.tell()
+        self._record = np.zeros(1, dtype=INDEX_DTYPE)
+        self.count = 0
+        self.nbytes = 0
+
+    def append(self, msg, t_ns=None):
+        self._data.write(msg)
+        self._record["offset"] = self._offset
+        self._record["size"] = len(msg)
+        self._record["t_ns"] = time.time_ns() if t_ns is None else t_ns
+        self._index.write(self._record.tobytes())
+        self._offset += len(msg)
+        self.count += 1
+        self.nbytes += len(msg)
+
+    def close(self):
+        # Data first: an index record never points past the end of the data file
+        self._data.close()
+        self._index.close()
+
+
+class StreamRecording:
+    """Read access to a recording; messages are memoryviews on a memory-mapped data file."""
+    def __init__(self, name):
+        self.data_path, self.index_path = recording_paths(name)
+        index = np.fromfile(self.index_path, dtype=INDEX_DTYPE)
+        self._file = open(self.data_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # Drop index records of a message that never made it to the data file
+        self.index = index[index["offset"] + index["size"] <= size]
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        offset, size = int(self.index["offset"][i]), int(self.index["size"][i])
+        return memoryview(self._mm)[offset:offset + size]
+
+    @property
+    def arrival_ns(self):
+        return self.index["t_ns"]
+
+    @property
+    def duration_s(self):
+        return (self.index["t_ns"][-1] - self.index["t_ns"][0]) / 1e9 if len(self) > 1 else 0.0
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+
+def record(endpoint, name, max_messages=None, duration_s=None, hwm=10000):
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.RCVTIMEO, 100)
+    # Unlike the GUI, the recorder wants every message: keep a deep receive queue
+    socket.setsockopt(zmq.RCVHWM, hwm)
+    socket.connect(endpoint)
+    socket.setsockopt(zmq.SUBSCRIBE, b"")
+
+    recorder = StreamRecorder(name)
+    logging.info(f"Recording {endpoint} to {recorder.data_path}")
+    counts = {}
+    t_start = time.monotonic()
+    try:
+        while max_messages is None or recorder.count < max_messages:
+            if duration_s is not None and time.monotonic() - t_start > duration_s:
+                break
+            try:
+                msg = socket.recv(copy=False)
+            except zmq.error.Again:
+                continue
+            recorder.append(msg.buffer, time.time_ns())
+            msg_type = peek_message_type(msg.buffer)
+            counts[msg_type] = counts.get(msg_type, 0) + 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+        socket.close()
+        context.term()
+    elapsed = time.monotonic() - t_start
+    logging.info(f"Recorded {recorder.count} messages ({recorder.nbytes / 1e6:.1f} MB) in {elapsed:.1f} s: {counts}")
+    return recorder.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a Jungfraujoch ZMQ stream to an indexed file")
+    parser.add_argument("-s", "--stream", type=str, default="tcp://noether:5501", help="zmq stream")
+    parser.add_argument("-o", "--output", type=str, required=True, help="Recording name (writes <name>.cbor and <name>.idx)")
+    parser.add_argument("-n", "--messages", type=int, default=None, help="Stop after this many messages")
+    parser.add_argument("-t", "--duration", type=float, default=None, help="Stop after this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    record(args.stream, args.output, args.messages, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Replay a recording made with stream_recorder.py on a local ZMQ PUB socket.
+
+Messages are re-emitted with their original spacing, with that spacing divided
+by --speed, or back to back with --max-rate. Point the GUI (-s) or
+bench_ingest.py at the bind address.
+
+    python -m jungfrau_gui.stream_tools.stream_replayer session -b tcp://*:4545 --speed 4 --loop 10
+"""
+import time
+import logging
+import argparse
+import zmq
+
+from .stream_recorder import StreamRecording
+
+
+def wait_until(t_target):
+    """Sleep most of the way, spin the last stretch: time.sleep alone cannot hold kHz rates"""
+    remaining = t_target - time.perf_counter()
+    if remaining > 0.002:
+        time.sleep(remaining - 0.001)
+    while time.perf_counter() < t_target:
+        pass
+
+
+class StreamReplayer:
+    def __init__(self, recording, endpoint="tcp://*:4545", hwm=1000):
+        self.recording = recording
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.bind(endpoint)
+        self.endpoint = endpoint
+
+    def play(self, speed=1.0, max_rate=False, loops=1, start=0, stop=None):
+        """
+        Publish messages [start, stop) of the recording `loops` times.
+
+        Returns (messages sent, elapsed seconds). Each loop restarts the schedule, the
+        pause between the last and first message being the average message spacing.
+        """
+        stop = len(self.recording) if stop is None else min(stop, len(self.recording))
+        t_ns = self.recording.arrival_ns[start:stop]
+        if len(t_ns) == 0:
+            return 0, 0.0
+        offsets = (t_ns - t_ns[0]) / 1e9 / speed
+        spacing = offsets[-1] / max(len(offsets) - 1, 1)
+
+        sent = 0
+        t_begin = time.perf_counter()
+        t_loop = t_begin
+        for _ in range(loops):
+            for i in range(start, stop):
+                if not max_rate:
+                    wait_until(t_loop + offsets[i - start])
+                # Zero-copy: the message is a view on the memory-mapped recording
+                self.socket.send(self.recording[i], copy=False)
+                sent += 1
+            t_loop = time.perf_counter() + spacing
+        return sent, time.perf_counter() - t_begin
+
+    def close(self):
+        self.socket.close(linger=1000)
+        self.context.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded Jungfraujoch stream")
+    parser.add_argument("recording", type=str, help="Recording name (<name>.cbor / <name>.idx)")
+    parser.add_argument("-b", "--bind", type=str, default="tcp://*:4545", help="PUB endpoint to bind")
+    parser.add_argument("--speed", type=float, default=1.0, help="Rate multiplier relative to the recording")
+    parser.add_argument("--max-rate", action="store_true", help="Send as fast as possible, ignoring timestamps")
+    parser.add_argument("--loop", type=int, default=1, help="Number of passes over the recording")
+    parser.add_argument("--start", type=int, default=0, help="First message to replay")
+    parser.add_argument("--stop", type=int, default=None, help="Message to stop before")
+    parser.add_argument("--wait", type=float, default=1.0, help="Seconds to let subscribers connect before sending")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    recording = StreamRecording(args.recording)
+    original_hz = (len(recording) - 1) / recording.duration_s if recording.duration_s > 0 else float("nan")
+    logging.info(f"{len(recording)} messages over {recording.duration_s:.2f} s ({original_hz:.0f} Hz as recorded)")
+
+    replayer = StreamReplayer(recording, args.bind)
+    time.sleep(args.wait)
+    try:
+        sent, elapsed = replayer.play(args.speed, args.max_rate, args.loop, args.start, args.stop)
+        logging.info(f"Sent {sent} messages in {elapsed:.2f} s: {sent / max(elapsed, 1e-9):.0f} Hz")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replayer.close()
+        recording.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph import functions as fn
+from PySide6.QtGui import QImage
+
+from ..frame_renderer import FrameRenderer, color_table
+from ..frame_histogram import FrameHistogram
+
+
+class StreamImageItem(pg.ImageItem):
+    """
+    ImageItem that paints streamed frames from indices rendered on the reader thread.
+
+    `image` stays the float frame (hover values, fitting, snapshots), levels
+    and LUT are still driven by the HistogramLUTItem. When a frame comes with
+    a display image rendered at the current levels, render() only wraps it in
+    an Indexed8 QImage with the colour table: no per-pixel work on the GUI
+    thread. Any other case (levels changed since, plain setImage, ...) falls
+    back to the regular pyqtgraph rendering.
+
+    The histogram of a streamed frame is also computed on the reader thread
+    (FrameHistogram); it feeds both the HistogramLUTItem and contrastLevels().
+    """
+    def __init__(self, *args, **kwargs):
+        self.renderer = FrameRenderer()
+        self.histogram = FrameHistogram()
+        self._counts = None
+        self._display = None
+        self._display_levels = None
+        self._color_table = None
+        super().__init__(*args, **kwargs)
+
+    def setFrame(self, frame):
+        """Show a pooled FrameBuffer; the caller keeps it retained while it is on screen."""
+        # Attached before setImage: sigImageChanged makes the HistogramLUTItem ask for the histogram right away
+        self._display = frame.display
+        self._display_levels = frame.display_levels
+        self._counts = frame.histogram
+        super().setImage(frame.array, autoRange=False, autoLevels=False, autoHistogramRange=False)
+
+    def setImage(self, image=None, autoLevels=None, **kargs):
+        if image is not None:
+            self._display = None
+            self._counts = None
+        super().setImage(image, autoLevels, **kargs)
+
+    def setLevels(self, levels, update=True):
+        super().setLevels(levels, update)
+        if levels is not None and np.ndim(levels) == 1:
+            self.renderer.levels = (float(levels[0]), float(levels[1]))
+        else:
+            self.renderer.levels = None
+
+    def setLookupTable(self, lut, update=True):
+        self._color_table = None
+        super().setLookupTable(lut, update)
+
+    def histogramCounts(self):
+        """FrameHistogram counts of the current image, computed here only for images set without one."""
+        if self._counts is None and self.image is not None and self.image.ndim == 2:
+            self._counts = self.histogram.compute(self.image)
+        return self._counts
+
+    def getHistogram(self, bins='auto', step='auto', perChannel=False, **kwds):
+        if perChannel or bins != 'auto' or step != 'auto' or self.image is None or self.image.ndim != 2:
+            return super().getHistogram(bins, step, perChannel, **kwds)
+        return self.histogram.plot_data(self.histogramCounts())
+
+    def contrastLevels(self, quantiles=(0.01, 0.99999)):
+        """Levels at the given quantiles of the current image, from its histogram: O(bins)."""
+        counts = self.histogramCounts()
+        if counts is None:
+            return None
+        return self.histogram.percentiles(counts, quantiles)
+
+    def render(self):
+        display = self._display
+        if (display is None or self._display_levels != self.renderer.levels
+                or self.autoDownsample or self.axisOrder != 'row-major'):
+            return super().render()
+        if self._color_table is None:
+            self._color_table = color_table(self.lut, self.image)
+        qimage = fn.ndarray_to_qimage(display, QImage.Format.Format_Indexed8)
+        qimage.setColorTable(self._color_table)
+        self._processingBuffer = None
+        self._displayBuffer = None
+        self.qimage = qimage
+        self._renderRequired = False
+        self._unrenderable = False
@@ -0,0 +1,208 @@
+import os
+import logging
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from ...frame_bus import FrameBusReader, _attach
+from ... import globals
+
+from .toolbox.fit_beam_intensity import super_gaussian2d_rotated, fit_2d_gaussian_roi_NaN_fast, create_roi_coord_tuple, FitPlan
+
+
+def physical_cores():
+    """Number of physical cores (psutil), or of logical CPUs when psutil is not installed"""
+    try:
+        import psutil
+    except ImportError:
+        return os.cpu_count() or 1
+    return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+
+
+def roi_coords_of(roi):
+    """ROI as given to fit_batch, {"pos": [x, y], "size": [w, h]} or (start_row, end_row, start_col, end_col)"""
+    if isinstance(roi, dict):
+        return create_roi_coord_tuple(tuple(roi["pos"]), tuple(roi["size"]))
+    return tuple(int(v) for v in roi)
+
+
+# State of each pool process
+_pinned = {}  # Shared block of the pool with the ROIs of the batch, by name
+_plans = {}
+_MAX_PLANS = 16
+
+
+def _pinned_roi(name, offset, shape):
+    """Copy of an ROI the pool pinned at `offset` (in float32 items) of its shared block `name`"""
+    shm = _pinned.get(name)
+    if shm is None:
+        # The pool replaced its block, the previous one is no longer used
+        for old in _pinned.values():
+            old.close()
+        _pinned.clear()
+        shm = _pinned[name] = _attach(name)
+    return np.ndarray(shape, dtype=np.float32, buffer=shm.buf, offset=offset * 4).copy()
+
+
+def _plan(roi_coord, function):
+    plan = _plans.get((roi_coord, function))
+    if plan is None:
+        if len(_plans) >= _MAX_PLANS:
+            _plans.clear()
+        plan = _plans[(roi_coord, function)] = FitPlan(roi_coord, function)
+    return plan
+
+
+def _fit_task(task):
+    """
+    One fit of the pool: (roi_ref, (row, col) offset of the ROI, function, mode) -> best_values or None.
+
+    roi_ref is the ROI array a caller sent for an image off the bus, or the
+    (block name, offset, shape) of an ROI pinned in the pool's shared block.
+    """
+    roi_ref, (roi_start_row, roi_start_col), function, mode = task
+    max_int32 = np.float32(np.iinfo(np.int32).max)
+    try:
+        im_roi = roi_ref if isinstance(roi_ref, np.ndarray) else _pinned_roi(*roi_ref)
+        im_roi[im_roi >= max_int32] = np.nan  # Saturated pixels (max_int32)
+        roi_coord = (0, im_roi.shape[0] - 1, 0, im_roi.shape[1] - 1)
+        fit_result = fit_2d_gaussian_roi_NaN_fast(im_roi, roi_coord, function=function, mode=mode, plan=_plan(roi_coord, function))
+    except Exception as e:
+        logging.error(f"Beam fit pool: error during fit: {e}")
+        return None
+    # Back to full-frame coordinates
+    best_values = fit_result.best_values
+    best_values['xo'] += roi_start_col
+    best_values['yo'] += roi_start_row
+    return best_values
+
+
+class BeamFitPool:
+    """
+    Pool of beam fitting processes reading frames from the shared-memory frame bus.
+
+    fit_batch() fits a list of (frame_ref, roi) in parallel and returns the
+    best_values (None for a failed fit) in the order of the list, e.g. one
+    ROI over the last frames of a lens setting (frames_on_bus()) or several
+    beams or spots of one frame. frame_ref is a frame sequence number of the
+    bus, None for the newest frame, or a 2D array; of an array only the ROI
+    is sent to the pool. The bus keeps a few frames and overwrites them
+    within milliseconds, so the ROIs of bus frames are copied into a shared
+    block of the pool when the batch is submitted, before the processes
+    fit them; a frame already gone from the bus gives None. Each process
+    keeps its own FitPlan per ROI; the fits are independent, so the
+    throughput grows with the number of processes up to the number of
+    physical cores (the default).
+
+    The GUI does not run a pool: this is an API for scripts and tools, e.g.
+    the "pool" path of toolbox/fit_benchmark.py.
+    """
+    def __init__(self, processes=None, bus_name=None, function=super_gaussian2d_rotated, mode="fit"):
+        self.processes = processes or physical_cores()
+        self.bus_name = bus_name if bus_name is not None else globals.framebus
+        self.function = function
+        self.mode = mode
+        self.pool = None
+        self.reader = None
+        self.pinned = None  # Shared block the ROIs of bus frames are copied into
+
+    def start(self):
+        if self.pool is None:
+            logging.info(f"Starting beam fit pool with {self.processes} processes")
+            self.pool = mp.Pool(self.processes)
+            if self.bus_name:
+                self.reader = FrameBusReader(self.bus_name)
+        return self
+
+    def frames_on_bus(self, count):
+        """Sequence numbers of the last `count` frames published on the bus (those still in its ring)"""
+        if self.reader is None:
+            return []
+        head = self.reader.published
+        count = min(count, self.reader.nslots - 1, head)  # The oldest slot is the next one overwritten
+        return list(range(head - count + 1, head + 1))
+
+    def _pin(self, nbytes):
+        """The shared block, grown to hold at least `nbytes`"""
+        if self.pinned is None or self.pinned.size < nbytes:
+            size = max(nbytes, 2 * self.pinned.size if self.pinned is not None else 1 << 20)
+            self._release_pinned()
+            self.pinned = shared_memory.SharedMemory(create=True, size=size)
+        return self.pinned
+
+    def _release_pinned(self):
+        # Pool processes attached to the block keep their mapping until they see the next one
+        if self.pinned is not None:
+            self.pinned.close()
+            self.pinned.unlink()
+            self.pinned = None
+
+    def _tasks(self, tasks):
+        """Pool tasks of (frame_ref, roi), None for a frame no longer on the bus; the ROIs of bus frames are copied now"""
+        roi_tasks = []
+        on_bus = []  # (index in roi_tasks, view, ROI of the frame in shared memory)
+        for frame_ref, roi in tasks:
+            roi_start_row, roi_end_row, roi_start_col, roi_end_col = roi_coords_of(roi)
+            rows, cols = slice(roi_start_row, roi_end_row + 1), slice(roi_start_col, roi_end_col + 1)
+            origin = (roi_start_row, roi_start_col)
+            if isinstance(frame_ref, np.ndarray):
+                roi_tasks.append((np.ascontiguousarray(frame_ref[rows, cols], dtype=np.float32), origin, self.function, self.mode))
+                continue
+            view = None
+            if self.reader is None:
+                logging.error("Beam fit pool: frame reference without a frame bus")
+            else:
+                view = self.reader.latest() if frame_ref is None else self.reader.frame(frame_ref)
+                if view is None:
+                    logging.warning(f"Beam fit pool: frame #{frame_ref} no longer on the frame bus")
+            if view is not None:
+                on_bus.append((len(roi_tasks), view, view.array[rows, cols]))
+            roi_tasks.append(None)
+
+        pinned = self._pin(4 * sum(src.size for _, _, src in on_bus)) if on_bus else None
+        offset = 0
+        for k, view, src in on_bus:
+            np.copyto(np.ndarray(src.shape, dtype=np.float32, buffer=pinned.buf, offset=offset * 4), src)
+            if not self.reader.is_valid(view):
+                logging.warning(f"Beam fit pool: frame #{view.seq} overwritten while copying the ROI")
+                continue
+            roi_start_row, _, roi_start_col, _ = roi_coords_of(tasks[k][1])
+            roi_tasks[k] = ((pinned.name, offset, src.shape), (roi_start_row, roi_start_col), self.function, self.mode)
+            offset += src.size
+        return roi_tasks
+
+    def fit_batch(self, tasks, timeout=None):
+        """best_values (or None) of each (frame_ref, roi) of `tasks`, in order"""
+        if self.pool is None:
+            self.start()
+        tasks = self._tasks(tasks)
+        sent = [task for task in tasks if task is not None]
+        if not sent:
+            return [None] * len(tasks)
+        chunksize = max(1, len(sent) // (4 * self.processes))
+        try:
+            results = iter(self.pool.map_async(_fit_task, sent, chunksize).get(timeout))
+        except mp.TimeoutError:
+            self._release_pinned()  # Fits still running read it: the next batch gets a new block
+            raise
+        return [None if task is None else next(results) for task in tasks]
+
+    def stop(self):
+        if self.pool is not None:
+            logging.info("Stopping beam fit pool")
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self._release_pinned()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __str__(self) -> str:
+        return "BeamFitPool"
@@ -1,41 +1,69 @@
 import logging
-import numpy as np 
 from PySide6.QtCore import QObject, Signal, Slot
 # from line_profiler import LineProfiler
 
-from .toolbox.fit_beam_intensity import gaussian2d_rotated, super_gaussian2d_rotated, fit_2d_gaussian_roi_NaN
+from .toolbox.fit_beam_intensity import gaussian2d_rotated, super_gaussian2d_rotated, fit_2d_gaussian_roi_NaN, estimate_2d_gaussian_roi_moments, create_roi_coord_tuple, FitPlan
+from .toolbox.beam_tracker import BeamTracker
 
 class GaussianFitter(QObject):
     finished = Signal(object)
-    updateParamsSignal = Signal(object, object)
+    updateParamsSignal = Signal(object, object, object)
 
-    def __init__(self):
+    def __init__(self, mode="fit"):
         super(GaussianFitter, self).__init__()
         self.task_name = "Gaussian Fitter"
+        self.mode = mode  # "fit" (super-Gaussian fit seeded by the moments), "track" (seeded by the previous fit) or "moments" (instant estimate), see FIT_MODES
+        self.tracker = BeamTracker(super_gaussian2d_rotated)
+        self.plan = None  # FitPlan of the current ROI, dropped by invalidatePlan() when the ROI changes
         self.imageItem = None
         self.roi = None
+        self.frame = None
         self.updateParamsSignal.connect(self.updateParams)
     
-    @Slot(object, object)
-    def updateParams(self, imageItem, roi):
+    @Slot(object, object, object)
+    def updateParams(self, imageItem, roi, frame=None):
         # Thread-safe update of parameters
+        # `frame` is a retained FrameBuffer of the displayed image (None for non-streamed images),
+        # holding it keeps the pooled buffer from being refilled while the fit runs
+        self.releaseFrame()
         self.imageItem = imageItem
         self.roi = roi
+        self.frame = frame
+
+    @Slot()
+    def releaseFrame(self):
+        # The frame of an update not followed by a run, e.g. when fitting is stopped
+        if self.frame is not None:
+            self.frame.release()
+            self.frame = None
 
     @Slot()
     def run(self):
         if not self.imageItem or not self.roi:
             logging.warning("ImageItem or ROI not set.\nSetting now...")
             return
-        im = self.imageItem.image
-        roiPos = self.roi.pos()
-        roiSize = self.roi.size()
-        roi_start_row = int(np.floor(roiPos.y()))
-        roi_end_row = int(np.ceil(roiPos.y() + roiSize.y()))
-        roi_start_col = int(np.floor(roiPos.x()))
-        roi_end_col = int(np.ceil(roiPos.x() + roiSize.x()))
-        fit_result = fit_2d_gaussian_roi_NaN(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = super_gaussian2d_rotated)
+        frame, self.frame = self.frame, None
+        im = frame.array if frame is not None else self.imageItem.image
+        roi_coords = create_roi_coord_tuple(self.roi.pos(), self.roi.size())
+        roi_start_row, roi_end_row, roi_start_col, roi_end_col = roi_coords
+        plan = self.plan
+        if plan is None or not plan.matches(roi_coords, super_gaussian2d_rotated):
+            plan = self.plan = FitPlan(roi_coords, super_gaussian2d_rotated)
+        try:
+            if self.mode == "track":
+                fit_result = self.tracker.fit(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, plan = plan)
+            elif self.mode == "moments":
+                fit_result = estimate_2d_gaussian_roi_moments(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = super_gaussian2d_rotated)
+            else:
+                fit_result = fit_2d_gaussian_roi_NaN(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = super_gaussian2d_rotated, initial = "moments", plan = plan)
+        finally:
+            if frame is not None:
+                frame.release()
         self.finished.emit(fit_result.best_values)
 
+    def invalidatePlan(self):
+        # Called from the GUI thread: a fit running with the old plan keeps its own reference
+        self.plan = None
+
     def __str__(self) -> str:
         return "Gaussian Fitter"
\ No newline at end of file
@@ -1,59 +1,102 @@
+import time
 import logging
+import threading
+import itertools
 import numpy as np
 import multiprocessing as mp
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeoutError
 from PySide6.QtCore import QObject, Signal
 from line_profiler import LineProfiler
 import zmq
 import cbor2
 from ...decoder import tag_hook
+from ...frame_bus import FrameBusReader
 from ... import globals
 
-from .toolbox.fit_beam_intensity import gaussian2d_rotated, super_gaussian2d_rotated, fit_2d_gaussian_roi_NaN_fast
+from .toolbox.fit_beam_intensity import gaussian2d_rotated, super_gaussian2d_rotated, fit_2d_gaussian_roi_NaN_fast, create_roi_coord_tuple, FitPlan, roi_moments
+from .toolbox.beam_tracker import BeamTracker
+from .toolbox.settle_detector import SettleDetector
 from datetime import datetime
 
 # import globals
 
 from queue import Empty  # or multiprocessing.queues.Empty
 
-def create_roi_coord_tuple(roiPos, roiSize):
-    roi_start_row = int(np.floor(roiPos[1]))                # roi_start_row = int(np.floor(roiPos.y()))
-    roi_end_row = int(np.ceil(roiPos[1] + roiSize[1]))      # roi_end_row = int(np.ceil(roiPos.y() + roiSize.y()))
-    roi_start_col = int(np.floor(roiPos[0]))                # roi_start_col = int(np.floor(roiPos.x()))
-    roi_end_col = int(np.ceil(roiPos[0] + roiSize[0]))      # roi_end_col = int(np.ceil(roiPos.x() + roiSize.x()))
+def fit_stats(fit_result):
+    """Solver work for the worker log: start (tracking mode), iterations and function evaluations."""
+    if not hasattr(fit_result, 'njev'):
+        return ""  # lmfit result
+    start = getattr(fit_result, 'start', None)
+    start = f"{start} start, " if start else ""
+    return f" ({start}{fit_result.njev} iterations, {fit_result.nfev} evaluations)"
 
-    return (roi_start_row, roi_end_row, roi_start_col, roi_end_col)
+def _is_stale(command, discard_below):
+    """Requests cancelled on the GUI side while queued are not worth a capture"""
+    if command.get("seq", 0) < discard_below.value:
+        logging.info(f"Worker: request #{command['seq']} cancelled while queued, skipped")
+        return True
+    return False
 
-# Option A
-def _fitGaussian(input_queue, output_queue):
-    while True:
-        # task = input_queue.get()  
-        try:
-            task = input_queue.get() # Blocking call, waits for new data
-        except Exception as e:
-            logging.error("Error retrieving task from input queue: %s", e)
-            break
-           
-        if task is None:  # Sentinel for termination.
-            logging.info("Termination signal received. Exiting _fitGaussian loop.")
+def _reply(output_queue, seq, best_values=None, captured=False, settled=None):
+    """Results, and the capture notice sent before the fit, are tagged with the sequence number of their request"""
+    if captured:
+        output_queue.put({"seq": seq, "captured": True, "settled": settled})
+    else:
+        output_queue.put({"seq": seq, "best_values": best_values})
+
+def _wait_settled(next_frame, roi_of, settle):
+    """
+    Frames from next_frame() until the beam in roi_of(frame) has settled, see SettleDetector(**settle).
+
+    Returns (frame, settled): the first settled frame, or the last frame and
+    False if the detector timed out; frame is None if next_frame() had none.
+    """
+    detector = SettleDetector(**settle)
+    frame = None
+    while not detector.expired():
+        candidate = next_frame()
+        if candidate is None:
             break
-        
+        frame = candidate
         try:
-            logging.debug("Ongoing Fitting.......")
-            image_data, roiPos, roiSize = task
-            roi_coord = create_roi_coord_tuple(roiPos, roiSize)
-            logging.info(datetime.now().strftime(" START FITTING @ %H:%M:%S.%f")[:-3])
-            fit_result = fit_2d_gaussian_roi_NaN_fast(image_data, roi_coord, function=super_gaussian2d_rotated)
-            logging.info(datetime.now().strftime(" END FITTING @ %H:%M:%S.%f")[:-3])
-            output_queue.put(fit_result.best_values)
-            logging.info("Task processed. Is output queue empty? %s", output_queue.empty())
-        except Exception as e:
-            logging.error("Error during the fitting process: %s", e)
+            values = roi_moments(roi_of(frame))
+        except ValueError:
+            values = None  # No beam in the ROI (yet)
+        if detector.update(values):
+            logging.info(f"Worker: beam settled, {detector}")
+            return frame, True
+    logging.warning(f"Worker: beam not settled, taking the last frame, {detector}")
+    return frame, False
+
+def _next_zmq_image(socket, dt):
+    """Next frame of the stream with masked pixels set to NaN, None on timeout or if it is not an image"""
+    try:
+        msg = socket.recv()  # Will block up to timeout_ms
+    except zmq.error.Again as e:
+        logging.error("Worker: zmq timeout/error: %s", e)
+        return None
+    try:
+        msg = cbor2.loads(msg, tag_hook=tag_hook)
+        # Extract the image array.
+        if msg['type'] != "image":
+            return None
+        raw_data = msg['data']['default']
+        min_int32 = np.iinfo(np.int32).min
+        max_int32 = np.iinfo(np.int32).max
+        mask = (raw_data == min_int32) | (raw_data == max_int32)
+        image = raw_data.astype(dt).reshape(globals.nrow, globals.ncol)
+        image[mask] = np.nan
+        return image
+    except Exception as decode_e:
+        logging.error("Worker: error decoding frame: %s", decode_e)
+        return None
 
 # Option B
-def _capture_and_fit_worker(input_queue, output_queue, zmq_endpoint, timeout_ms, hwm, image_size, dt):
+def _capture_and_fit_worker(input_queue, output_queue, discard_below, zmq_endpoint, timeout_ms, hwm, image_size, dt):
     """
     Worker process that waits for a "CAPTURE_AND_FIT" command,
     then reads a frame from a ZeroMQ camera stream and performs the fit.
+    Replies are tagged with the "seq" of the command, see GaussianFitterMP.
     """
     logging.info("Asynchronous Gaussian Fitting process starting...")
     # Set up the ZeroMQ context and subscriber socket.
@@ -67,6 +110,8 @@ def _capture_and_fit_worker(input_queue, output_queue, zmq_endpoint, timeout_ms,
     socket.connect(zmq_endpoint)
     logging.info(f"Worker connected to ZMQ endpoint: {zmq_endpoint}")
     socket.setsockopt(zmq.SUBSCRIBE, b"")
+    tracker = BeamTracker(super_gaussian2d_rotated)  # Warm starts for mode "track"
+    plan = None  # FitPlan of the current ROI
 
     while True:
         try:
@@ -80,51 +125,54 @@ def _capture_and_fit_worker(input_queue, output_queue, zmq_endpoint, timeout_ms,
             break
 
         if isinstance(command, dict) and command.get("cmd") == "CAPTURE_AND_FIT":
+            if _is_stale(command, discard_below):
+                continue
             # Expect ROI parameters as a dictionary: {'pos': [x, y], 'size': [w, h]}
+            seq = command.get("seq", 0)
             roi_data = command.get("roi")
+            mode = command.get("mode", "fit")
             if not roi_data:
                 logging.error("Worker: missing ROI data in command.")
-                output_queue.put(None)
+                _reply(output_queue, seq)
                 continue
             try:
-                # Read a fresh frame from the ZMQ stream.
-                msg = socket.recv()  # Will block up to timeout_ms
-                try:
-                    msg = cbor2.loads(msg, tag_hook=tag_hook)
-                    # Extract the image array.
-                    if msg['type'] == "image":
-                        raw_data = msg['data']['default']
-                        min_int32 = np.iinfo(np.int32).min
-                        max_int32 = np.iinfo(np.int32).max
-                        mask = (raw_data == min_int32) | (raw_data == max_int32)
-                        image = raw_data.astype(dt).reshape(globals.nrow, globals.ncol)
-                        image[mask] = np.nan
-                        logging.info(datetime.now().strftime("FRAME CAPTURED AND MASKED @ %H:%M:%S.%f")[:-3])
-                    else:
-                        output_queue.put(None)
-                        continue
-                except Exception as decode_e:
-                    logging.error("Worker: error decoding frame: %s", decode_e)
-                    output_queue.put(None)
-                    continue
-
                 # Convert ROI parameters to a tuple for fitting.
                 # Here, roi_data is assumed to be a dict: {"pos": [x, y], "size": [w, h]}
                 roiPos = tuple(roi_data["pos"])
                 roiSize = tuple(roi_data["size"])
                 roi_coord = create_roi_coord_tuple(roiPos, roiSize)
+                roi_start_row, roi_end_row, roi_start_col, roi_end_col = roi_coord
+
+                # With CONFLATE the buffered message may predate the request (and its lens setting):
+                # drop it and wait for one received from now on
+                try:
+                    socket.recv(zmq.NOBLOCK)
+                except zmq.error.Again:
+                    pass
+                settle = command.get("settle")
+                settled = None
+                if settle:
+                    image, settled = _wait_settled(lambda: _next_zmq_image(socket, dt),
+                                                   lambda image: image[roi_start_row : roi_end_row + 1, roi_start_col : roi_end_col + 1],
+                                                   settle)
+                else:
+                    image = _next_zmq_image(socket, dt)
+                if image is None:
+                    _reply(output_queue, seq)
+                    continue
+                _reply(output_queue, seq, captured=True, settled=settled)
+                logging.info(datetime.now().strftime("FRAME CAPTURED AND MASKED @ %H:%M:%S.%f")[:-3])
+
+                if plan is None or not plan.matches(roi_coord, super_gaussian2d_rotated):
+                    plan = FitPlan(roi_coord, super_gaussian2d_rotated)
 
                 logging.info(datetime.now().strftime("WORKER START FITTING @ %H:%M:%S.%f")[:-3])
-                fit_result = fit_2d_gaussian_roi_NaN_fast(image, roi_coord, function=super_gaussian2d_rotated)
-                logging.info(datetime.now().strftime("WORKER END FITTING @ %H:%M:%S.%f")[:-3])
-                output_queue.put(fit_result.best_values)
-                logging.info(datetime.now().strftime(f"Task processed. Output queue empty? {output_queue.empty()} @ %H:%M:%S.%f")[:-3])
-            except zmq.error.Again as e:
-                logging.error("Worker: zmq timeout/error: %s", e)
-                output_queue.put(None)
+                fit_result = fit_2d_gaussian_roi_NaN_fast(image, roi_coord, function=super_gaussian2d_rotated, mode=mode, tracker=tracker, plan=plan)
+                logging.info(datetime.now().strftime(f"WORKER END FITTING #{seq} @ %H:%M:%S.%f")[:-3] + fit_stats(fit_result))
+                _reply(output_queue, seq, fit_result.best_values)
             except Exception as e:
                 logging.error("Worker: error during capture and fit: %s", e)
-                output_queue.put(None)
+                _reply(output_queue, seq)
         else:
             logging.warning("Worker: unknown command received: %s", command)
     # Cleanup the ZMQ socket and context.
@@ -132,74 +180,269 @@ def _capture_and_fit_worker(input_queue, output_queue, zmq_endpoint, timeout_ms,
     context.term()
     logging.info("Worker process terminated.")
 
+def _next_bus_roi(reader, last, sent_ns, roi_coord, timeout_s):
+    """
+    Copy of the ROI (saturated pixels NaN) of the next frame of the bus, published after frame
+    `last` and after `sent_ns`. Returns (its sequence number, the copy), or (last, None) on timeout.
+    """
+    roi_start_row, roi_end_row, roi_start_col, roi_end_col = roi_coord
+    max_int32 = np.float32(np.iinfo(np.int32).max)
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        view = reader.wait_latest(after=last, timeout=max(deadline - time.monotonic(), 0))
+        if view is None:
+            break
+        last = view.seq
+        # A queued request must not be answered with a frame of the previous lens setting
+        if view.time_ns < sent_ns:
+            continue
+        im_roi = view.array[roi_start_row : roi_end_row + 1, roi_start_col : roi_end_col + 1].copy()
+        if not reader.is_valid(view):
+            logging.warning("Worker: frame overwritten while copying the ROI, skipped")
+            continue
+        im_roi[im_roi >= max_int32] = np.nan  # Saturated pixels (max_int32)
+        return last, im_roi
+    return last, None
+
+# Option C
+def _capture_and_fit_bus_worker(input_queue, output_queue, discard_below, bus_name, timeout_ms):
+    """
+    Same protocol as Option B, but frames are taken from the shared-memory frame bus
+    the GUI already decodes into, instead of a second subscription to the stream.
+    Only the ROI is copied out of shared memory, from a frame published after the
+    request was sent ("sent_ns").
+    """
+    logging.info("Asynchronous Gaussian Fitting process starting on the frame bus...")
+    reader = FrameBusReader(bus_name)
+    last = reader.published
+    tracker = BeamTracker(super_gaussian2d_rotated)  # Warm starts for mode "track"
+    tracked_roi = None
+    plan = None  # FitPlan of the ROI copy
+
+    while True:
+        try:
+            command = input_queue.get()  # Blocking call for a new command.
+        except Exception as e:
+            logging.error("Worker: error retrieving command: %s", e)
+            break
+
+        if command is None:
+            logging.info("Worker: termination signal received. Exiting loop.")
+            break
+
+        if isinstance(command, dict) and command.get("cmd") == "CAPTURE_AND_FIT":
+            if _is_stale(command, discard_below):
+                continue
+            seq = command.get("seq", 0)
+            roi_data = command.get("roi")
+            mode = command.get("mode", "fit")
+            if not roi_data:
+                logging.error("Worker: missing ROI data in command.")
+                _reply(output_queue, seq)
+                continue
+            try:
+                roi_start_row, roi_end_row, roi_start_col, roi_end_col = create_roi_coord_tuple(tuple(roi_data["pos"]), tuple(roi_data["size"]))
+
+                def next_roi():
+                    nonlocal last
+                    last, im_roi = _next_bus_roi(reader, last, command.get("sent_ns", 0),
+                                                 (roi_start_row, roi_end_row, roi_start_col, roi_end_col), timeout_ms / 1000)
+                    return im_roi
+
+                settle = command.get("settle")
+                im_roi, settled = _wait_settled(next_roi, lambda im_roi: im_roi, settle) if settle else (next_roi(), None)
+                if im_roi is None:
+                    logging.error("Worker: no new frame on the frame bus")
+                    _reply(output_queue, seq)
+                    continue
+                _reply(output_queue, seq, captured=True, settled=settled)
+                logging.info(datetime.now().strftime("FRAME CAPTURED AND MASKED @ %H:%M:%S.%f")[:-3])
+
+                # The tracker sees ROI coordinates here: a moved ROI invalidates its previous fit
+                if tracked_roi != (roi_start_row, roi_start_col):
+                    tracker.reset()
+                    tracked_roi = (roi_start_row, roi_start_col)
+
+                roi_coord = (0, im_roi.shape[0] - 1, 0, im_roi.shape[1] - 1)
+                if plan is None or not plan.matches(roi_coord, super_gaussian2d_rotated):
+                    plan = FitPlan(roi_coord, super_gaussian2d_rotated)
+
+                logging.info(datetime.now().strftime("WORKER START FITTING @ %H:%M:%S.%f")[:-3])
+                fit_result = fit_2d_gaussian_roi_NaN_fast(im_roi, roi_coord, function=super_gaussian2d_rotated, mode=mode, tracker=tracker, plan=plan)
+                # Back to full-frame coordinates
+                fit_result.best_values['xo'] += roi_start_col
+                fit_result.best_values['yo'] += roi_start_row
+                logging.info(datetime.now().strftime(f"WORKER END FITTING #{seq} @ %H:%M:%S.%f")[:-3] + fit_stats(fit_result))
+                _reply(output_queue, seq, fit_result.best_values)
+            except Exception as e:
+                logging.error("Worker: error during capture and fit: %s", e)
+                _reply(output_queue, seq)
+        else:
+            logging.warning("Worker: unknown command received: %s", command)
+    reader.close()
+    logging.info("Worker process terminated.")
+
+class FitRequest(Future):
+    """
+    A capture-and-fit request in flight; its result is the best_values dict, or None if the
+    worker could not capture or fit.
+
+    `captured` is set once the worker holds the frame it fits, so a caller
+    may change the lens while the fit runs. `settled` is then True or False
+    when the worker waited for the beam to settle (False: it timed out and
+    took the last frame), None otherwise. Callbacks added with
+    add_done_callback() run in the collector thread of GaussianFitterMP.
+    """
+    def __init__(self, seq, roi, lens_state=None):
+        super().__init__()
+        self.seq = seq
+        self.roi = roi
+        self.lens_state = lens_state
+        self.sent_ns = time.time_ns()
+        self.captured = threading.Event()
+        self.settled = None
+
+    def __repr__(self):
+        return f"FitRequest(#{self.seq}, lens_state={self.lens_state}, done={self.done()})"
+
 class GaussianFitterMP(QObject):
     finished = Signal(object)
 
-    def __init__(self):
+    def __init__(self, mode="fit"):
         super(GaussianFitterMP, self).__init__()
         self.task_name = "GaussianFitterMP"
+        self.mode = mode  # Sent with each capture command, see FIT_MODES
         self.input_queue = mp.Queue()
         self.output_queue = mp.Queue()
         self.fitting_process = None 
+        # Requests are numbered; replies of requests no longer pending (cancelled, timed out) are dropped
+        self._seq = itertools.count(1)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._last_request = None
+        self._discard_below = mp.Value('q', 0)  # Queued requests below this number are skipped by the worker
+        self._collector = None
         # (Option B) ZMQ Parameters 
         self.zmq_endpoint = globals.stream
         self.timeout_ms = 100
         self.hwm = 1 #2
         self.image_size = (globals.nrow, globals.ncol)
         self.dt = globals.dtype
+        # (Option C) Frame bus, used instead of ZMQ when the GUI runs one
+        self.bus_name = globals.framebus
 
-    """
-    # Option A
-    def start(self):
-        logging.info("Starting Gaussian Fitting!")
-        if self.fitting_process is None or not self.fitting_process.is_alive():
-            self.fitting_process = mp.Process(target=_fitGaussian, args=(self.input_queue, self.output_queue))
-            self.fitting_process.start()
- 
-    def updateParams(self, image, roi):
-        logging.debug("Updating parameters in the processing Queue...")
-        roiPos = (roi.pos().x(), roi.pos().y())
-        roiSize = (roi.size().x(), roi.size().y())
-        self.input_queue.put((image, roiPos, roiSize))
-        logging.info(datetime.now().strftime(" UPDATED FITTER @ %H:%M:%S.%f")[:-3]) 
-    """
-
-    # Option B
+    # Option B / C
     def start(self):
         logging.info("Starting Gaussian Fitting process (capture & fit)...")
         if self.fitting_process is None or not self.fitting_process.is_alive():
-            self.fitting_process = mp.Process(
-                target=_capture_and_fit_worker,
-                args=(self.input_queue,
-                      self.output_queue,
-                      self.zmq_endpoint,
-                      self.timeout_ms,
-                      self.hwm,
-                      self.image_size,
-                      self.dt)
-            )
+            if self.bus_name:
+                self.fitting_process = mp.Process(
+                    target=_capture_and_fit_bus_worker,
+                    args=(self.input_queue,
+                          self.output_queue,
+                          self._discard_below,
+                          self.bus_name,
+                          self.timeout_ms)
+                )
+            else:
+                self.fitting_process = mp.Process(
+                    target=_capture_and_fit_worker,
+                    args=(self.input_queue,
+                          self.output_queue,
+                          self._discard_below,
+                          self.zmq_endpoint,
+                          self.timeout_ms,
+                          self.hwm,
+                          self.image_size,
+                          self.dt)
+                )
             self.fitting_process.start()
+        if self._collector is None or not self._collector.is_alive():
+            self._collector = threading.Thread(target=self._collect, name="GaussianFitterMP collector", daemon=True)
+            self._collector.start()
+
+    def _collect(self):
+        """Route the worker's replies to their FitRequest by sequence number"""
+        while True:
+            try:
+                reply = self.output_queue.get()
+            except (EOFError, OSError, ValueError):
+                break
+            if reply is None:
+                break
+            seq = reply.get("seq")
+            with self._pending_lock:
+                request = self._pending.get(seq)
+                if request is not None and not reply.get("captured"):
+                    del self._pending[seq]
+            if request is None:
+                logging.info(f"Discarding stale fit reply #{seq}")
+                continue
+            if reply.get("captured"):
+                request.settled = reply.get("settled")
+            request.captured.set()
+            if not reply.get("captured") and request.set_running_or_notify_cancel():
+                request.set_result(reply["best_values"])
 
-    def trigger_capture(self, roi):
+    def trigger_capture(self, roi, lens_state=None, settle=None, mode=None):
         '''
         Instead of passing an image, we simply send a command (with ROI parameters)
         to trigger a capture and fitting in the worker process.
         `roi` should be a dict with keys "pos" and "size", e.g.:
              {"pos": [x, y], "size": [w, h]}
+        `lens_state` is kept with the request (e.g. the lens values the frame is taken at).
+        With `settle`, a dict of SettleDetector criteria, the worker watches the
+        frames until the beam is stable (after a lens change) and fits the
+        first settled one. `mode` overrides the mode of the fitter for this
+        request, e.g. "moments" to only wait for the beam to settle.
+        Returns a FitRequest; several may be in flight.
         '''
         logging.debug("Triggering capture and fit with ROI: %s", roi)
-        self.input_queue.put({"cmd": "CAPTURE_AND_FIT", "roi": roi})
-        logging.info(datetime.now().strftime("TRIGGERED FITTER @ %H:%M:%S.%f")[:-3])
+        request = FitRequest(next(self._seq), roi, lens_state)
+        with self._pending_lock:
+            self._pending[request.seq] = request
+        self._last_request = request
+        self.input_queue.put({"cmd": "CAPTURE_AND_FIT", "seq": request.seq, "sent_ns": request.sent_ns,
+                              "roi": roi, "mode": mode or self.mode, "settle": settle})
+        logging.info(datetime.now().strftime(f"TRIGGERED FITTER #{request.seq} @ %H:%M:%S.%f")[:-3])
+        return request
 
-    def fetch_result(self):
+    def wait_result(self, request, timeout=2.0):
+        """best_values of `request`, or None if it failed or did not complete within `timeout` (it is then cancelled)"""
         try:
-            return self.output_queue.get(timeout=2.0)
-        except Empty:
-            logging.info(datetime.now().strftime(" FETCH RESULT is None @ %H:%M:%S.%f")[:-3])
+            return request.result(timeout=timeout)
+        except (FutureTimeoutError, CancelledError):
+            self.cancel(request)
+            logging.info(datetime.now().strftime(f" FETCH RESULT #{request.seq} is None @ %H:%M:%S.%f")[:-3])
             return None
 
+    def fetch_result(self, timeout=2.0):
+        """Blocking result of the last triggered request, as before FitRequest"""
+        if self._last_request is None:
+            return None
+        return self.wait_result(self._last_request, timeout)
+
+    def cancel(self, request):
+        """Drop `request`: a late reply is discarded, and the worker skips it if still queued"""
+        with self._pending_lock:
+            self._pending.pop(request.seq, None)
+            if not self._pending:
+                self._discard_below.value = max(self._discard_below.value, request.seq + 1)
+        request.cancel()
+        request.captured.set()
+
+    def cancel_pending(self):
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._discard_below.value = self._last_request.seq + 1 if self._last_request else 0
+        for request in pending:
+            request.cancel()
+            request.captured.set()
+
     def stop(self):
         logging.debug("Stopping Gaussian Fitting Process")
+        self.cancel_pending()
         if self.fitting_process is not None:
             try:
                 # Signal termination
@@ -225,6 +468,11 @@ class GaussianFitterMP(QObject):
                     break
 
         drain_queue(self.input_queue)
+        # Ends the collector thread
+        if self._collector is not None:
+            self.output_queue.put(None)
+            self._collector.join(timeout=2)
+            self._collector = None
         drain_queue(self.output_queue)
 
         try:
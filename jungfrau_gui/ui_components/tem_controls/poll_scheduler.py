@@ -0,0 +1,182 @@
+import time
+import logging
+import threading
+import numpy as np
+
+# Interval of each #info quantity, in multiples of the polling period (spin box), while it
+# changes and at most once it has not changed for a while; None = no fast polling in motion
+POLL_RATES = {
+    # query: (base, max, in motion)
+    "stage.GetPos": (1, 8, 0.2),
+    "stage.GetStatus": (1, 2, 0.2),
+    "eos.GetMagValue": (1, 4, None),
+    "eos.GetFunctionMode": (1, 4, None),
+    "defl.GetBeamBlank": (1, 4, None),
+    "stage.Getf1OverRateTxNum": (2, 8, None),
+}
+
+# Readout noise not counted as a change: nm, nm, nm, deg, deg
+POLL_TOLERANCES = {"stage.GetPos": [10, 10, 10, 0.01, 0.01]}
+
+
+class PollEntry:
+    """Schedule of one quantity"""
+    __slots__ = ("query", "base", "max", "motion", "interval_s", "due", "value", "polls", "changes")
+
+    def __init__(self, query, base, max_, motion):
+        self.query = query
+        self.base = base
+        self.max = max_
+        self.motion = motion
+        self.interval_s = None
+        self.due = 0.0  # time.monotonic(); 0 = now
+        self.value = None
+        self.polls = 0
+        self.changes = 0
+
+
+def stage_moving(status):
+    """True if GetStageStatus reports any axis moving (non-zero)"""
+    if status is None:
+        return False
+    return bool(np.any(np.asarray(status) != 0))
+
+
+class PollScheduler:
+    """
+    Which #info quantities to read at each tick of the TEM polling.
+
+    Each quantity of POLL_RATES has its own interval. It starts at `base`
+    polling periods and doubles (`backoff`) every time a read returns the
+    same value, up to `max` periods. A changed value brings it back to
+    `base`. While GetStageStatus reports motion, or a rotation is flagged
+    with set_rotating(), the stage position and status are read every
+    `motion` periods instead. force() makes quantities due at once and
+    resets their backoff, e.g. after a user action on the microscope.
+
+    due() gives the quantities to read now, update() takes the values read
+    and returns the names of those that changed, so the GUI is only
+    refreshed for a change. Thread-safe: ticks, results and user actions
+    come from different threads.
+    """
+    def __init__(self, period_s=1.0, rates=POLL_RATES, backoff=2.0):
+        self.period_s = period_s
+        self.backoff = backoff
+        self.entries = {query: PollEntry(query, *rate) for query, rate in rates.items()}
+        self.rotating = False
+        self.moving = False
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Every quantity due now at its base interval, e.g. on (re)connection"""
+        with self._lock:
+            for entry in self.entries.values():
+                entry.interval_s = entry.base * self.period_s
+                entry.due = 0.0
+
+    def set_period(self, period_s):
+        """New polling period (spin box); intervals restart from their base"""
+        self.period_s = period_s
+        self.reset()
+
+    def set_rotating(self, rotating):
+        with self._lock:
+            self.rotating = rotating
+        if rotating:
+            self.force(["stage.GetPos", "stage.GetStatus"])
+
+    @property
+    def tick_s(self):
+        """Period of the ticks asking due(), fine enough for the fastest rate"""
+        return self.period_s * min(min(e.base for e in self.entries.values()),
+                                   min((e.motion for e in self.entries.values() if e.motion is not None), default=1))
+
+    @property
+    def in_motion(self):
+        return self.moving or self.rotating
+
+    def _interval(self, entry):
+        if self.in_motion and entry.motion is not None:
+            return min(entry.interval_s, entry.motion * self.period_s)
+        return entry.interval_s
+
+    def due(self, now=None):
+        """Queries to read now"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return [q for q, entry in self.entries.items() if entry.due <= now]
+
+    def next_due_in(self, now=None):
+        """Seconds until the next quantity is due (0 if one is due)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return max(0.0, min((entry.due for entry in self.entries.values()), default=np.inf) - now)
+
+    def update(self, results, now=None):
+        """Values read {query: value} (None for a failed read); the queries whose value changed"""
+        now = time.monotonic() if now is None else now
+        changed = []
+        with self._lock:
+            if "stage.GetStatus" in results and results["stage.GetStatus"] is not None:
+                moving = stage_moving(results["stage.GetStatus"])
+                if moving != self.moving:
+                    logging.debug(f"Stage {'moving' if moving else 'stopped'}, polling position "
+                                  f"{'faster' if moving else 'at the usual rate'}")
+                self.moving = moving
+            for query, value in results.items():
+                entry = self.entries.get(query)
+                if entry is None:
+                    continue
+                entry.polls += 1
+                if value is None:
+                    # Failed read: try again soon
+                    entry.interval_s = entry.base * self.period_s
+                elif entry.value is None or not _same(value, entry.value, POLL_TOLERANCES.get(query)):
+                    entry.value = value
+                    entry.changes += 1
+                    entry.interval_s = entry.base * self.period_s
+                    changed.append(query)
+                else:
+                    entry.interval_s = min(entry.interval_s * self.backoff, entry.max * self.period_s)
+                entry.due = now + self._interval(entry)
+            if self.in_motion:
+                for entry in self.entries.values():
+                    if entry.motion is not None:
+                        entry.due = min(entry.due, now + self._interval(entry))
+        return changed
+
+    def force(self, queries=None):
+        """Make `queries` (all by default) due now, at their base interval"""
+        with self._lock:
+            for query in (self.entries if queries is None else queries):
+                entry = self.entries.get(query)
+                if entry is not None:
+                    entry.interval_s = entry.base * self.period_s
+                    entry.due = 0.0
+
+    def stats(self):
+        """Reads per quantity, and the total against reading everything every period"""
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            polls = sum(entry.polls for entry in self.entries.values())
+            return {"polls": polls,
+                    "fixed_schedule_polls": int(elapsed / self.period_s) * len(self.entries),
+                    "in_motion": self.in_motion,
+                    "queries": {q: {"polls": e.polls, "changes": e.changes, "interval_s": e.interval_s}
+                                for q, e in self.entries.items()}}
+
+    def __str__(self) -> str:
+        return "PollScheduler"
+
+
+def _same(a, b, tolerance=None):
+    if tolerance is not None:
+        try:
+            return bool(np.all(np.abs(np.asarray(a, dtype=float) - np.asarray(b, dtype=float)) <= tolerance))
+        except (TypeError, ValueError):
+            return False
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return bool(np.array_equal(a, b))
+    return a == b
@@ -0,0 +1,134 @@
+import time
+import logging
+from functools import partial
+
+
+def parse_argument(arg):
+    """Argument of a command string as the client takes it: bool, int, float or the string itself"""
+    arg = arg.strip()
+    if arg.lower() == 'true':
+        return True
+    if arg.lower() == 'false':
+        return False
+    try:
+        return float(arg) if '.' in arg else int(arg)
+    except ValueError:
+        return arg
+
+
+def parse_command(command_str):
+    """
+    Split a client command string of tools.full_mapping into (method_name, args),
+    e.g. "_send_message(GetApertureSize_CL)" -> ("_send_message", ("GetApertureSize_CL",))
+    and "GetStagePosition()" or "GetStagePosition" -> ("GetStagePosition", ()).
+    """
+    if '(' not in command_str:
+        return command_str.strip(), ()
+    method_name, arguments = command_str.split('(', 1)
+    arguments = arguments.split(')', 1)[0]
+    if not arguments.strip():
+        return method_name.strip(), ()
+    return method_name.strip(), tuple(parse_argument(arg) for arg in arguments.split(','))
+
+
+class CompiledQuery:
+    """One query of a QueryPlan: the call to make and its timing"""
+    __slots__ = ("query", "command", "method_name", "args", "call",
+                 "count", "failures", "total_s", "max_s", "last_s")
+
+    def __init__(self, query, command, method_name, args, call):
+        self.query = query  # Key of the results, e.g. "apt.GetSize(1)"
+        self.command = command  # Client command string, e.g. "_send_message(GetApertureSize_CL)"
+        self.method_name = method_name
+        self.args = args
+        self.call = call  # No-argument callable, None when the client lacks the method
+        self.count = 0
+        self.failures = 0  # Calls returning None (timeout, error) or not made
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.last_s = None
+
+    def stats(self):
+        return {"command": self.command, "count": self.count, "failures": self.failures,
+                "mean_ms": 1e3 * self.total_s / self.count if self.count else None,
+                "max_ms": 1e3 * self.max_s, "last_ms": None if self.last_s is None else 1e3 * self.last_s}
+
+
+class QueryPlan:
+    """
+    A named list of TEM queries ("#info", "#more", "#init") compiled once.
+
+    Each query of `queries` is looked up in `mapping` (tools.full_mapping),
+    its command string parsed into a method name and converted arguments,
+    and bound to `call(method_name, args)` (e.g. TEMExecutor.call). A query
+    whose method the `client` does not have is logged once and answers None.
+    run() is then only a loop over the bound callables; it times each one
+    and stats() reports the timing per query and of the whole plan.
+    """
+    def __init__(self, name, queries, mapping, call, client=None):
+        self.name = name
+        self.queries = []
+        for query in queries:
+            command = mapping[query]
+            method_name, args = parse_command(command)
+            bound = partial(call, method_name, args)
+            if client is not None and not hasattr(client, method_name):
+                logging.error(f"{name}: method '{method_name}' of {query} does not exist")
+                bound = None
+            self.queries.append(CompiledQuery(query, command, method_name, args, bound))
+        self.runs = 0
+        self.last_run_s = None
+        self.total_run_s = 0.0
+
+    def run(self, timestamps=False, only=None):
+        """
+        Make each query once (or those named in `only`); results by query name,
+        the value or, with `timestamps`, {"tst_before", "val", "tst_after"} (time.time()).
+        """
+        results = {}
+        tic_run = time.perf_counter()
+        queries = self.queries if only is None else [q for q in self.queries if q.query in only]
+        for q in queries:
+            if timestamps:
+                tst_before = time.time()
+            tic = time.perf_counter()
+            val = q.call() if q.call is not None else None
+            self._record(q, val, time.perf_counter() - tic)
+            results[q.query] = {"tst_before": tst_before, "val": val, "tst_after": time.time()} if timestamps else val
+        self.last_run_s = time.perf_counter() - tic_run
+        self.total_run_s += self.last_run_s
+        self.runs += 1
+        return results
+
+    @staticmethod
+    def _record(q, val, elapsed):
+        q.count += 1
+        q.total_s += elapsed
+        q.last_s = elapsed
+        if elapsed > q.max_s:
+            q.max_s = elapsed
+        if val is None:
+            q.failures += 1
+
+    def remove(self, query):
+        """Stop making `query`; False if the plan does not have it"""
+        for i, q in enumerate(self.queries):
+            if q.query == query:
+                del self.queries[i]
+                return True
+        return False
+
+    def __contains__(self, query):
+        return any(q.query == query for q in self.queries)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def stats(self):
+        return {"runs": self.runs,
+                "mean_ms": 1e3 * self.total_run_s / self.runs if self.runs else None,
+                "last_ms": None if self.last_run_s is None else 1e3 * self.last_run_s,
+                "queries": {q.query: q.stats() for q in self.queries}}
+
+    def __str__(self) -> str:
+        return f"QueryPlan({self.name}, {len(self.queries)} queries)"
@@ -3,6 +3,7 @@ import time
 import logging
 import numpy as np
 from .task import Task
+from ..toolbox.focus_optimizer import QuadraticFocusOptimizer, beam_variance
 
 from .... import globals
 from PySide6.QtCore import Qt, QMetaObject, Signal
@@ -12,7 +13,10 @@ from simple_tem import TEMClient
 
 IL1_0 = 21780 # 21819 
 ILS_0 = [32920, 32776] # [32820, 32976]
-WAIT_TIME_S = 0.25 # TODO: optimize value
+WAIT_TIME_S = 0.25 # Fixed wait after a lens change, when the settle detection is off or has no frames
+# Settle detection after a lens change (SettleDetector in the fitting worker), None for the fixed wait.
+# It gives up after the fixed wait it replaces, so it never makes a step slower than before.
+SETTLE_CRITERIA = {"max_shift": 0.5, "max_sigma_change": 0.02, "frames": 2, "timeout_s": WAIT_TIME_S}
 
 class AutoFocusTask(Task):
     # Signal to notify the main thread that a new best result arrived
@@ -34,11 +38,14 @@ class AutoFocusTask(Task):
                                 "ils": ILS_0, # two integers for stigmation
         }
         self.beam_fitter = self.control.beam_fitter
+        self.settle_criteria = SETTLE_CRITERIA
         self.results = []
         self.best_result = None
 
         # Fast mode
         self.rapid_mode = self.tem_action.tem_tasks.fast_autofocus_checkbox.isChecked()
+        # Joint IL1/ILs optimization with a quadratic surrogate
+        self.model_mode = self.tem_action.tem_tasks.model_autofocus_checkbox.isChecked()
 
         # Track current optimization mode
         self._current_mode = None
@@ -55,7 +62,12 @@ class AutoFocusTask(Task):
             # ----------------------
             self.beam_fitter.start()
 
-            if self.rapid_mode:
+            if self.model_mode:
+                logging.warning(" ############ MODEL-BASED MODE ############ ")
+                results = self.model_based_autofocus(init_IL1, init_stigm, time_budget)
+                print("Results of model-based focusing:")
+                print(results)
+            elif self.rapid_mode:
                 # Use the rapid optimization approach
                 logging.warning(" ############ RAPID MODE ############ ")
                 results = self.rapid_autofocus(init_IL1, init_stigm, time_budget)
@@ -92,7 +104,7 @@ class AutoFocusTask(Task):
             init_IL1: Initial IL1 value to center the search around
             range_width: Total width of the search range (init_IL1 ± range_width/2)
             num_points: Number of points to sample for fitting the parabola
-            wait_time_s: Wait time between lens adjustments
+            wait_time_s: Wait time between lens adjustments when settle detection is off
             
         Returns:
             dict: Result dictionary with optimal IL1 and metrics
@@ -149,10 +161,10 @@ class AutoFocusTask(Task):
             # Approach with hysteresis compensation ?
             # self.goto_il1_with_hysteresis_compensation(il1, margin=20)
             self.client.SetILFocus(il1)
-            time.sleep(wait_time_s)
+            self.lens_parameters["il1"] = il1
             
-            # Request fit and process result
-            fit_success = self.request_fit_and_process_result()
+            # Request fit (once the beam settled) and process result
+            fit_success = self.request_fit_and_process_result(settle=True, wait_time_s=wait_time_s)
             if not fit_success:
                 logging.warning(f"Failed to get valid fit for IL1={il1}")
                 continue
@@ -256,7 +268,7 @@ class AutoFocusTask(Task):
             init_stigm: Initial stigmation values [x, y]
             deviation: Range to search around center
             num_points: Number of points to sample in each dimension (reduced grid)
-            wait_time_s: Wait time between lens adjustments
+            wait_time_s: Wait time between lens adjustments when settle detection is off
             
         Returns:
             dict: Result dictionary with optimal stigmation values and metrics
@@ -300,10 +312,10 @@ class AutoFocusTask(Task):
             # Set stigmation with hysteresis compensation ?
             # self.goto_ils_with_hysteresis_compensation([ils_x, ils_y])
             self.client.SetILs(ils_x, ils_y)
-            time.sleep(wait_time_s)
+            self.lens_parameters["ils"] = [ils_x, ils_y]
             
-            # Request fit and process result
-            fit_success = self.request_fit_and_process_result()
+            # Request fit (once the beam settled) and process result
+            fit_success = self.request_fit_and_process_result(settle=True, wait_time_s=wait_time_s)
             if not fit_success:
                 logging.warning(f"Failed to get valid fit for ILs=[{ils_x}, {ils_y}]")
                 continue
@@ -563,15 +575,19 @@ class AutoFocusTask(Task):
             lower (int): Starting IL1 lens position
             upper (int): Ending IL1 lens position
             step (int): Increment between positions
-            wait_time_s (float, optional): Wait time after setting focus before fitting
+            wait_time_s (float, optional): Wait time after setting focus before fitting,
+                when settle detection is off (settle_criteria None)
             
         Returns:
             bool: True if sweep completes, False if interrupted
         """
         self._current_mode = "IL1_FOCUS"
+        # Fit of the previous position, running while the lens moves and settles
+        pending = None
         for il1_value in range(lower, upper, step):
             # Check if process is alive
             if not self.check_process_alive():
+                self.beam_fitter.cancel_pending()
                 return False
 
             # Set IL1 to current position
@@ -583,16 +599,15 @@ class AutoFocusTask(Task):
             iter_time = iter_end - iter_start
             logging.critical(f"SetILFocus({il1_value}) took {iter_time:.6f} seconds")
 
-            # Small wait for hardware to stabilize
-            time.sleep(wait_time_s)
-
             # Update lens_parameters so we know what was used
             self.lens_parameters["il1"] = il1_value
 
-            fit_success = self.request_fit_and_process_result()
-            if not fit_success:
-                logging.warning(f"Failed to get a valid fit for IL1={il1_value}")
+            if pending is not None and not self.collect_fit(pending):
+                logging.warning(f"Failed to get a valid fit for IL1={pending.lens_state['il1']}")
+            pending = self.submit_fit(settle=True, wait_time_s=wait_time_s)  # Captured once the beam settled
 
+        if pending is not None and not self.collect_fit(pending):
+            logging.warning(f"Failed to get a valid fit for IL1={pending.lens_state['il1']}")
         return True
     
     def sweep_stig_linear(self, init_stigm, deviation, step, wait_time_s=WAIT_TIME_S):
@@ -607,7 +622,8 @@ class AutoFocusTask(Task):
             init_stigm (list[2]): Initial stigmation values [ils_x0, ils_y0]
             deviation (int): Range around initial values to explore
             step (int): Increment between stigmation values
-            wait_time_s (float, optional): Wait time after setting stigmation
+            wait_time_s (float, optional): Wait time after setting stigmation,
+                when settle detection is off (settle_criteria None)
             
         Returns:
             bool: True if completed, False if interrupted
@@ -618,9 +634,12 @@ class AutoFocusTask(Task):
 
         logging.info("################ Start X-ILs sweep ################")
 
+        # Fit of the previous position, running while the lens moves and settles
+        pending = None
         for ils_x in range(init_stigm[0] - deviation, init_stigm[0] + deviation + step, step):
             # Check if process is alive
             if not self.check_process_alive():
+                self.beam_fitter.cancel_pending()
                 return False
             
             # Set ILs lens to the current position
@@ -632,25 +651,27 @@ class AutoFocusTask(Task):
             iter_time = iter_end - iter_start
             logging.critical(f"SetILs({ils_x}, {current_ils_y}) took {iter_time:.6f} seconds")
 
-            # Wait for the system to stabilize after setting ILs
-            time.sleep(wait_time_s)
-
             # Update dictionnary
             self.lens_parameters["ils"] = [ils_x, current_ils_y]
 
-            # Request fit and process results - skip to next iteration if it fails
-            fit_success = self.request_fit_and_process_result()
-            if not fit_success:
-                logging.warning(f"Failed to get a valid fit for ILs=[{ils_x}, {current_ils_y}]")
+            # Process the previous fit and request this one - skip to next iteration if it fails
+            if pending is not None and not self.collect_fit(pending):
+                logging.warning(f"Failed to get a valid fit for ILs={pending.lens_state['ils']}")
+            pending = self.submit_fit(settle=True, wait_time_s=wait_time_s)
+
+        if pending is not None and not self.collect_fit(pending):
+            logging.warning(f"Failed to get a valid fit for ILs={pending.lens_state['ils']}")
         
         # Store the current X stigmatism lens position (unchanged during Y-sweep)
         current_ils_x = self.lens_parameters["ils"][0]
 
         logging.info("################ Start Y-ILs sweep ################")
 
+        pending = None
         for ils_y in range(init_stigm[1] - deviation, init_stigm[1] + deviation + step, step):
             # Check if process is alive
             if not self.check_process_alive():
+                self.beam_fitter.cancel_pending()
                 return False
                 
             # Set ILs lens to the current position
@@ -662,19 +683,103 @@ class AutoFocusTask(Task):
             iter_time = iter_end - iter_start
             logging.critical(f"SetILs({current_ils_x}, {ils_y}) took {iter_time:.6f} seconds")
 
-            # Wait for the system to stabilize after setting ILs
-            time.sleep(wait_time_s)
-
             # Update dictionnary
             self.lens_parameters["ils"] = [current_ils_x, ils_y]
 
-            # Request fit and process results - skip to next iteration if it fails
-            fit_success = self.request_fit_and_process_result()
-            if not fit_success:
-                logging.warning(f"Failed to get a valid fit for ILs=[{current_ils_x}, {ils_y}]")
+            # Process the previous fit and request this one - skip to next iteration if it fails
+            if pending is not None and not self.collect_fit(pending):
+                logging.warning(f"Failed to get a valid fit for ILs={pending.lens_state['ils']}")
+            pending = self.submit_fit(settle=True, wait_time_s=wait_time_s)
 
+        if pending is not None and not self.collect_fit(pending):
+            logging.warning(f"Failed to get a valid fit for ILs={pending.lens_state['ils']}")
         return True
 
+    ##########
+    # METHOD C
+    ##########
+    def model_based_autofocus(self, init_IL1=None, init_stigm=None, time_budget_seconds=15, step=(30, 60, 60), max_evals=20):
+        """
+        Optimize focus and stigmation together with a quadratic surrogate of the beam size.
+
+        IL1, ILs x and ILs y are set jointly at the settings proposed by
+        QuadraticFocusOptimizer, which minimises sigma_x**2 + sigma_y**2 of
+        the fits; each setting depends on the previous measurements, so the
+        fits are not pipelined.
+
+        Args:
+            init_IL1: Initial IL1 value (if None, uses current value)
+            init_stigm: Initial stigmation values [x, y] (if None, uses current values)
+            time_budget_seconds: Maximum time allowed for optimization
+            step: Initial spacing of the measurements for IL1, ILs x and ILs y
+            max_evals: Maximum number of measurements
+
+        Returns:
+            dict: Best result, with the number of measurements and the time used
+        """
+        self._current_mode = "JOINT"
+        start_time = time.perf_counter()
+        logging.info("################ Starting model-based autofocus ################")
+
+        if init_IL1 is None:
+            init_IL1 = self.lens_parameters.get("il1", IL1_0)
+        if init_stigm is None:
+            init_stigm = self.lens_parameters.get("ils", ILS_0)
+        self.results = []
+        self.best_result = None
+
+        center = np.array([init_IL1, *init_stigm])
+        optimizer = QuadraticFocusOptimizer(center, step, lower=center - 4 * np.array(step),
+                                            upper=center + 4 * np.array(step), max_evals=max_evals)
+        while (setting := optimizer.ask()) is not None:
+            if not self.check_process_alive():
+                return None
+            if time.perf_counter() - start_time > time_budget_seconds:
+                logging.warning("Time budget exceeded, stopping the model-based autofocus")
+                break
+            il1, ils_x, ils_y = setting
+            self.client.SetILFocus(il1)
+            self.client.SetILs(ils_x, ils_y)
+            self.lens_parameters["il1"] = il1
+            self.lens_parameters["ils"] = [ils_x, ils_y]
+
+            request = self.submit_fit(settle=True)
+            fit_values = self.beam_fitter.wait_result(request, 2.0)
+            if fit_values is None:
+                logging.warning(f"Failed to get a valid fit for IL1={il1}, ILs=[{ils_x}, {ils_y}]")
+                optimizer.tell(setting, None)
+                continue
+            self.process_fit_results_refined(fit_values, request.lens_state)
+            optimizer.tell(setting, beam_variance(fit_values))
+            logging.info(f"Measurement {optimizer.evaluations}: IL1={il1}, ILs=[{ils_x}, {ils_y}], "
+                         f"variance={beam_variance(fit_values):.1f}, predicted={optimizer.predicted}")
+
+        result = optimizer.result
+        if result is None:
+            logging.warning("No valid measurements found")
+            return None
+        (il1, ils_x, ils_y), _ = result
+        self.best_result = next((r for r in self.results if r["il1_value"] == il1 and r["ils_value"] == [ils_x, ils_y]), None)
+
+        # Ensure we're at the optimal position
+        self.goto_il1_with_hysteresis_compensation(il1)
+        self.goto_ils_with_hysteresis_compensation([ils_x, ils_y])
+
+        elapsed_time = time.perf_counter() - start_time
+        summary = optimizer.summary(elapsed_time)
+        logging.warning(f"Model-based autofocus completed in {elapsed_time:.2f} seconds with "
+                        f"{summary['measurements']} measurements ({summary['reason']})")
+        if self.best_result is not None:
+            self.newBestResult.emit(self.best_result)
+        return {
+            "best": self.best_result,
+            "best_combined": self._best_combined,
+            "measurements": summary["measurements"],
+            "failed_measurements": summary["failed_measurements"],
+            "elapsed_time": elapsed_time,
+            "stop_reason": summary["reason"],
+        }
+
     ################
     # Common methods
     ################
@@ -702,15 +807,15 @@ class AutoFocusTask(Task):
         
         # Go to a value well below the target
         self.client.SetILFocus(target_il1 - 50)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         
         # Overshoot by a fixed amount
         self.client.SetILFocus(target_il1 + margin)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         
         # Approach the final value
         self.client.SetILFocus(target_il1)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         
         # Update stored value
         self.lens_parameters["il1"] = target_il1
@@ -729,61 +834,121 @@ class AutoFocusTask(Task):
         # X axis approach
         current_ils_y = self.lens_parameters.get("ils", [0, 0])[1]
         self.client.SetILs(ils_x - 100, current_ils_y)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         self.client.SetILs(ils_x + margin, current_ils_y)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         self.client.SetILs(ils_x, current_ils_y)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         
         # Y axis approach
         self.client.SetILs(ils_x, ils_y - 100)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         self.client.SetILs(ils_x, ils_y + margin)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         self.client.SetILs(ils_x, ils_y)
-        time.sleep(WAIT_TIME_S)
+        self.wait_settled()
         
         # Update stored value
         self.lens_parameters["ils"] = [ils_x, ils_y]
 
-    def request_fit_and_process_result(self, roi=None):
+    def current_lens_state(self):
+        return {"il1": self.lens_parameters["il1"], "ils": list(self.lens_parameters["ils"])}
+
+    def current_roi(self):
+        roi = self.tem_action.parent.roi
+        return {
+            "pos": [roi.pos().x(), roi.pos().y()],
+            "size": [roi.size().x(), roi.size().y()]
+        }
+
+    def wait_settled(self, roi=None, wait_time_s=WAIT_TIME_S):
         """
-        Request a beam fit and process the results.
-        
+        Wait after a lens change until the beam has stopped changing.
+
+        The fitting worker compares the moment estimates of consecutive
+        frames (SettleDetector with settle_criteria), at most for its
+        timeout. Sleeps `wait_time_s` instead when settle detection is off
+        or the worker has no frame.
+        """
+        if self.settle_criteria is None:
+            time.sleep(wait_time_s)
+            return
+        start = time.perf_counter()
+        request = self.beam_fitter.trigger_capture(roi or self.current_roi(), settle=self.settle_criteria, mode="moments")
+        if self.beam_fitter.wait_result(request, self.settle_criteria["timeout_s"] + 1.0) is None:
+            logging.warning("No frame to detect the beam settling, waiting a fixed time")
+            time.sleep(wait_time_s)
+            logging.info(f"Lens change waited {time.perf_counter() - start:.3f} s (settling not detected)")
+        elif request.settled:
+            logging.info(f"Lens change settled after {time.perf_counter() - start:.3f} s")
+        else:
+            logging.warning(f"Lens change not settled (timeout) after {time.perf_counter() - start:.3f} s")
+
+    def submit_fit(self, roi=None, capture_timeout_s=1.0, settle=False, wait_time_s=WAIT_TIME_S):
+        """
+        Request a beam fit at the current lens state, without waiting for the fit.
+
+        Returns once the worker has captured its frame, so the lens may move
+        on while the fit runs; collect the result with collect_fit().
+
         # Args
         roi: Optional ROI override. If None, uses the current ROI from the UI.
-            
+        settle: The lens was just changed: the worker fits the first frame after
+            the beam settled (see wait_settled), or the fit waits `wait_time_s`
+            when settle detection is off.
+        """
+        roi_data = self.current_roi() if roi is None else roi
+
+        settle_criteria = None
+        if settle and self.settle_criteria is None:
+            time.sleep(wait_time_s)
+        elif settle:
+            settle_criteria = self.settle_criteria
+            capture_timeout_s += settle_criteria["timeout_s"]
+
+        # Trigger capture & fitting in the worker process
+        request = self.beam_fitter.trigger_capture(roi_data, lens_state=self.current_lens_state(), settle=settle_criteria)
+        if not request.captured.wait(capture_timeout_s):
+            logging.warning(f"Fit request #{request.seq}: no frame captured in {capture_timeout_s} s")
+        elif request.settled is False:
+            logging.warning(f"Fit request #{request.seq}: beam not settled (timeout), fitting the last frame")
+        return request
+
+    def collect_fit(self, request, timeout_s=2.0):
+        """
+        Wait for the result of a submit_fit() request and process it with the lens state it was taken at.
+
         # Returns
         bool: True if the fit was successful, False otherwise
         """
-        if roi is None:
-            roi = self.tem_action.parent.roi
-            roi_data = {
-                "pos": [roi.pos().x(), roi.pos().y()],
-                "size": [roi.size().x(), roi.size().y()]
-            }
-        else:
-            roi_data = roi
-            
-        # Trigger capture & fitting in the worker process
-        self.beam_fitter.trigger_capture(roi_data)
-        
-        # Wait for the result (blocking in this thread only!)
-        fit_result = self.beam_fitter.fetch_result()
-        
+        fit_result = self.beam_fitter.wait_result(request, timeout_s)
+
         if fit_result is None:
-            logging.warning("No fit result arrived in time; skipping this iteration.")
+            logging.warning(f"No fit result for {request.lens_state} arrived in time; skipping this iteration.")
             return False
-        
+
         # Process the result
         # self.process_fit_results(fit_result)
-        self.process_fit_results_refined(fit_result)
-        
+        self.process_fit_results_refined(fit_result, request.lens_state)
+
         # Optionally draw fitting result on UI (uncomment if needed)
         # self.control.draw_ellipses_on_ui.emit(fit_result)
-        
+
         return True
 
+    def request_fit_and_process_result(self, roi=None, settle=False, wait_time_s=WAIT_TIME_S):
+        """
+        Request a beam fit and process the results (blocking).
+
+        # Args
+        roi: Optional ROI override. If None, uses the current ROI from the UI.
+        settle, wait_time_s: see submit_fit()
+
+        # Returns
+        bool: True if the fit was successful, False otherwise
+        """
+        return self.collect_fit(self.submit_fit(roi, settle=settle, wait_time_s=wait_time_s))
+
     def process_fit_results(self, fit_values):
         """
         Save the result, compute FOM, etc.
@@ -815,13 +980,16 @@ class AutoFocusTask(Task):
         logging.info(datetime.now().strftime(" FIT RESULTS PROCESSED @ %H:%M:%S.%f")[:-3])
         print("=============================================================================")
 
-    def process_fit_results_refined(self, fit_values):
+    def process_fit_results_refined(self, fit_values, lens_state=None):
         """
         Process fit results with separate optimization goals for IL1 and ILs.
         
         Args:
             fit_values: Dictionary with fit parameters
+            lens_state: Lens values the fitted frame was taken at (default: the current ones)
         """
+        if lens_state is None:
+            lens_state = self.current_lens_state()
         # Extract measurements
         sigma_x = float(fit_values.get("sigma_x", 0))
         sigma_y = float(fit_values.get("sigma_y", 0))
@@ -842,8 +1010,8 @@ class AutoFocusTask(Task):
         
         # Store the result
         result_dict = {
-            "il1_value": self.lens_parameters["il1"],
-            "ils_value": self.lens_parameters["ils"],
+            "il1_value": lens_state["il1"],
+            "ils_value": lens_state["ils"],
             "sigma_x": sigma_x,
             "sigma_y": sigma_y,
             "area": area,
@@ -144,7 +144,8 @@ class RecordTask(Task):
                 self.writer[0]()
                 logging.info("\033[1mAsynchronous writing of files is starting now...")
 
-            t0 = time.time()
+            history = self.control.tem_history
+            t0 = time.monotonic()
             try:
                 while self.client.is_rotating:
                     try:
@@ -152,12 +153,12 @@ class RecordTask(Task):
                             logging.warning("*Interruption request*: Stopping the rotation...")
                             send_with_retries(self.client.StopStage)
                         pos = self.client.GetStagePosition()
-                        t = time.time()
+                        t = time.monotonic()
+                        history.record({"stage.GetPos": pos}, t, source="record")
                         # difference in timers of TEM and GUI might cause small error and should be evaluated.
                         if os.access(os.path.dirname(self.log_suffix), os.W_OK):
                             logfile.write(f"{t - t0:10.6f}  {pos[3]:8.3f} deg\n")
                         logging.info(f"{t - t0:10.6f}  {pos[3]:8.3f} deg")
-                        self.rotations_angles.append([f'{t-t0:10.6f}', f'{pos[3]:8.3f}'])
                         time.sleep(0.1)
                     except Exception as e:
                         logging.error(f"Error getting stage position, skipping iteration: {e}")
@@ -167,6 +168,10 @@ class RecordTask(Task):
             except Exception as e:
                 logging.error(f"Unexpected error caught for TEMClient::is_rotating(): {e}")                
 
+            # Rotation log of the metadata: the reads of this loop only, the polling reads GetPos at its own times
+            times, positions = history.range("stage.GetPos", t0, time.monotonic(), source="record")
+            self.rotations_angles = [[f'{t-t0:10.6f}', f'{pos[3]:8.3f}'] for t, pos in zip(times, positions)]
+
             # Stop the file writing
             if self.writer is not None:
                 logging.info(" ********************  Stopping Data Collection...")
@@ -203,9 +208,11 @@ class RecordTask(Task):
                         "angle" : self.control.beam_property_fitting[2],
                         "illumination" : self.control.beam_intensity,
                     }
+                    # Newest value of every quantity read, with the entries derived by ControlWorker (e.g. eos.GetMagValue_DIFF)
+                    tem_status = {**self.control.tem_status, **self.control.tem_history.snapshot()}
                     send_with_retries(self.metadata_notifier.notify_metadata_update, 
                                         self.tem_action.visualization_panel.formatted_filename, 
-                                        self.control.tem_status, 
+                                        tem_status, 
                                         beam_property,
                                         self.rotations_angles,
                                         self.cfg.threshold,
@@ -4,6 +4,7 @@ import os
 from datetime import datetime as dt
 import numpy as np
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from PySide6.QtCore import Signal, Slot, QObject, QThread, QMetaObject, Qt, QTimer
 
@@ -26,6 +27,10 @@ import jungfrau_gui.ui_threading_helpers as thread_manager
 from .... import globals
 
 from ..gaussian_fitter_mp import GaussianFitterMP
+from ..tem_executor import TEMExecutor
+from ..query_plan import QueryPlan, parse_command
+from ..poll_scheduler import PollScheduler
+from ..tem_history import TEMHistory
 
 def on_new_best_result_in_main_thread(result_dict):
     # This runs in the main thread. We can safely update GUI elements, logs, etc.
@@ -65,6 +70,11 @@ class ControlWorker(QObject):
         super().__init__()
         self.cfg = ConfigurationClient(redis_host(), token=auth_token())
         self.client = TEMClient(globals.tem_host, 3535,  verbose=False)
+        # Queries of the polling run on persistent threads, each with its own client
+        self.tem_executor = TEMExecutor(lambda: TEMClient(globals.tem_host, 3535, verbose=False))
+        # Asynchronous "#info"/"#more"/"#init" handlers, one at a time; a poll still running is not queued again
+        self.poll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TEM poll")
+        self._pending_polls = {}
 
         self.task = Task(self, "Dummy")
         self.task_thread = QThread()
@@ -73,9 +83,16 @@ class ControlWorker(QObject):
         self.file_operations = self.tem_action.file_operations
         self.visualization_panel = self.tem_action.visualization_panel
         self.last_task: Task = None
-        self.info_queries = tools.INFO_QUERIES
-        self.more_queries = tools.MORE_QUERIES
-        self.init_queries = tools.INIT_QUERIES
+        # Polling queries compiled once into calls on the executor
+        self.query_plans = {
+            "#info": QueryPlan("#info", tools.INFO_QUERIES, tools.full_mapping, self._execute_with_timeout, self.client),
+            "#more": QueryPlan("#more", tools.MORE_QUERIES, tools.full_mapping, self._execute_with_timeout, self.client),
+            "#init": QueryPlan("#init", tools.INIT_QUERIES, tools.full_mapping, self._execute_with_timeout, self.client),
+        }
+        # Which #info quantities the periodic polling reads at each tick
+        self.poll_scheduler = PollScheduler()
+        # Every value read, with its time; tem_status keeps the latest ones for the GUI
+        self.tem_history = TEMHistory()
         
         self.setObjectName("Control Worker")
         
@@ -133,6 +150,8 @@ class ControlWorker(QObject):
         self.task, self.task_thread = thread_manager.reset_worker_and_thread(self.task, self.task_thread)
         logging.info(f"Is Task actually reset to None ? -> {self.task is None}")
 
+        self.poll_scheduler.set_rotating(False)
+        self.poll_scheduler.force()
         # Ask for a full update after the end and clean up of the task
         self.send_to_tem("#more", asynchronous=True)
 
@@ -258,6 +277,7 @@ class ControlWorker(QObject):
         else:
             task = RecordTask(self, end_angle) #, filename_suffix.as_posix())
 
+        self.poll_scheduler.set_rotating(True)
         self.start_task(task)
 
     @Slot()
@@ -279,7 +299,8 @@ class ControlWorker(QObject):
 
         self._interupt_TEM_polling_and_pause_GF()
 
-        self.beam_fitter = GaussianFitterMP()
+        # Consecutive sweep points differ little: warm-start each fit from the previous one
+        self.beam_fitter = GaussianFitterMP(mode="track")
 
         task = AutoFocusTask(self)
         
@@ -466,10 +487,11 @@ class ControlWorker(QObject):
         handler = command_map.get(message)
         if handler:
             if asynchronous:
-                # Use daemon threads to prevent hanging
-                thread = threading.Thread(target=handler, args=(asynchronous,))
-                thread.daemon = True
-                thread.start()
+                pending = self._pending_polls.get(message)
+                if pending is not None and not pending.done():
+                    logging.debug(f"{message} still running, skipped")
+                    return
+                self._pending_polls[message] = self.poll_executor.submit(handler, asynchronous)
             else:
                 handler(asynchronous)
         else:
@@ -477,6 +499,8 @@ class ControlWorker(QObject):
 
     def _handle_info_command(self, asynchronous):
         """Handle '#info' command in a worker thread."""
+        # An explicit #info reads every quantity, whatever the poll schedule
+        self.poll_scheduler.force()
         # If we have a worker, use it
         if hasattr(self.tem_action, 'tem_threads') and self.tem_action.tem_threads.get('update_worker'):
             # Invoke the worker method
@@ -485,7 +509,7 @@ class ControlWorker(QObject):
                                     Qt.QueuedConnection)
         else:
             # Fallback to old method
-            results = self.get_state_batched()
+            results = self.get_state_batched(scheduled=False)
             self.trigger_tem_update.emit(results)
 
     def _handle_more_command(self, asynchronous):
@@ -502,131 +526,64 @@ class ControlWorker(QObject):
         # Emit signal with results
         self.trigger_tem_update_init.emit(results)
 
-    def get_state_batched(self, batch_size=3):
-        """Get TEM state in batches to prevent freezes."""
-        results = {}
-        tic_loop = time.perf_counter()
-        mapping = tools.full_mapping
-        
-        # Process queries in batches to allow UI updates between batches
-        query_batches = [self.info_queries[i:i+batch_size] for i in range(0, len(self.info_queries), batch_size)]
-        
-        for batch in query_batches:
-            batch_results = {}
-            
-            # Process each query in the batch
-            for query in batch:
-                logging.debug(f"Processing command: {query}")
-                
-                # Execute command with mapped value and timeout
-                batch_results[query] = self.execute_command(mapping[query])
-            
-            # Update results with batch results
-            results.update(batch_results)
-            
-            # Short yield to allow UI updates
-            if len(query_batches) > 1:
-                time.sleep(0.001)  # Minimal sleep to allow event loop to process
-
-        toc_loop = time.perf_counter()
-        logging.debug(f"Getting #info took {toc_loop - tic_loop} seconds")
-        
+    def get_state_batched(self, scheduled=True):
+        """
+        Get TEM state (#info plan). Scheduled: only the quantities due in the
+        poll schedule are read, and only those that changed are returned.
+        """
+        plan = self.query_plans["#info"]
+        if not scheduled:
+            results = self._run_recorded(plan)
+            self.poll_scheduler.update(results)
+            logging.debug(f"Getting #info took {plan.last_run_s} seconds")
+            return results
+
+        due = self.poll_scheduler.due()
+        if not due:
+            return {}
+        results = self._run_recorded(plan, only=due)
+        changed = self.poll_scheduler.update(results)
+        logging.debug(f"Getting #info ({len(due)} due, {len(changed)} changed) took {plan.last_run_s} seconds")
+        return {query: results[query] for query in changed}
+
+    def _run_recorded(self, plan, only=None):
+        """Values of a plan run, each recorded in the history at the time of its own query"""
+        results = plan.run(timestamps=True, only=only)
+        self.tem_history.record_timed(results)
+        return {query: result["val"] for query, result in results.items()}
+
+    def get_state_detailed_batched(self):
+        """Get detailed TEM state (#more plan)."""
+        plan = self.query_plans["#more"]
+        results = plan.run(timestamps=True)
+        self.tem_history.record_timed(results)
+        # Just read: the polling does not need to read these again before their next interval
+        self.poll_scheduler.update({query: result["val"] for query, result in results.items()})
+
+        for query in ["apt.GetKind", "apt.GetPosition"]:
+            result = results.get(query)
+            if result is not None and result["val"] is None:
+                result["val"] = 0
+                # Remove failed queries at the first time
+                if self.tem_status['ht.GetHtValue_readout'] == 0 and plan.remove(query):
+                    logging.warning(f"{query} removed from query list")
+
+        logging.warning(f"Getting #more took {plan.last_run_s} seconds")
         return results
 
-    def get_state_detailed_batched(self, batch_size=3):
-        """Get detailed TEM state in batches."""
-        results = {}
-        tic_loop = time.perf_counter()
-        mapping = tools.full_mapping
-        del_items = []
-        
-        # Process queries in batches
-        query_batches = [self.more_queries[i:i+batch_size] for i in range(0, len(self.more_queries), batch_size)]
-        
-        for batch in query_batches:
-            batch_results = {}
-            
-            # Process each query in the batch
-            for query in batch:
-                # Create result structure
-                result = {
-                    "tst_before": time.time(),
-                    "val": self.execute_command(mapping[query]),
-                    "tst_after": time.time()
-                }
-                
-                # Store result
-                batch_results[query] = result
-                
-                # Check for None values
-                if result["val"] is None and query in ["apt.GetKind", "apt.GetPosition"]:
-                    del_items.append(query)
-                    result["val"] = 0
-            
-            # Update results with batch results
-            results.update(batch_results)
-            
-            # Short yield to allow UI updates
-            if len(query_batches) > 1:
-                time.sleep(0.001)
-        
-        # Remove failed queries at the first time 
-        for query in del_items:
-            if query in self.more_queries and self.tem_status['ht.GetHtValue_readout'] == 0:
-                self.more_queries.remove(query)
-                logging.warning(f"{query} removed from query list")
-
-        toc_loop = time.perf_counter()
-        logging.warning(f"Getting #more took {toc_loop - tic_loop} seconds")
-        
-        return results
+    def get_state_init_batched(self):
+        """Get initial TEM state (#init plan)."""
+        plan = self.query_plans["#init"]
+        results = plan.run(timestamps=True)
+        self.tem_history.record_timed(results)
 
-    def get_state_init_batched(self, batch_size=3):
-        """Get initial TEM state in batches."""
-        results = {}
-        tic_loop = time.perf_counter()
-        mapping = tools.full_mapping
-        del_items = []
-        
-        # Process queries in batches
-        query_batches = [self.init_queries[i:i+batch_size] for i in range(0, len(self.init_queries), batch_size)]
-        
-        for batch in query_batches:
-            batch_results = {}
-            
-            # Process each query in the batch
-            for query in batch:
-                # Create result structure
-                result = {
-                    "tst_before": time.time(),
-                    "val": self.execute_command(mapping[query]),
-                    "tst_after": time.time()
-                }
-                
-                # Store result
-                batch_results[query] = result
-                
-                # Check for None values
-                if result["val"] is None:
-                    del_items.append(query)
-            
-            # Update results with batch results
-            results.update(batch_results)
-            
-            # Short yield to allow UI updates
-            if len(query_batches) > 1:
-                time.sleep(0.001)
-        
-        # Remove failed queries at the first time 
-        for query in del_items:
-            if query in self.init_queries and self.tem_status['ht.GetHtValue_readout'] == 0:
-                self.init_queries.remove(query)
+        for query, result in results.items():
+            # Remove failed queries at the first time
+            if result["val"] is None and self.tem_status['ht.GetHtValue_readout'] == 0 and plan.remove(query):
                 logging.warning(f"{query} removed from query list")
-        
-        toc_loop = time.perf_counter()
-        logging.warning(f"Getting #init took {toc_loop - tic_loop} seconds")
 
-        return results 
+        logging.warning(f"Getting #init took {plan.last_run_s} seconds")
+        return results
 
     def execute_command(self, command_str):
         """Execute a TEM command with optimized performance."""
@@ -636,98 +593,23 @@ class ControlWorker(QObject):
             return None
             
         try:
-            # Handle methods with and without parentheses
-            if '(' in command_str:
-                # Cache frequently used operations
-                method_parts = command_str.split('(', 1)
-                method_name = method_parts[0]
-            
-                # Handle the case where there might not be a closing parenthesis
-                if ')' in method_parts[1]:
-                    arguments = method_parts[1].split(')', 1)[0]
-                else:
-                    arguments = method_parts[1]
-                
-                # Prepare arguments (only process if we have arguments)
-                if arguments.strip():
-                    # Pre-split arguments
-                    arg_list = arguments.split(',')
-                    args = []
-                    
-                    # Process each argument once with optimized type conversion
-                    for arg in arg_list:
-                        arg = arg.strip()
-                        if arg.lower() == 'true':
-                            args.append(True)
-                        elif arg.lower() == 'false':
-                            args.append(False)
-                        else:
-                            # Try numeric conversion with minimal overhead
-                            try:
-                                if '.' in arg:
-                                    args.append(float(arg))
-                                else:
-                                    args.append(int(arg))
-                            except ValueError:
-                                args.append(arg)
-                    
-                    # Convert to tuple once
-                    args = tuple(args)
-                else:
-                    args = ()
-            else:
-                # Method without arguments
-                method_name = command_str
-                args = ()
-
-            # Get method reference once (expensive operation)
-            try:
-                method = getattr(self.client, method_name)
-            except AttributeError:
+            method_name, args = parse_command(command_str)
+
+            if not hasattr(self.client, method_name):
                 logging.error(f"Method '{method_name}' does not exist")
                 return None
                 
             # Set a timeout for TEM communication
-            result = self._execute_with_timeout(method, args)
+            result = self._execute_with_timeout(method_name, args)
             return result
             
         except Exception as e:
             logging.error(f"Error executing '{command_str}': {str(e)}")
             return None
 
-    def _execute_with_timeout(self, method, args, timeout=1.0):
-        """Execute a method with a timeout to prevent UI freezes."""
-        # Create a result container
-        result_container = []
-        exception_container = []
-        
-        # Define the worker function
-        def worker():
-            try:
-                result_container.append(method(*args))
-            except Exception as e:
-                exception_container.append(e)
-        
-        # Create and start the thread
-        thread = threading.Thread(target=worker)
-        thread.daemon = True  # Allow program to exit even if thread is running
-        thread.start()
-        
-        # Wait for thread with timeout
-        thread.join(timeout)
-        
-        # Check if thread is still alive (timed out)
-        if thread.is_alive():
-            logging.warning(f"TEM command timed out: {method.__name__}")
-            return None
-        
-        # Check for exceptions
-        if exception_container:
-            logging.error(f"Error in TEM command: {str(exception_container[0])}")
-            return None
-        
-        # Return the result
-        return result_container[0] if result_container else None
+    def _execute_with_timeout(self, method_name, args, timeout=1.0):
+        """Execute a client method on the TEM executor with a timeout to prevent UI freezes."""
+        return self.tem_executor.call(method_name, args, timeout)
 
     def stop_task(self):
         if self.task:
@@ -749,6 +631,8 @@ class ControlWorker(QObject):
     @Slot()
     def shutdown(self):
         logging.info("Shutting down control")
+        self.poll_executor.shutdown(wait=False, cancel_futures=True)
+        self.tem_executor.shutdown()
         try:
             # self.client.exit_server()
             # logging.warning("TEM server is OFF")
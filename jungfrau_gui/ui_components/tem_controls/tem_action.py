@@ -54,6 +54,10 @@ class TEMAction(QObject):
         self.temConnector = None
         self.timer_tem_connexion = QTimer()
         self.timer_tem_connexion.timeout.connect(self.checkTemConnexion)
+        # Ticks of the #info polling, the quantities read at each one decided by control.poll_scheduler
+        self.timer_tem_poll = QTimer()
+        self.timer_tem_poll.timeout.connect(self.pollTemInfo)
+        self.pollWorkerReady = True
         
         # Initialization
         self.cfg = ConfigurationClient(redis_host(), token=auth_token())
@@ -239,6 +243,8 @@ class TEMAction(QObject):
             # Start timer with polling frequency
             polling_ms = self.tem_tasks.polling_frequency.value()
             self.timer_tem_connexion.start(polling_ms)
+            self.control.poll_scheduler.set_period(polling_ms / 1e3)
+            self.timer_tem_poll.setInterval(max(50, int(1e3 * self.control.poll_scheduler.tick_s)))
             
             # Get initial TEM state (non-blocking)
             QTimer.singleShot(0, lambda: self.control.send_to_tem("#init", asynchronous=True))
@@ -256,6 +262,7 @@ class TEMAction(QObject):
             
             # Stop timer first to prevent new tasks
             self.timer_tem_connexion.stop()
+            self.timer_tem_poll.stop()
             
             # Stop worker and thread
             self.parent.stopWorker(self.connect_thread, self.temConnector)
@@ -325,14 +332,24 @@ class TEMAction(QObject):
         # Enable/disable controls 
         QTimer.singleShot(0, lambda: self.enabling(tem_connected))
         
-        # Get TEM info if connected, but in a separate thread
+        # Poll TEM info while connected, in a separate thread
         if tem_connected:
             # Ensure we have a worker set up
             if not hasattr(self, 'tem_threads'):
                 self.setup_tem_update_worker()
             
-            # Use the worker to process TEM info
-            QMetaObject.invokeMethod(self.update_worker, "process_tem_info", Qt.QueuedConnection)
+            if not self.timer_tem_poll.isActive() and self.tem_tasks.connecttem_button.started:
+                self.control.poll_scheduler.reset()
+                self.timer_tem_poll.start()
+        else:
+            self.timer_tem_poll.stop()
+
+    def pollTemInfo(self):
+        """Read the TEM quantities due in the poll schedule, if any."""
+        if not self.pollWorkerReady or self.control.poll_scheduler.next_due_in() > 0:
+            return
+        self.pollWorkerReady = False
+        QMetaObject.invokeMethod(self.update_worker, "process_tem_info", Qt.QueuedConnection)
 
     def setup_tem_update_worker(self):
         """Set up a worker thread for TEM updates."""
@@ -359,8 +376,8 @@ class TEMAction(QObject):
         self.tem_threads = {'update_thread': self.update_thread, 'update_worker': self.update_worker}
 
     def on_update_finished(self):
-        """Function that does nothing, just catches the finished signal."""
-        pass
+        """The update worker is ready for the next poll."""
+        self.pollWorkerReady = True
 
     def callGetInfoTask(self):
         """Call get info task with optimizations."""
@@ -695,6 +712,7 @@ class TEMAction(QObject):
             threading.Thread(target=client.SetBeamBlank, args=(0,), daemon=True).start()
             blank_button.setText("Blank beam")
             blank_button.setStyleSheet('background-color: rgb(53, 53, 53); color: white;')
+        self.control.poll_scheduler.force(["defl.GetBeamBlank"])
 
     def toggle_screen(self):
         """Toggle screen position with error handling."""
@@ -739,6 +757,7 @@ class TEMAction(QObject):
         try:
             # Execute command in a thread to avoid blocking
             threading.Thread(target=self.control.client.Setf1OverRateTxNum, args=(idx_rot_button,), daemon=True).start()
+            self.control.poll_scheduler.force(["stage.Getf1OverRateTxNum"])
             
             # Update the local status to match what the user just selected
             self.control.tem_status["stage.Getf1OverRateTxNum"] = idx_rot_button
@@ -769,6 +788,7 @@ class TEMAction(QObject):
         try:
             # Send command once
             threading.Thread(target=self.control.client.SelectFunctionMode, args=(idx_mag_button,)).start()
+            self.control.poll_scheduler.force(["eos.GetFunctionMode", "eos.GetMagValue"])
             self.control.tem_status["eos.GetFunctionMode"] = idx_mag_button # TO_TEST: Live update
             logging.info(f"Function Mode switched to {idx_mag_button} (0=MAG, 2=Low MAG, 4=DIFF)")
         except Exception as e:
@@ -868,6 +888,7 @@ class TEMAction(QObject):
             return
         try:
             self.control.client._send_message("SetStagePosition", dif_pos[0], dif_pos[1])
+            self.control.poll_scheduler.force(["stage.GetPos", "stage.GetStatus"])
             # time.sleep(distance/1e5) # assumes speed of movement as > 100 um/s, should be updated with referring stage status!!
             logging.info(f"Moved from x:{position[0]*1e-3:6.2f} um, y:{position[1]*1e-3:6.2f} um") # debug
             logging.info(f"Moved by x:{dif_pos[0]*1e-3:6.2f} um, y:{dif_pos[1]*1e-3:6.2f} um")
@@ -7,7 +7,7 @@ from datetime import datetime
 from PySide6.QtCore import QThread, Qt, QRectF, QMetaObject, Slot, Signal, QTimer
 from PySide6.QtGui import QTransform, QFont
 from PySide6.QtWidgets import (QGroupBox, QVBoxLayout, QHBoxLayout, QLabel, QSpinBox,
-                               QDoubleSpinBox, QCheckBox, QGraphicsEllipseItem, QGraphicsRectItem)
+                               QDoubleSpinBox, QCheckBox, QComboBox, QGraphicsEllipseItem, QGraphicsRectItem)
 
 from .toolbox.plot_dialog import PlotDialog
 from .gaussian_fitter import GaussianFitter
@@ -122,6 +122,19 @@ class TemControls(QGroupBox):
         self.angle_spBx.setSingleStep(1)
         self.angle_spBx.setReadOnly(True)
         
+        self.label_fit_mode = QLabel()
+        self.label_fit_mode.setText("Fit mode")
+        self.fit_mode_combo = QComboBox()
+        self.fit_mode_combo.addItem("Full fit", "fit")
+        self.fit_mode_combo.addItem("Tracking (warm start)", "track")
+        self.fit_mode_combo.addItem("Fast (moments)", "moments")
+        self.fit_mode_combo.setToolTip("Tracking: each fit starts from the previous one, with a full fit as fallback\n"
+                                       "Fast (moments): beam estimate from the ROI moments, cheap enough to follow every displayed frame")
+        self.fit_mode_combo.currentIndexChanged.connect(self.update_fit_mode)
+        fit_mode_layout = QHBoxLayout()
+        fit_mode_layout.addWidget(self.label_fit_mode)
+        fit_mode_layout.addWidget(self.fit_mode_combo)
+
         font_big = QFont("Arial", 11)
         font_big.setBold(True)
 
@@ -165,7 +178,8 @@ class TemControls(QGroupBox):
             BeamFocus_layout.addLayout(rot_angle_layout)
 
             tem_section.addLayout(BeamFocus_layout)
-                
+
+        tem_section.addLayout(fit_mode_layout)
         tem_section.addStretch()
         self.setLayout(tem_section)
 
@@ -188,6 +202,20 @@ class TemControls(QGroupBox):
         text_color = self.palette.color(QPalette.Text).name()
         field.setStyleSheet(f"QSpinBox {{ color: {text_color}; background-color: {self.background_color}; }}")
     
+    def fit_interval(self):
+        """Fit timer period (ms): the moment estimate is cheap enough to follow the display timer"""
+        if self.fit_mode_combo.currentData() == "moments":
+            return self.parent.visualization_panel.update_interval.value()
+        return 200
+
+    def update_fit_mode(self):
+        mode = self.fit_mode_combo.currentData()
+        if self.fitter is not None:
+            self.fitter.mode = mode
+        if self.parent.timer_fit.isActive():
+            self.parent.timer_fit.setInterval(self.fit_interval())
+        logging.info(f"Beam fit mode set to '{mode}'")
+
     """ ***************************************** """
     """ Threading Version of the gaussian fitting """
     """ ***************************************** """
@@ -211,7 +239,7 @@ class TemControls(QGroupBox):
         self._fit_paused = False
         self.thread_fit = QThread()
         self.thread_fit.setObjectName("Fitter Thread")
-        self.fitter = GaussianFitter()
+        self.fitter = GaussianFitter(mode=self.fit_mode_combo.currentData())
         self.parent.threadWorkerPairs.append((self.thread_fit, self.fitter))
         self.initializeWorker(self.thread_fit, self.fitter)  # Initialize worker and fitter
         self.thread_fit.start()
@@ -221,7 +249,7 @@ class TemControls(QGroupBox):
         btn.started = True
         if self.checkbox.isChecked():
             self.showPlotDialog()
-        self.parent.timer_fit.start(200)
+        self.parent.timer_fit.start(self.fit_interval())
         if by_user:
             self.gaussian_user_forced_off = False
 
@@ -274,7 +302,7 @@ class TemControls(QGroupBox):
 
         if self.checkbox.isChecked() and self.plotDialog is not None:
             self.plotDialog.show()  # Show the previously hidden dialog
-        self.parent.timer_fit.start(200)
+        self.parent.timer_fit.start(self.fit_interval())
 
     def toggle_gaussianFit_beam(self, by_user=False, pause_only=False):
         """Toggle or pause/resume fitting using the tem_tasks button."""
@@ -297,14 +325,25 @@ class TemControls(QGroupBox):
         thread_manager.move_worker_to_thread(thread, worker)
         worker.finished.connect(self.updateFitParams)
         worker.finished.connect(self.getFitterReady)
+        # Called in the fitter thread as it ends (stop, exit): the pooled frame it may still hold goes back
+        thread.finished.connect(worker.releaseFrame, Qt.DirectConnection)
 
     def getFitterReady(self):
         self.fitterWorkerReady = True
 
     def updateWorkerParams(self, imageItem, roi):
         if self.thread_fit.isRunning():
+            # Hand the fitter its own reference on the displayed pooled frame, if any
+            frame = self.parent.visualization_panel.displayed_frame
+            if frame is not None:
+                frame.retain()
             # Emit the update signal with the new parameters
-            self.fitter.updateParamsSignal.emit(imageItem, roi)  
+            self.fitter.updateParamsSignal.emit(imageItem, roi, frame)  
+
+    def invalidateFitPlan(self):
+        """The ROI geometry changed: the fitter rebuilds its FitPlan on the next fit"""
+        if self.fitter is not None:
+            self.fitter.invalidatePlan()
 
     #@profile
     def getFitParams(self):
@@ -0,0 +1,155 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeoutError
+
+
+class TEMCall(Future):
+    """
+    A TEM client call queued in a TEMExecutor; its result is the return value of the call.
+
+    The call has to start before its `deadline` (time.monotonic()), or the
+    executor drops it; `started` and `finished` are set when it runs.
+    """
+    def __init__(self, method_name, args, timeout):
+        super().__init__()
+        self.method_name = method_name
+        self.args = args
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + timeout
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return f"TEMCall({self.method_name}{self.args}, done={self.done()})"
+
+
+class TEMExecutor:
+    """
+    Persistent threads running TEM client calls from one request queue.
+
+    Replaces a thread per call: at most `max_workers` threads, each with
+    its own client from `client_factory()`, created on first use and kept.
+    submit() returns a TEMCall future with a deadline; call() blocks until
+    the result or the deadline, like ControlWorker._execute_with_timeout
+    did. A call still queued at its deadline is dropped without reaching
+    the microscope. A call running past its deadline keeps its thread busy
+    until the server answers. It is counted as timed out and its late
+    result is discarded. A hung server therefore ties up at most
+    `max_workers` threads, never more.
+    """
+    def __init__(self, client_factory, max_workers=2, name="TEM executor"):
+        self.client_factory = client_factory
+        self.max_workers = max_workers
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._workers = []
+        self._running = {}  # Thread name -> TEMCall it runs
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self.counts = {"submitted": 0, "completed": 0, "errors": 0, "timed_out": 0, "expired": 0, "late": 0}
+        self._latency_s = 0.0  # Sum over the completed calls, submission to result
+
+    def submit(self, method_name, *args, timeout=1.0):
+        """Queue client.<method_name>(*args); returns its TEMCall"""
+        call = TEMCall(method_name, args, timeout)
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError(f"{self.name} is shut down")
+            self.counts["submitted"] += 1
+            # One more thread only while every thread is busy, up to max_workers
+            if len(self._workers) < self.max_workers and len(self._running) >= len(self._workers):
+                worker = threading.Thread(target=self._work, name=f"{self.name} {len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        self._queue.put(call)
+        return call
+
+    def call(self, method_name, args=(), timeout=1.0):
+        """Result of client.<method_name>(*args), or None if it failed or did not finish within `timeout` (logged)"""
+        call = self.submit(method_name, *args, timeout=timeout)
+        try:
+            return call.result(timeout=max(call.deadline - time.monotonic(), 0))
+        except (FutureTimeoutError, CancelledError):
+            self.timed_out(call)
+            logging.warning(f"TEM command timed out: {method_name}")
+        except Exception as e:
+            logging.error(f"Error in TEM command: {str(e)}")
+        return None
+
+    def timed_out(self, call):
+        """The caller gave up on `call`: it is dropped if still queued"""
+        with self._lock:
+            self.counts["timed_out"] += 1
+        call.cancel()
+
+    def _work(self):
+        client = None
+        thread_name = threading.current_thread().name
+        while True:
+            call = self._queue.get()
+            if call is None:
+                break
+            if time.monotonic() > call.deadline:
+                call.cancel()
+            if not call.set_running_or_notify_cancel():
+                with self._lock:
+                    self.counts["expired"] += 1
+                logging.debug(f"{call.method_name} dropped, its deadline passed while queued")
+                continue
+            with self._lock:
+                self._running[thread_name] = call
+            call.started = time.monotonic()
+            try:
+                if client is None:
+                    client = self.client_factory()
+                result = getattr(client, call.method_name)(*call.args)
+            except Exception as e:
+                call.finished = time.monotonic()
+                with self._lock:
+                    self.counts["errors"] += 1
+                call.set_exception(e)
+            else:
+                call.finished = time.monotonic()
+                with self._lock:
+                    self.counts["completed"] += 1
+                    self._latency_s += call.finished - call.submitted
+                call.set_result(result)
+            with self._lock:
+                del self._running[thread_name]
+                if call.finished > call.deadline:
+                    self.counts["late"] += 1
+            if call.finished > call.deadline:
+                logging.warning(f"TEM command {call.method_name} answered after its deadline "
+                                f"({call.finished - call.started:.2f} s), result discarded")
+
+    def hung_calls(self):
+        """Calls running past their deadline, e.g. on an unresponsive server"""
+        now = time.monotonic()
+        with self._lock:
+            return [call for call in self._running.values() if now > call.deadline]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counts)
+            stats["threads"] = len(self._workers)
+            stats["running"] = len(self._running)
+            stats["mean_latency_ms"] = 1e3 * self._latency_s / stats["completed"] if stats["completed"] else None
+        stats["hung"] = len(self.hung_calls())
+        return stats
+
+    def shutdown(self, timeout=1.0):
+        """Stop the threads once their current call returns; threads stuck on a hung server are left (daemon)"""
+        with self._lock:
+            self._shutdown = True
+            workers = list(self._workers)
+        for _ in workers:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+        logging.info(f"{self.name} stopped: {self.stats()}")
+
+    def __str__(self) -> str:
+        return "TEMExecutor"
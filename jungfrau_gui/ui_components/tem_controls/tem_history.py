@@ -0,0 +1,238 @@
+import time
+import logging
+import threading
+import numpy as np
+
+
+def monotonic_from_wall(t_wall):
+    """time.monotonic() of a time.time() timestamp (e.g. tst_before/tst_after of a query)"""
+    return time.monotonic() - (time.time() - t_wall)
+
+
+class SeriesBuffer:
+    """
+    Ring buffer of the last `capacity` (time.monotonic(), value) samples of one TEM quantity.
+
+    Numeric values (scalars or fixed-length lists such as GetStagePosition)
+    are kept in a float array of shape (capacity, width). Anything else,
+    e.g. [20000, "X", "X20k"] of GetMagValue, is kept in an object array,
+    and so is everything once a value does not fit the numeric layout.
+    Each sample carries the id of its source (0: none), see TEMHistory.
+    Samples are kept sorted by time: one older than the newest (e.g. a
+    query stamped at its mid-time, after a faster reader) is moved into
+    place, only one older than everything of a full ring is dropped. The
+    times are sorted within the two runs of the ring, so range() and at()
+    find their samples by binary search, in O(log n).
+    """
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self.t = np.empty(capacity, dtype=np.float64)
+        self.sources = np.zeros(capacity, dtype=np.int16)
+        self.values = None  # Allocated from the first value
+        self.numeric = None
+        self.integer = None  # Numeric values all read as integers (returned as int by native())
+        self.shape = None  # Shape of one numeric value, () for a scalar
+        self.head = 0  # Next slot written
+        self.count = 0
+        self.dropped = 0  # Samples older than everything of a full ring, not stored
+
+    def _allocate(self, value):
+        try:
+            array = np.asarray(value, dtype=np.float64)
+        except (TypeError, ValueError):
+            array = None
+        if array is not None and array.ndim <= 1:
+            self.numeric, self.shape = True, array.shape
+            self.integer = True
+            self.values = np.empty((self.capacity,) + self.shape, dtype=np.float64)
+        else:
+            self.numeric, self.shape = False, None
+            self.values = np.empty(self.capacity, dtype=object)
+
+    def _to_objects(self):
+        values = np.empty(self.capacity, dtype=object)
+        for i in range(self.capacity):
+            values[i] = self.values[i].tolist() if self.shape else float(self.values[i])
+        self.values, self.numeric, self.shape = values, False, None
+
+    def append(self, t, value, source=0):
+        late = self.count and t < self.t[(self.head - 1) % self.capacity]
+        if late:
+            position = self._bisect(t, 'right')  # Samples at or before t
+            if self.count == self.capacity:
+                if position == 0:
+                    self.dropped += 1
+                    return
+                position -= 1  # The oldest sample makes room
+        if self.values is None:
+            self._allocate(value)
+        if self.numeric:
+            try:
+                array = np.asarray(value, dtype=np.float64)
+            except (TypeError, ValueError):
+                array = None
+            if array is None or array.shape != self.shape:
+                self._to_objects()
+        if self.numeric:
+            self.values[self.head] = array
+            self.integer = self.integer and np.asarray(value).dtype.kind in 'biu'
+        else:
+            self.values[self.head] = value
+        self.t[self.head] = t
+        self.sources[self.head] = source
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        if late:
+            # Move the new sample back past the newer ones (a few at most)
+            for i in range(self.count - 1, position, -1):
+                self._swap(self._slot(i), self._slot(i - 1))
+
+    def _swap(self, a, b):
+        self.t[[a, b]] = self.t[[b, a]]
+        self.sources[[a, b]] = self.sources[[b, a]]
+        self.values[[a, b]] = self.values[[b, a]]
+
+    def __len__(self):
+        return self.count
+
+    def _slot(self, i):
+        """Slot of the i-th oldest sample"""
+        return (self.head - self.count + i) % self.capacity
+
+    def _runs(self):
+        """The stored samples as at most two (first slot, end slot) runs, oldest first"""
+        start = (self.head - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            return [(start, start + self.count)]
+        return [(start, self.capacity), (0, self.head)]
+
+    def _bisect(self, t, side):
+        """Number of samples with time < t (side 'left') or <= t (side 'right')"""
+        n = 0
+        for a, b in self._runs():
+            k = int(np.searchsorted(self.t[a:b], t, side=side))
+            n += k
+            if k < b - a:
+                break
+        return n
+
+    def latest(self):
+        """(t, value) of the newest sample, or None"""
+        if not self.count:
+            return None
+        return self._sample(self.count - 1)
+
+    def _sample(self, i):
+        slot = self._slot(i)
+        value = self.values[slot]
+        return float(self.t[slot]), (value.copy() if self.numeric and self.shape else value)
+
+    def native(self, value):
+        """A stored value as it was read: list or scalar, int if all reads of the series were"""
+        if not self.numeric:
+            return value
+        cast = int if self.integer else float
+        return [cast(v) for v in value] if self.shape else cast(value)
+
+    def range(self, t0=-np.inf, t1=np.inf, source=None):
+        """Times and values of the samples with t0 <= t <= t1 (of `source` only, if given), oldest first"""
+        i0, i1 = self._bisect(t0, 'left'), self._bisect(t1, 'right')
+        slots = np.array([self._slot(i) for i in range(i0, i1)], dtype=np.intp)
+        if source is not None:
+            slots = slots[self.sources[slots] == source]
+        return self.t[slots], self.values[slots]
+
+    def at(self, t):
+        """
+        Value at time t: linear interpolation between the samples around t for
+        numeric values, the last sample before t for others; the newest value
+        after the last sample; None before the first one.
+        """
+        i = self._bisect(t, 'right')
+        if i == 0:
+            return None
+        t_before, before = self._sample(i - 1)
+        if i == self.count or not self.numeric or t == t_before:
+            return before
+        t_after, after = self._sample(i)
+        w = (t - t_before) / (t_after - t_before)
+        return before + w * (after - before)
+
+
+class TEMHistory:
+    """
+    Samples of every polled TEM quantity, one SeriesBuffer per query name
+    (e.g. "stage.GetPos"), with time.monotonic() timestamps.
+
+    ControlWorker records the #info, #more and #init results here as they
+    arrive, each at the middle of its own query, and RecordTask records the
+    tilt angles it reads during a rotation with the source "record". The
+    rotation log of the metadata is the range() of that source only (evenly
+    spaced reads, whatever the polling does meanwhile), the TEM state sent
+    with the metadata is a snapshot(), and the value of any quantity at a
+    given moment is at(), without asking the microscope again. Thread-safe.
+    """
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self.series = {}
+        self.source_ids = {None: 0}
+        self._lock = threading.Lock()
+
+    def record(self, results, t=None, source=None):
+        """Values {query: value} read at monotonic time t (now by default) by `source`; None values are skipped"""
+        t = time.monotonic() if t is None else t
+        with self._lock:
+            source_id = self.source_ids.setdefault(source, len(self.source_ids))
+            for query, value in results.items():
+                if value is None:
+                    continue
+                series = self.series.get(query)
+                if series is None:
+                    series = self.series[query] = SeriesBuffer(self.capacity)
+                series.append(t, value, source_id)
+
+    def record_timed(self, response):
+        """Results with timestamps {query: {"tst_before", "val", "tst_after"}} (#more, #init), each at the middle of its query"""
+        for query, data in response.items():
+            self.record({query: data["val"]}, monotonic_from_wall(0.5 * (data["tst_before"] + data["tst_after"])))
+
+    def latest(self, query):
+        """(t, value) of the newest sample of `query`, or None"""
+        with self._lock:
+            series = self.series.get(query)
+            return series.latest() if series is not None else None
+
+    def range(self, query, t0=-np.inf, t1=np.inf, source=None):
+        """Times and values of the samples of `query` with t0 <= t <= t1, only those recorded by `source` if given"""
+        with self._lock:
+            series = self.series.get(query)
+            if series is None or source not in self.source_ids:
+                return np.empty(0), np.empty(0)
+            times, values = series.range(t0, t1, None if source is None else self.source_ids[source])
+            full = len(series) == series.capacity
+        if full and len(times) and times[0] > t0 > -np.inf:
+            logging.warning(f"History of {query} starts {times[0] - t0:.1f} s after the time asked, older samples overwritten")
+        return times, values
+
+    def at(self, query, t):
+        """Value of `query` at monotonic time t (see SeriesBuffer.at)"""
+        with self._lock:
+            series = self.series.get(query)
+            return series.at(t) if series is not None else None
+
+    def snapshot(self, t=None):
+        """{query: value} of the last sample at or before monotonic time t (the newest by default), as read"""
+        t = np.inf if t is None else t
+        state = {}
+        with self._lock:
+            for query, series in self.series.items():
+                i = series._bisect(t, 'right')
+                if i:
+                    state[query] = series.native(series._sample(i - 1)[1])
+        return state
+
+    def __contains__(self, query):
+        return query in self.series
+
+    def __str__(self) -> str:
+        return "TEMHistory"
@@ -16,11 +16,12 @@ class TemUpdateWorker(QObject):
         """Process TEM info in a separate thread."""
         try:
             logging.debug("In TemUpdateWorker::process_tem_info() -> Processing batched results")
-            # Get the state without blocking UI
+            # Get the quantities due in the poll schedule without blocking UI
             results = self.control_worker.get_state_batched()
             
-            # Emit results and finished signal
-            self.status_updated.emit(results)
+            # Emit the changed values (the GUI is not refreshed when nothing changed) and finished signal
+            if results:
+                self.status_updated.emit(results)
             self.finished.emit()
         except Exception as e:
             logging.error(f"Error in TemUpdateWorker: {e}")
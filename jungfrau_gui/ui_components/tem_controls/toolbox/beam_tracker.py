@@ -0,0 +1,127 @@
+import logging
+import numpy as np
+
+from .fit_beam_intensity import (gaussian2d_rotated, super_gaussian2d_rotated, FitPlan,
+                                 initial_guess, finalize_best_values, roi_values)
+
+
+class BeamTracker:
+    """
+    Beam fits of consecutive frames, each seeded with the previous converged result.
+
+    Between two frames of the live view or of a focus sweep the beam only
+    moves a little, so starting from the last best_values converges in a
+    few iterations where a cold start (moment estimate, see
+    fit_2d_gaussian_roi_NaN) needs several more. A warm fit is not trusted
+    and the frame is fitted again from a cold start when
+
+    - the previous centre is outside the ROI (ROI moved, beam lost),
+    - the fit is not finite,
+    - the centre moved by more than `max_shift` previous sigmas, or a sigma
+      changed by more than the fraction `max_sigma_change`,
+    - the cost per pixel grew by more than `max_cost_ratio` over the last
+      accepted fit.
+
+    The solver's `success` flag is not one of the tests: a warm fit that
+    passes them is kept even if it stopped on its iteration limit, and a
+    fit converged with parameters on their bounds (e.g. the amplitude of a
+    saturated core) is as good a seed as any.
+
+    Each result carries `start` ("warm", "cold" or "fallback") and the
+    solver's `nfev` / `njev` (iterations); the counters of the tracker keep
+    the totals. reset() forgets the previous fit.
+    """
+    def __init__(self, function=super_gaussian2d_rotated, max_shift=1.0, max_sigma_change=0.25, max_cost_ratio=4.0):
+        if function not in (gaussian2d_rotated, super_gaussian2d_rotated):
+            raise ValueError(f"BeamTracker only fits gaussian2d_rotated and super_gaussian2d_rotated, not {function.__name__}")
+        self.function = function
+        self.super_gaussian = function == super_gaussian2d_rotated
+        self.max_shift = max_shift
+        self.max_sigma_change = max_sigma_change
+        self.max_cost_ratio = max_cost_ratio
+        self.reset()
+
+    def reset(self):
+        self.previous = None  # best_values of the last accepted fit (full image, degrees)
+        self.previous_cost = None  # its cost per pixel
+        self.fits = 0
+        self.warm_fits = 0
+        self.fallbacks = 0
+        self.nfev = 0
+        self.njev = 0
+
+    def fit(self, im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, plan=None):
+        """Fit the beam in the ROI of `im`; same arguments and best_values convention as fit_2d_gaussian_roi_NaN."""
+        roi_coords = (roi_start_row, roi_end_row, roi_start_col, roi_end_col)
+        if plan is None or not plan.matches(roi_coords, self.function):
+            plan = FitPlan(roi_coords, self.function)
+        im_roi, x_clean, y_clean, z_clean = plan.prepare(im)
+        model = plan.model(x_clean, y_clean, z_clean)
+
+        result, start = None, "cold"
+        seed = self._warm_seed(im_roi, roi_start_row, roi_start_col, plan.template)
+        if seed is not None:
+            result = self._solve(model, seed)
+            if self._accept(result, roi_start_row, roi_start_col, z_clean.size):
+                start = "warm"
+                self.warm_fits += 1
+            else:
+                start = "fallback"
+                self.fallbacks += 1
+                logging.debug(f"Warm-started beam fit rejected ({result.message}), fitting from a cold start")
+                warm_nfev, warm_njev = result.nfev, result.njev
+                result = self._solve(model, initial_guess(im_roi, self.super_gaussian, "moments", plan.template))
+                # The evaluations of the rejected attempt are part of the cost of this frame
+                result.nfev += warm_nfev
+                result.njev += warm_njev
+        if result is None:
+            result = self._solve(model, initial_guess(im_roi, self.super_gaussian, "moments", plan.template))
+
+        result.start = start
+        self.fits += 1
+        self.nfev += result.nfev
+        self.njev += result.njev
+        finalize_best_values(result.best_values, roi_start_row, roi_start_col)
+        if result.success or start == "warm":
+            self.previous = dict(result.best_values)
+            self.previous_cost = result.cost / z_clean.size
+        else:
+            self.previous, self.previous_cost = None, None
+        logging.debug(f"Beam fit ({start}): {result.njev} iterations, {result.nfev} evaluations")
+        return result
+
+    def _warm_seed(self, im_roi, roi_start_row, roi_start_col, template):
+        if self.previous is None:
+            return None
+        values = roi_values(self.previous, roi_start_row, roi_start_col)
+        n_rows_roi, n_cols_roi = im_roi.shape
+        if not (0 <= values['xo'] < n_cols_roi and 0 <= values['yo'] < n_rows_roi):
+            return None
+        # Bounds as for a cold start, the seed clipped into them
+        return initial_guess(im_roi, self.super_gaussian, values, template)
+
+    def _solve(self, model, guess):
+        p0, lower, upper = zip(*(guess[name] for name in model.names))
+        return model.fit(p0, lower, upper)
+
+    def _accept(self, result, roi_start_row, roi_start_col, n_pixels):
+        if not (np.isfinite(result.cost) and all(np.isfinite(v) for v in result.best_values.values())):
+            result.message = "fit not finite"
+            return False
+        previous = roi_values(self.previous, roi_start_row, roi_start_col)
+        new = result.best_values
+        # finalize_best_values may have swapped the axes of the previous fit, compare like with like
+        sigmas_prev = sorted((previous['sigma_x'], previous['sigma_y']))
+        sigmas_new = sorted((new['sigma_x'], new['sigma_y']))
+        shift = np.hypot(new['xo'] - previous['xo'], new['yo'] - previous['yo'])
+        if shift > self.max_shift * sigmas_prev[0]:
+            result.message = f"centre moved by {shift:.1f} px"
+            return False
+        for old, fitted in zip(sigmas_prev, sigmas_new):
+            if abs(fitted - old) > self.max_sigma_change * old:
+                result.message = f"sigma changed from {old:.1f} to {fitted:.1f} px"
+                return False
+        if result.cost / n_pixels > self.max_cost_ratio * self.previous_cost:
+            result.message = "residual grew"
+            return False
+        return True
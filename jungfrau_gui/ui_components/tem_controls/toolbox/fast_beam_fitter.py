@@ -0,0 +1,175 @@
+import numpy as np
+from scipy.optimize import least_squares
+
+GAUSSIAN_PARAMS = ('amplitude', 'xo', 'yo', 'sigma_x', 'sigma_y', 'theta')
+THETA = GAUSSIAN_PARAMS.index('theta')
+SUPER_GAUSSIAN_PARAMS = GAUSSIAN_PARAMS + ('n',)
+
+
+class FastFitResult:
+    """The part of lmfit's ModelResult the GUI relies on (best_values), plus solver diagnostics."""
+    def __init__(self, best_values, nfev, njev, cost, success, message):
+        self.best_values = best_values
+        self.nfev = nfev
+        self.njev = njev
+        self.cost = cost
+        self.success = success
+        self.message = message
+
+    def __repr__(self):
+        return f"FastFitResult(nfev={self.nfev}, njev={self.njev}, cost={self.cost:.4g}, success={self.success})"
+
+
+class RotatedGaussianModel:
+    """
+    Residuals and closed-form Jacobian of the rotated (super-)Gaussian of fit_beam_intensity
+    on a fixed set of pixels:
+
+        g = amplitude * exp(-Q**(n/2)),  Q = a dx**2 + 2 b dx dy + c dy**2
+
+    with a, b, c the usual rotated-ellipse coefficients of sigma_x, sigma_y,
+    theta. `super_gaussian=False` fixes n = 2 (gaussian2d_rotated).
+    `jac_buffer`, an (nparams, npixels) array, is reused for the Jacobian
+    instead of a new one.
+    """
+    def __init__(self, x, y, z, super_gaussian=True, jac_buffer=None):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.z = np.asarray(z, dtype=np.float64)
+        self.super_gaussian = super_gaussian
+        self.names = SUPER_GAUSSIAN_PARAMS if super_gaussian else GAUSSIAN_PARAMS
+        self._cache_p = None
+        if jac_buffer is None:
+            jac_buffer = np.empty((len(self.names), self.z.size))  # One contiguous row per parameter, handed out transposed
+        self._jac = jac_buffer
+
+    def _evaluate(self, p):
+        # least_squares asks for the Jacobian at the point whose residuals it just got: share the work
+        if self._cache_p is not None and np.array_equal(p, self._cache_p):
+            return self._cache
+        amplitude, xo, yo, sx, sy, theta = p[:6]
+        n = p[6] if self.super_gaussian else 2.0
+        cos2, sin2 = np.cos(theta)**2, np.sin(theta)**2
+        sin2t, cos2t = np.sin(2 * theta), np.cos(2 * theta)
+        a = cos2 / (2 * sx**2) + sin2 / (2 * sy**2)
+        b = -sin2t / (4 * sx**2) + sin2t / (4 * sy**2)
+        c = sin2 / (2 * sx**2) + cos2 / (2 * sy**2)
+        dx = self.x - xo
+        dy = self.y - yo
+        q = a * dx * dx + 2 * b * dx * dy + c * dy * dy
+        np.maximum(q, 1e-300, out=q)  # Pixel exactly on the centre, keeps Q**(n/2 - 1) finite
+        e = q ** (n / 2)
+        shape = np.exp(-e)
+        g = amplitude * shape
+        self._cache_p = p.copy()
+        self._cache = (g, shape, dx, dy, q, e, n, (a, b, c), (cos2, sin2, sin2t, cos2t))
+        return self._cache
+
+    def residuals(self, p):
+        return self._evaluate(p)[0] - self.z
+
+    def jacobian(self, p):
+        g, shape, dx, dy, q, e, n, (a, b, c), (cos2, sin2, sin2t, cos2t) = self._evaluate(p)
+        sx, sy = p[3], p[4]
+        # dg/dQ = -g * dE/dQ
+        dg_dq = -g * (n / 2) * e / q
+        jac = self._jac
+        jac[0] = shape
+        jac[1] = dg_dq * -2 * (a * dx + b * dy)
+        jac[2] = dg_dq * -2 * (b * dx + c * dy)
+        dxx, dxy, dyy = dx * dx, 2 * dx * dy, dy * dy
+        jac[3] = dg_dq * ((-cos2 * dxx - sin2 * dyy + sin2t / 2 * dxy) / sx**3)
+        jac[4] = dg_dq * ((-sin2 * dxx - cos2 * dyy - sin2t / 2 * dxy) / sy**3)
+        da = sin2t * (1 / (2 * sy**2) - 1 / (2 * sx**2))
+        db = cos2t * (1 / (2 * sy**2) - 1 / (2 * sx**2))
+        jac[5] = dg_dq * (da * (dxx - dyy) + db * dxy)
+        if self.super_gaussian:
+            jac[6] = -g * e * np.log(q) / 2
+        return jac.T
+
+    def fit(self, p0, lower, upper, solver="lm", **kwargs):
+        """
+        Bounded least squares from p0, returns a FastFitResult.
+
+        solver="lm" is the projected Levenberg-Marquardt below, which only
+        needs the (n x n) normal equations per iteration; solver="trf" hands
+        the same residuals and Jacobian to scipy's least_squares.
+        """
+        lower = np.asarray(lower, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+        # Strictly feasible start and non-empty intervals
+        upper = np.maximum(upper, lower + 1e-9)
+        p0 = np.clip(np.asarray(p0, dtype=np.float64), lower, upper)
+        if solver == "trf":
+            kwargs.setdefault('x_scale', 'jac')
+            result = least_squares(self.residuals, p0, jac=self.jacobian, bounds=(lower, upper), method='trf', **kwargs)
+            x, nfev, njev, cost, success, message = result.x, result.nfev, result.njev, result.cost, result.success, result.message
+        else:
+            x, nfev, njev, cost, success, message = self._levenberg_marquardt(p0, lower, upper, **kwargs)
+        best_values = {name: float(v) for name, v in zip(self.names, x)}
+        return FastFitResult(best_values, nfev, njev, float(cost), success, message)
+
+    def _levenberg_marquardt(self, p, lower, upper, max_iter=100, ftol=1e-8, xtol=1e-8, gtol=1e-10):
+        """
+        Marquardt-scaled damping (Nielsen update) on the free variables, steps projected onto the bounds.
+
+        A parameter on a bound whose gradient pushes it further out is held
+        there (active): the damped normal equations are solved for the free
+        parameters only, and the gtol, ftol and xtol tests see the projected
+        gradient and step, so an optimum on a bound (e.g. the amplitude of a
+        saturated core) converges like an interior one. theta is not clipped
+        but wrapped into [-pi/2, pi/2): the model has a period of pi in
+        theta, and a clipped angle sticks to the bound when the fit has to
+        go round it.
+        """
+        lower, upper = lower.copy(), upper.copy()
+        lower[THETA], upper[THETA] = -np.inf, np.inf
+        r = self.residuals(p)
+        cost = 0.5 * r @ r
+        nfev, njev = 1, 0
+        damping, nu = 1e-3, 2.0
+        for _ in range(max_iter):
+            jac = self.jacobian(p)
+            njev += 1
+            jtj = jac.T @ jac
+            grad = jac.T @ r
+            diag = np.maximum(np.diag(jtj), 1e-12)
+            # Descent (-grad) would leave the feasible box: keep the parameter on its bound
+            active = ((p <= lower) & (grad > 0)) | ((p >= upper) & (grad < 0))
+            free = ~active
+            if np.max(np.abs(grad[free]) / np.sqrt(diag[free]), initial=0) <= gtol * max(np.sqrt(2 * cost), 1):
+                return p, nfev, njev, cost, True, "gradient below gtol"
+            jtj_free = jtj[np.ix_(free, free)]
+            while True:
+                step = np.zeros_like(p)
+                try:
+                    step[free] = np.linalg.solve(jtj_free + damping * np.diag(diag[free]), -grad[free])
+                except np.linalg.LinAlgError:
+                    step = None
+                if step is not None:
+                    p_new = np.clip(p + step, lower, upper)
+                    taken = p_new - p
+                    p_new[THETA] = (p_new[THETA] + np.pi / 2) % np.pi - np.pi / 2
+                    r_new = self.residuals(p_new)
+                    nfev += 1
+                    cost_new = 0.5 * r_new @ r_new
+                    # Gain ratio against the cost decrease predicted by the linear model
+                    predicted = -(grad @ taken) - 0.5 * taken @ (jtj @ taken)
+                    if cost_new < cost and predicted > 0:
+                        rho = (cost - cost_new) / predicted
+                        damping *= max(1 / 3, 1 - (2 * rho - 1)**3)
+                        nu = 2.0
+                        break
+                    if np.linalg.norm(taken) <= xtol * (np.linalg.norm(p) + xtol):
+                        # The projected step vanished without a decrease: p is the optimum within the bounds
+                        return p, nfev, njev, cost, True, "xtol"
+                damping *= nu
+                nu *= 2
+                if damping > 1e16 or nfev > 10 * max_iter:
+                    return p, nfev, njev, cost, False, "no further decrease of the cost"
+            converged_f = cost - cost_new <= ftol * cost
+            converged_x = np.linalg.norm(taken) <= xtol * (np.linalg.norm(p) + xtol)
+            p, r, cost = p_new, r_new, cost_new
+            if converged_f or converged_x:
+                return p, nfev, njev, cost, True, "ftol" if converged_f else "xtol"
+        return p, nfev, njev, cost, False, "maximum number of iterations reached"
@@ -7,6 +7,8 @@ from lmfit import Model, Parameters
 from scipy.interpolate import griddata
 from line_profiler import LineProfiler
 
+from .fast_beam_fitter import RotatedGaussianModel, FastFitResult, GAUSSIAN_PARAMS, SUPER_GAUSSIAN_PARAMS
+
 from .... import globals
 
 def filter_outliers(im_roi, lower_percentile=1, upper_percentile=99.99):
@@ -74,127 +76,376 @@ def super_gaussian2d_rotated(x, y, amplitude, xo, yo, sigma_x, sigma_y, theta, n
 
 def is_finite(array, sentinel = np.iinfo(np.int32).max):
     """Returns check of validity: exclude any infinite values or specified sentinel"""
-    return np.isfinite(array) & (array != sentinel)
+    # max_int32 reads 2**31 once converted to float32, so equality alone would keep saturated pixels
+    return np.isfinite(array) & (array < sentinel)
+
+FIT_MODES = ("fit", "track", "moments")  # Full nonlinear fit, fit warm-started from the previous frame (BeamTracker), or the instant moment estimate
 
-def fit_2d_gaussian_roi_NaN_fast(im, roi_coords, function = gaussian2d_rotated):
+def fit_2d_gaussian_roi_NaN_fast(im, roi_coords, function = gaussian2d_rotated, engine = "fast", mode = "fit", initial = "moments", tracker = None, plan = None):
     
     roi_start_row, roi_end_row, roi_start_col, roi_end_col = roi_coords
-    fit_result = fit_2d_gaussian_roi_NaN(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = function)
+    if mode == "track" and tracker is not None:
+        return tracker.fit(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, plan = plan)
+    if mode == "moments":
+        return estimate_2d_gaussian_roi_moments(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = function)
+    fit_result = fit_2d_gaussian_roi_NaN(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = function, engine = engine, initial = initial, plan = plan)
     return fit_result
 
-def fit_2d_gaussian_roi_NaN(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = gaussian2d_rotated):
-    """Fit a rotated 2D Gaussian to an ROI of `im`, ignoring NaN (masked) pixels."""
-    # Extract the ROI
+def create_roi_coord_tuple(roiPos, roiSize):
+    """(roi_start_row, roi_end_row, roi_start_col, roi_end_col) of an ROI given as (x, y) position and (w, h) size"""
+    roi_start_row = int(np.floor(roiPos[1]))
+    roi_end_row = int(np.ceil(roiPos[1] + roiSize[1]))
+    roi_start_col = int(np.floor(roiPos[0]))
+    roi_end_col = int(np.ceil(roiPos[0] + roiSize[0]))
+    return (roi_start_row, roi_end_row, roi_start_col, roi_end_col)
+
+class FitPlan:
+    """
+    The part of a fit that only depends on the ROI geometry and the model function, built once.
+
+    Holds the flattened ROI coordinates, the validity masks, the cleaned
+    ROI, the Jacobian buffer and the data-independent parameter bounds.
+    The (x, y) of the valid pixels are kept as long as the mask does not
+    change from one frame to the next (masked pixels are mostly fixed), so
+    prepare() costs two masks, one copy and the compaction of z per frame
+    instead of a meshgrid, ravels and the reallocations of roi_fit_data.
+    The cleaned ROI it returns is overwritten by the next prepare(): one
+    fit at a time per plan. The buffers follow the actual ROI shape, which
+    is smaller than roi_coords when the ROI touches the edge of the image.
+    """
+    def __init__(self, roi_coords, function = gaussian2d_rotated):
+        self.roi_coords = tuple(roi_coords)
+        self.function = function
+        self.super_gaussian = function == super_gaussian2d_rotated
+        self.shape = None
+
+    def matches(self, roi_coords, function):
+        return self.roi_coords == tuple(roi_coords) and self.function == function
+
+    def _allocate(self, shape):
+        n_rows_roi, n_cols_roi = shape
+        x_roi, y_roi = np.meshgrid(np.arange(n_cols_roi, dtype=np.float64), np.arange(n_rows_roi, dtype=np.float64))
+        self.x_flat = x_roi.ravel()
+        self.y_flat = y_roi.ravel()
+        self._valid = np.empty(shape, dtype=bool)
+        self._invalid = np.empty(shape, dtype=bool)
+        self._previous_valid = np.zeros(shape, dtype=bool)
+        self._x_clean = self._y_clean = None
+        self._im_roi = np.empty(shape, dtype=np.float64)
+        self._jac = np.empty((len(SUPER_GAUSSIAN_PARAMS if self.super_gaussian else GAUSSIAN_PARAMS), n_rows_roi * n_cols_roi))
+        self.template = parameter_template(shape, self.super_gaussian)
+        self.shape = shape
+
+    def prepare(self, im, sentinel = np.iinfo(np.int32).max):
+        """ROI with invalid pixels set to NaN, and the (x, y, z) of its valid pixels: the return of roi_fit_data."""
+        roi_start_row, roi_end_row, roi_start_col, roi_end_col = self.roi_coords
+        im_roi = im[roi_start_row : roi_end_row + 1,
+                    roi_start_col : roi_end_col + 1]
+        if im_roi.shape != self.shape:
+            self._allocate(im_roi.shape)
+        # Same validity as is_finite, into the preallocated masks
+        valid, invalid = self._valid, self._invalid
+        np.isfinite(im_roi, out=valid)
+        np.less(im_roi, sentinel, out=invalid)
+        valid &= invalid
+        np.logical_not(valid, out=invalid)
+        valid_flat = valid.ravel()
+        if self._x_clean is None or not np.array_equal(valid, self._previous_valid):
+            if not valid_flat.any():
+                raise ValueError("No valid data left in ROI after removing NaNs/infs. Cannot fit.")
+            np.copyto(self._previous_valid, valid)
+            self._x_clean = self.x_flat[valid_flat]
+            self._y_clean = self.y_flat[valid_flat]
+        # Saturated pixels would otherwise dominate the centroid and amplitude guesses
+        clean = self._im_roi
+        np.copyto(clean, im_roi)
+        np.copyto(clean, np.nan, where=invalid)
+        z_clean = clean.ravel()[valid_flat]
+        return clean, self._x_clean, self._y_clean, z_clean
+
+    def model(self, x_clean, y_clean, z_clean):
+        """RotatedGaussianModel of the prepared pixels, its Jacobian in the plan's buffer"""
+        return RotatedGaussianModel(x_clean, y_clean, z_clean, self.super_gaussian, jac_buffer=self._jac[:, :z_clean.size])
+
+def roi_fit_data(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col):
+    """ROI of `im` with invalid pixels set to NaN, and the (x, y, z) of its valid pixels, x/y relative to the ROI."""
+    return FitPlan((roi_start_row, roi_end_row, roi_start_col, roi_end_col)).prepare(im)
+
+def roi_moments(im_roi, background=True, iterations=2, window=3.0):
+    """
+    Gaussian parameters of the ROI from its NaN-aware image moments, in ROI pixels and radians.
+
+    The background (median of the valid border pixels) is subtracted first
+    if `background`. Each of the `iterations` windowing passes keeps only the
+    pixels within `window` sigmas (Mahalanobis distance) of the previous
+    estimate, and the moments are corrected for the part of the Gaussian
+    the window cuts off. One pass over the ROI per iteration, no fitting.
+    """
+    valid = is_finite(im_roi)
+    w = np.where(valid, im_roi, 0).astype(np.float64)
+    if background:
+        border = np.concatenate((im_roi[0], im_roi[-1], im_roi[1:-1, 0], im_roi[1:-1, -1]))
+        border = border[is_finite(border)]
+        if border.size:
+            w -= np.median(border)
+            np.maximum(w, 0, out=w)
+            w[~valid] = 0
+    n_rows_roi, n_cols_roi = im_roi.shape
+    x = np.arange(n_cols_roi, dtype=np.float64)
+    y = np.arange(n_rows_roi, dtype=np.float64)
+
+    weights = w
+    mass_kept, var_kept = 1.0, 1.0
+    for iteration in range(iterations + 1):
+        col_sums = weights.sum(axis=0)
+        row_sums = weights.sum(axis=1)
+        m0 = col_sums.sum()
+        if m0 <= 0:
+            raise ValueError("No signal above background in ROI. Cannot estimate the beam.")
+        xo = col_sums @ x / m0
+        yo = row_sums @ y / m0
+        dx = x - xo
+        dy = y - yo
+        sxx = col_sums @ (dx * dx) / m0 / var_kept
+        syy = row_sums @ (dy * dy) / m0 / var_kept
+        sxy = dy @ weights @ dx / m0 / var_kept
+        det = sxx * syy - sxy * sxy
+        if iteration == iterations or det <= 0:
+            break
+        # Keep the pixels inside the `window`-sigma ellipse of this estimate
+        d2 = (syy * (dx * dx)[None, :] - 2 * sxy * dy[:, None] * dx[None, :] + sxx * (dy * dy)[:, None]) / det
+        weights = np.where(d2 <= window**2, w, 0)
+        # Fraction of a 2D Gaussian's mass, and of its variance, within that radius
+        tail = np.exp(-window**2 / 2)
+        mass_kept = 1 - tail
+        var_kept = 1 - (window**2 / 2) * tail / mass_kept
+
+    half_trace = (sxx + syy) / 2
+    spread = np.sqrt(((sxx - syy) / 2)**2 + sxy**2)
+    sigma_x = np.sqrt(max(half_trace + spread, 1e-12))
+    sigma_y = np.sqrt(max(half_trace - spread, 1e-12))
+    # The models put the sigma_x axis along (cos theta, -sin theta)
+    theta = 0.5 * np.arctan2(-2 * sxy, sxx - syy)
+    amplitude = m0 / mass_kept / (2 * np.pi * sigma_x * sigma_y)
+    return {'amplitude': amplitude, 'xo': xo, 'yo': yo, 'sigma_x': sigma_x, 'sigma_y': sigma_y, 'theta': theta}
+
+def estimate_2d_gaussian_roi_moments(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col,
+                                     function = gaussian2d_rotated, background = True, iterations = 2, window = 3.0):
+    """Instant beam estimate from image moments (see roi_moments), with the best_values of fit_2d_gaussian_roi_NaN."""
     im_roi = im[roi_start_row : roi_end_row + 1,
                 roi_start_col : roi_end_col + 1]
-    
-    # Set up x,y mesh for ROI
-    n_rows_roi, n_cols_roi = im_roi.shape
-    x_roi, y_roi = np.meshgrid(
-        np.arange(n_cols_roi), 
-        np.arange(n_rows_roi)
-    )
+    best_values = roi_moments(im_roi, background, iterations, window)
+    if function == super_gaussian2d_rotated:
+        best_values['n'] = 2.0
+    finalize_best_values(best_values, roi_start_row, roi_start_col)
+    return FastFitResult(best_values, nfev=0, njev=0, cost=np.nan, success=True, message="image moments")
+
+def parameter_template(shape, super_gaussian=False):
+    """Starting values and bounds {name: (value, min, max)} that only depend on the ROI shape."""
+    n_rows_roi, n_cols_roi = shape
+    diag_roi = np.sqrt(n_rows_roi**2 + n_cols_roi**2)
+    template = {
+        'xo': (n_cols_roi/2, 0, n_cols_roi),
+        'yo': (n_rows_roi/2, 0, n_rows_roi),
+        'sigma_x': (max(n_cols_roi//4, 1), 1, diag_roi/2),
+        'sigma_y': (max(n_rows_roi//4, 1), 1, diag_roi/2),
+        'theta': (0, -np.pi/2, np.pi/2),
+    }
+    if super_gaussian:
+        template['n'] = (2, 1, 10)  # Adjust 'n' as needed
+    return template
+
+def initial_guess(im_roi, super_gaussian=False, initial="centroid", template=None):
+    """
+    Starting values and bounds {name: (value, min, max)}.
 
-    # Flatten
-    z_flat_roi = im_roi.ravel()
-    x_flat_roi = x_roi.ravel()
-    y_flat_roi = y_roi.ravel()
-
-    # ------------------------------------------------
-    # 1) Exclude any NaN entries in z_flat_roi
-    # ------------------------------------------------
-    valid_mask = ~np.isnan(z_flat_roi)
-    z_flat_roi_clean = z_flat_roi[valid_mask]
-    x_flat_roi_clean = x_flat_roi[valid_mask]
-    y_flat_roi_clean = y_flat_roi[valid_mask]
-
-    # Also exclude infinities (including the case max(int32))
-    valid_mask_inf = is_finite(z_flat_roi_clean)
-    z_flat_roi_clean = z_flat_roi_clean[valid_mask_inf]
-    x_flat_roi_clean = x_flat_roi_clean[valid_mask_inf]
-    y_flat_roi_clean = y_flat_roi_clean[valid_mask_inf]
-
-    # Now ensure we have some data left
-    if len(z_flat_roi_clean) == 0:
-        raise ValueError("No valid data left in ROI after removing NaNs/infs. Cannot fit.")
-
-    # ------------------------------------------------
-    # 2) Compute initial guesses
-    # ------------------------------------------------
-    total_intensity = np.nansum(z_flat_roi_clean)
-    # Weighted averages (x, y) for initial guess
-    # (Note we must use the cleaned arrays)
-    # x_flat_roi_clean, y_flat_roi_clean are relative to the ROI.
+    initial="centroid" starts from the ROI centroid and size, "moments" from
+    the moment estimate of roi_moments (same bounds); a dict of values (ROI
+    pixels, radians) replaces the starting values it names. `template` is
+    the parameter_template of the ROI shape, if already at hand (FitPlan).
+    """
+    n_rows_roi, n_cols_roi = im_roi.shape
+    guess = dict(template if template is not None else parameter_template(im_roi.shape, super_gaussian))
+    # Weighted averages (x, y) for initial guess, relative to the ROI
     col_sums = np.nansum(im_roi, axis=0)  # sum along rows
     row_sums = np.nansum(im_roi, axis=1)  # sum along columns
     # Weighted average index in X (across columns):
-    linspace_cols = np.arange(n_cols_roi)
     if col_sums.sum() != 0:
-        xo_init = np.dot(col_sums, linspace_cols) / col_sums.sum()
-    else:
-        xo_init = n_cols_roi/2
+        xo_init = np.dot(col_sums, np.arange(n_cols_roi)) / col_sums.sum()
+        guess['xo'] = (xo_init,) + guess['xo'][1:]
     # Weighted average index in Y (across rows):
-    linspace_rows = np.arange(n_rows_roi)
     if row_sums.sum() != 0:
-        yo_init = np.dot(row_sums, linspace_rows) / row_sums.sum()
-    else:
-        yo_init = n_rows_roi/2
+        yo_init = np.dot(row_sums, np.arange(n_rows_roi)) / row_sums.sum()
+        guess['yo'] = (yo_init,) + guess['yo'][1:]
 
-    amp_guess = 0.5 * np.nanmax(im_roi)  # might be NaN if ROI all NaN, but we handled that case above
+    amp_max = np.nanmax(im_roi)
+    amp_guess = 0.5 * amp_max  # might be NaN if ROI all NaN, but we handled that case above
     if np.isnan(amp_guess) or amp_guess < 1:
         amp_guess = 1.0
-
-    diag_roi = np.sqrt(n_rows_roi**2 + n_cols_roi**2)
-
-    # ------------------------------------------------
-    # 3) Create the model and parameters
-    # ------------------------------------------------
-    model_roi = Model(
-        function, 
-        independent_vars=['x','y'],
-    )
-
-    params_roi = Parameters()
-    params_roi.add('amplitude', value=amp_guess, min=1, max=1.0 * np.nanmax(im_roi))
-    params_roi.add('xo', value=xo_init, min=0, max=n_cols_roi)
-    params_roi.add('yo', value=yo_init, min=0, max=n_rows_roi)
-    params_roi.add('sigma_x', value=max(n_cols_roi//4, 1), min=1, max=diag_roi/2)
-    params_roi.add('sigma_y', value=max(n_rows_roi//4, 1), min=1, max=diag_roi/2)
-    params_roi.add('theta', value=0, min=-np.pi/2, max=np.pi/2)
-    if function == super_gaussian2d_rotated:
-        params_roi.add('n', value=2, min=1, max=10)  # Adjust 'n' as needed
-
-    # ------------------------------------------------
-    # 4) Perform the fit on the cleaned data
-    # ------------------------------------------------
-    result_roi = model_roi.fit(
-        z_flat_roi_clean,
-        x=x_flat_roi_clean,
-        y=y_flat_roi_clean,
-        params=params_roi
-    )
-
+    guess['amplitude'] = (amp_guess, 1, 1.0 * amp_max)
+
+    if isinstance(initial, dict):
+        estimate = initial
+    elif initial == "moments":
+        try:
+            estimate = roi_moments(im_roi)
+        except ValueError:
+            estimate = {}
+    else:
+        estimate = {}
+    for name, value in estimate.items():
+        _, vmin, vmax = guess[name]
+        guess[name] = (value, vmin, vmax)
+    return guess
+
+def finalize_best_values(best_values, roi_start_row, roi_start_col):
+    """Full-image centre, sigma_x >= sigma_y, theta in degrees within [-90, 90]: the convention of the GUI."""
     # Adjust the best-fit center to the full image coordinates
-    result_roi.best_values['xo'] += (roi_start_col + 0.5)
-    result_roi.best_values['yo'] += (roi_start_row + 0.5)
+    best_values['xo'] += (roi_start_col + 0.5)
+    best_values['yo'] += (roi_start_row + 0.5)
 
     # Ensure sigma_x >= sigma_y for a consistent convention (optional)
-    if result_roi.best_values['sigma_x'] < result_roi.best_values['sigma_y']:
-        sx = result_roi.best_values['sigma_x']
-        sy = result_roi.best_values['sigma_y']
-        result_roi.best_values['sigma_x'] = sy
-        result_roi.best_values['sigma_y'] = sx
-        result_roi.best_values['theta'] += np.pi/2
+    if best_values['sigma_x'] < best_values['sigma_y']:
+        sx = best_values['sigma_x']
+        sy = best_values['sigma_y']
+        best_values['sigma_x'] = sy
+        best_values['sigma_y'] = sx
+        best_values['theta'] += np.pi/2
 
     # Keep angle between [-90, +90) degrees, etc.
-    if result_roi.best_values['theta'] > np.pi/2:
-        result_roi.best_values['theta'] -= np.pi
-    elif result_roi.best_values['theta'] < -np.pi/2:
-        result_roi.best_values['theta'] += np.pi
+    if best_values['theta'] > np.pi/2:
+        best_values['theta'] -= np.pi
+    elif best_values['theta'] < -np.pi/2:
+        best_values['theta'] += np.pi
 
     # Convert theta to degrees
-    result_roi.best_values['theta'] = np.degrees(result_roi.best_values['theta'])
+    best_values['theta'] = np.degrees(best_values['theta'])
+    return best_values
+
+def roi_values(best_values, roi_start_row, roi_start_col):
+    """Inverse of finalize_best_values: ROI-relative centre and theta in radians."""
+    values = dict(best_values)
+    values['xo'] -= (roi_start_col + 0.5)
+    values['yo'] -= (roi_start_row + 0.5)
+    values['theta'] = np.radians(values['theta'])
+    return values
+
+PYRAMID_MIN_PIXELS = 200 * 200  # Larger ROIs are fitted coarse-to-fine, see fit_2d_gaussian_roi_pyramid
+
+def rebin_nan(arr, bin_factor):
+    """
+    Block mean of a 2D array by an integer factor, ignoring NaN pixels.
 
+    Same block reshape as rebin() of the metadata server (the remainder
+    rows and columns are cropped); a block without any valid pixel is NaN.
+    """
+    if bin_factor < 1:
+        raise ValueError("bin_factor must be >= 1.")
+    if bin_factor == 1:
+        return arr
+    height, width = arr.shape
+    new_height = height // bin_factor
+    new_width = width // bin_factor
+    reshaped = arr[:new_height * bin_factor, :new_width * bin_factor].reshape(
+        new_height, bin_factor,
+        new_width, bin_factor
+    )
+    valid = ~np.isnan(reshaped)
+    sums = np.where(valid, reshaped, 0).sum(axis=(1, 3), dtype=np.float64)
+    counts = valid.sum(axis=(1, 3))
+    with np.errstate(invalid='ignore'):
+        return sums / counts  # 0 / 0 -> NaN for fully masked blocks
+
+def fit_2d_gaussian_roi_pyramid(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = gaussian2d_rotated,
+                                engine = "fast", initial = "moments", target_pixels = 10000, window = 3.0):
+    """
+    Coarse-to-fine fit of a large ROI; same arguments and result as fit_2d_gaussian_roi_NaN.
+
+    The ROI is binned (rebin_nan) down to about `target_pixels` and fitted,
+    then the fit is refined at full resolution, seeded with the coarse
+    result, on the bounding box of its `window`-sigma ellipse only. The cost
+    follows the size of the beam instead of the size of the ROI. nfev and
+    njev of the result add up both stages.
+    """
+    im_roi = im[roi_start_row : roi_end_row + 1,
+                roi_start_col : roi_end_col + 1]
+    bin_factor = max(1, int(np.ceil(np.sqrt(im_roi.size / target_pixels))))
+    coarse_im = rebin_nan(np.where(is_finite(im_roi), im_roi, np.nan), bin_factor)
+    coarse = fit_2d_gaussian_roi_NaN(coarse_im, 0, coarse_im.shape[0] - 1, 0, coarse_im.shape[1] - 1,
+                                     function = function, engine = engine, initial = initial, pyramid = False)
+
+    # Back to full-resolution pixels: bin j spans [j, j + 1) * bin_factor, and averaging
+    # over a bin adds the variance of a uniform bin_factor-wide box to each sigma
+    values = dict(coarse.best_values)
+    values['xo'] = roi_start_col + bin_factor * values['xo']
+    values['yo'] = roi_start_row + bin_factor * values['yo']
+    for name in ('sigma_x', 'sigma_y'):
+        values[name] = np.sqrt(max((bin_factor * values[name])**2 - (bin_factor**2 - 1) / 12, 1.0))
+
+    theta = np.radians(values['theta'])
+    half_width = window * np.hypot(values['sigma_x'] * np.cos(theta), values['sigma_y'] * np.sin(theta))
+    half_height = window * np.hypot(values['sigma_x'] * np.sin(theta), values['sigma_y'] * np.cos(theta))
+    window_start_row = max(roi_start_row, int(np.floor(values['yo'] - half_height)))
+    window_end_row = min(roi_end_row, int(np.ceil(values['yo'] + half_height)))
+    window_start_col = max(roi_start_col, int(np.floor(values['xo'] - half_width)))
+    window_end_col = min(roi_end_col, int(np.ceil(values['xo'] + half_width)))
+    if window_end_row - window_start_row < 4 or window_end_col - window_start_col < 4:
+        # Coarse result outside the ROI or degenerate: refine on the whole ROI
+        window_start_row, window_end_row, window_start_col, window_end_col = roi_start_row, roi_end_row, roi_start_col, roi_end_col
+
+    seed = roi_values(values, window_start_row, window_start_col)
+    result = fit_2d_gaussian_roi_NaN(im, window_start_row, window_end_row, window_start_col, window_end_col,
+                                     function = function, engine = engine, initial = seed, pyramid = False)
+    if hasattr(result, 'njev') and hasattr(coarse, 'njev'):
+        result.nfev += coarse.nfev
+        result.njev += coarse.njev
+    return result
+
+def fit_2d_gaussian_roi_NaN(im, roi_start_row, roi_end_row, roi_start_col, roi_end_col, function = gaussian2d_rotated, engine = "fast", initial = "centroid", plan = None, pyramid = True):
+    """
+    Fit a rotated 2D Gaussian to an ROI of `im`, ignoring NaN (masked) pixels.
+
+    engine="fast" solves the bounded least squares with the closed-form
+    Jacobian of fast_beam_fitter (gaussian2d_rotated and
+    super_gaussian2d_rotated only); engine="lmfit" builds the lmfit Model.
+    Both return an object whose `best_values` follow the same convention.
+    initial="moments" seeds the fit with the moment estimate instead of the
+    ROI centroid and size. A FitPlan of the same ROI and function, kept by
+    the caller between frames, saves the per-fit setup. With `pyramid`,
+    ROIs above PYRAMID_MIN_PIXELS go through fit_2d_gaussian_roi_pyramid.
+    """
+    roi_coords = (roi_start_row, roi_end_row, roi_start_col, roi_end_col)
+    if pyramid and (roi_end_row - roi_start_row + 1) * (roi_end_col - roi_start_col + 1) > PYRAMID_MIN_PIXELS:
+        return fit_2d_gaussian_roi_pyramid(im, *roi_coords, function = function, engine = engine,
+                                           initial = initial if initial == "centroid" else "moments")
+    if plan is None or not plan.matches(roi_coords, function):
+        plan = FitPlan(roi_coords, function)
+    im_roi, x_clean, y_clean, z_clean = plan.prepare(im)
+    guess = initial_guess(im_roi, plan.super_gaussian, initial, plan.template)
+
+    if engine == "fast" and function in (gaussian2d_rotated, super_gaussian2d_rotated):
+        model = plan.model(x_clean, y_clean, z_clean)
+        p0, lower, upper = zip(*(guess[name] for name in model.names))
+        result_roi = model.fit(p0, lower, upper)
+    else:
+        # Create the model and parameters
+        model_roi = Model(
+            function, 
+            independent_vars=['x','y'],
+        )
+        params_roi = Parameters()
+        for name, (value, vmin, vmax) in guess.items():
+            params_roi.add(name, value=value, min=vmin, max=vmax)
+
+        # Perform the fit on the cleaned data
+        result_roi = model_roi.fit(
+            z_clean,
+            x=x_clean,
+            y=y_clean,
+            params=params_roi
+        )
+
+    finalize_best_values(result_roi.best_values, roi_start_row, roi_start_col)
     return result_roi
 
 # Start the Qt event loop
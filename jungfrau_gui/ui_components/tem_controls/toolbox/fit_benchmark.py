@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Speed and agreement of the beam fitting engines of fit_2d_gaussian_roi_NaN.
+
+Test beams are utils.create_gaussian patches (or super-Gaussian ones) with a
+known centre, sigmas and angle, on a Poisson background with masked (NaN) and
+saturated pixels, fitted in an ROI as the GUI does. Each engine is timed on
+the same frames and the fitted parameters are compared with each other and
+with the truth.
+
+    python -m jungfrau_gui.ui_components.tem_controls.toolbox.fit_benchmark -n 20 --roi 150 100
+
+--suite runs every fitting path of FIT_PATHS over several ROI sizes and
+both models, and writes a JSON report (wall time, function evaluations,
+parameter errors) to diff against the report of another version:
+
+    python -m jungfrau_gui.ui_components.tem_controls.toolbox.fit_benchmark --suite --report after.json --baseline before.json
+
+--check fits the regression beams of bound_checks() with both engines and
+fails if the fast engine does not converge to at least lmfit's optimum,
+including when parameters end on their bounds:
+
+    python -m jungfrau_gui.ui_components.tem_controls.toolbox.fit_benchmark --check
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+from ...utils import create_gaussian
+from .fit_beam_intensity import (fit_2d_gaussian_roi_NaN, estimate_2d_gaussian_roi_moments,
+                                 gaussian2d_rotated, super_gaussian2d_rotated)
+
+PARAMS = ('amplitude', 'xo', 'yo', 'sigma_x', 'sigma_y', 'theta')
+
+
+def make_beam(rng, shape=(514, 1030), roi=(150, 100), amplitude=800, background=2.0, masked=30, saturated=3, n=None):
+    """
+    Frame with one beam inside a (width, height) ROI.
+
+    Returns (image, roi_coords, truth) with roi_coords as taken by
+    fit_2d_gaussian_roi_NaN and truth in its best_values convention. With
+    `n` the beam is a super-Gaussian of that order on the grid of
+    create_gaussian, and truth has `n` too.
+    """
+    width, height = roi
+    sigma_x = rng.uniform(0.12, 0.22) * width
+    sigma_y = rng.uniform(0.5, 0.9) * sigma_x
+    theta = rng.uniform(-np.pi / 3, np.pi / 3)
+    if n is None:
+        patch = create_gaussian(amplitude, width, height, sigma_x, sigma_y, theta)
+    else:
+        x, y = np.meshgrid(np.linspace(-width//2, width//2, width), np.linspace(-height//2, height//2, height))
+        patch = super_gaussian2d_rotated(x, y, amplitude, 0, 0, sigma_x, sigma_y, theta, n).reshape(height, width)
+    r0 = (shape[0] - height) // 2 + int(rng.integers(-50, 50))
+    c0 = (shape[1] - width) // 2 + int(rng.integers(-100, 100))
+    image = np.zeros(shape, dtype=np.float32)
+    image[r0:r0 + height, c0:c0 + width] = patch
+    image = rng.poisson(image + background).astype(np.float32)
+    image.flat[rng.integers(0, image.size, masked * 100)] = np.nan
+    roi_view = image[r0:r0 + height, c0:c0 + width]
+    roi_view.flat[rng.integers(0, roi_view.size, masked)] = np.nan
+    roi_view.flat[rng.integers(0, roi_view.size, saturated)] = np.iinfo(np.int32).max
+
+    # create_gaussian centres the beam on linspace(-size//2, size//2, size): pixel spacing is slightly above 1
+    step_x = 2 * (width // 2) / (width - 1)
+    step_y = 2 * (height // 2) / (height - 1)
+    truth = dict(amplitude=amplitude, xo=c0 + (width // 2) / step_x + 0.5, yo=r0 + (height // 2) / step_y + 0.5,
+                 sigma_x=sigma_x / step_x, sigma_y=sigma_y / step_y, theta=np.degrees(theta))
+    if n is not None:
+        truth['n'] = n
+    return image, (r0, r0 + height - 1, c0, c0 + width - 1), truth
+
+
+def angle_diff(a, b):
+    """Difference of two ellipse angles in degrees, modulo 180"""
+    return (a - b + 90) % 180 - 90
+
+
+def compare(values, reference):
+    diffs = {}
+    for name in PARAMS + ('n',):
+        if name not in values or name not in reference:
+            continue
+        d = values[name] - reference[name]
+        diffs[name] = angle_diff(values[name], reference[name]) if name == 'theta' else d
+    return diffs
+
+
+def run(n_frames, roi, function, engines=("lmfit", "fast"), seed=0):
+    rng = np.random.default_rng(seed)
+    frames = [make_beam(rng, roi=roi) for _ in range(n_frames)]
+    fit_2d_gaussian_roi_NaN(frames[0][0], *frames[0][1], function=function, engine=engines[-1])  # Warm-up
+    timings, results = {}, {}
+    for engine in engines:
+        timings[engine], results[engine] = [], []
+        for image, roi_coords, _ in frames:
+            t0 = time.perf_counter()
+            result = fit_2d_gaussian_roi_NaN(image, *roi_coords, function=function, engine=engine)
+            timings[engine].append((time.perf_counter() - t0) * 1e3)
+            results[engine].append(dict(result.best_values))
+
+    for engine in engines:
+        t = np.array(timings[engine])
+        logging.info(f"{engine:>6}: {np.median(t):8.2f} ms median, {np.percentile(t, 95):8.2f} ms p95")
+    if len(engines) > 1:
+        ref, new = engines[0], engines[-1]
+        logging.info(f"Speed-up {new} vs {ref}: {np.median(timings[ref]) / np.median(timings[new]):.1f}x")
+        diffs = [compare(b, a) for a, b in zip(results[ref], results[new])]
+        logging.info(f"Max |{new} - {ref}| over {n_frames} frames:")
+        for name in PARAMS:
+            logging.info(f"    {name:>9}: {max(abs(d[name]) for d in diffs):.4g}")
+    for engine in engines:
+        errors = [compare(r, truth) for r, (_, _, truth) in zip(results[engine], frames)]
+        logging.info(f"{engine:>6} vs truth, median |error|: " +
+                     ", ".join(f"{name} {np.median([abs(e[name]) for e in errors]):.3g}" for name in PARAMS))
+    return timings, results
+
+
+def bound_check_beams(rng, size=60):
+    """
+    {name: (image, roi_coords, function)} of the regression checks: a noise-free
+    beam (interior optimum), a beam whose saturated core is masked (the
+    amplitude ends on its upper bound, the brightest valid pixel) and a
+    super-Gaussian beam fitted with gaussian2d_rotated (bounds of the
+    Gaussian active), the last two also on a 300x200 ROI.
+    """
+    def beam(shape, n=2.0, noise=True):
+        y, x = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float64)
+        sx = 0.12 * shape[1]
+        image = super_gaussian2d_rotated(x, y, 2000, shape[1] / 2, shape[0] / 2 - 2, sx, 0.7 * sx, 0.4, n).reshape(shape)
+        return (rng.poisson(image) if noise else image).astype(np.float32)
+
+    beams = {"noise-free": (beam((size, size), noise=False), gaussian2d_rotated)}
+    for shape in ((size, size), (200, 300)):
+        label = f"{shape[1]}x{shape[0]}"
+        image = beam(shape)
+        image[image > 1200] = np.iinfo(np.int32).max
+        beams[f"saturated-core {label}"] = (image, gaussian2d_rotated)
+        beams[f"super-gaussian beam {label}"] = (beam(shape, n=5.0), gaussian2d_rotated)
+    return {name: (image, (0, image.shape[0] - 1, 0, image.shape[1] - 1), function)
+            for name, (image, function) in beams.items()}
+
+
+def bound_checks(seed=0, max_nfev=50, tolerance=1e-6):
+    """
+    Fast engine against lmfit on bound_check_beams(); the names of the failed checks.
+
+    A check passes if the fast fit reports success within `max_nfev`
+    function evaluations and its cost is at most lmfit's (relative
+    `tolerance`, or of the data energy for a noise-free beam): on a bound lmfit stops a little short of the optimum, so
+    the parameters are only compared when both costs agree.
+    """
+    failed = []
+    for name, (image, roi_coords, function) in bound_check_beams(np.random.default_rng(seed)).items():
+        fast = fit_2d_gaussian_roi_NaN(image, *roi_coords, function=function, engine="fast", initial="moments", pyramid=False)
+        reference = fit_2d_gaussian_roi_NaN(image, *roi_coords, function=function, engine="lmfit", initial="moments", pyramid=False)
+        reference_cost = 0.5 * float(np.sum(reference.residual**2))
+        # Costs within rounding of the data (noise-free beam) count as equal
+        slack = tolerance * max(reference_cost, 0.5 * float(np.sum(reference.data**2)) * 1e-6)
+        ok = fast.success and fast.nfev <= max_nfev and fast.cost <= reference_cost + slack
+        if ok and abs(fast.cost - reference_cost) <= slack:
+            diffs = compare(fast.best_values, reference.best_values)
+            ok = all(abs(d) <= 1e-3 * max(abs(reference.best_values[k]), 1) for k, d in diffs.items())
+        logging.info(f"{name:>28}: {'ok    ' if ok else 'FAILED'} fast {fast.message!r} nfev {fast.nfev}, "
+                     f"cost {fast.cost:.6g} (lmfit {reference_cost:.6g}, nfev {reference.nfev})")
+        if not ok:
+            failed.append(name)
+    return failed
+
+
+class PoolPath:
+    """The multi-process path: all frames of a case in one BeamFitPool.fit_batch, wall time per fit"""
+    def __init__(self, processes=None):
+        self.processes = processes
+        self.pools = {}
+
+    def __call__(self, frames, function):
+        from ..beam_fit_pool import BeamFitPool  # Only when the suite runs this path
+        pool = self.pools.get(function)
+        if pool is None:
+            pool = self.pools[function] = BeamFitPool(self.processes, bus_name="", function=function).start()
+            pool.fit_batch([(frames[0][0], frames[0][1])])  # Warm-up
+        t0 = time.perf_counter()
+        values = pool.fit_batch([(image, roi_coords) for image, roi_coords, _ in frames])
+        wall_ms = (time.perf_counter() - t0) * 1e3 / len(frames)
+        return [(v, None, wall_ms, None) for v in values]
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.stop()
+        self.pools.clear()
+
+
+class MPWorkerPath:
+    """
+    The GUI's asynchronous path: GaussianFitterMP on a frame bus, each frame published after
+    its trigger_capture(), wall time from the trigger to wait_result() (queue, worker process,
+    ROI copy out of shared memory, fit and reply). The worker fits super_gaussian2d_rotated
+    only, other functions are not measured.
+    """
+    def __init__(self, timeout_ms=2000):
+        self.timeout_ms = timeout_ms
+        self.writer = None
+        self.fitter = None
+        self.frame_nr = 0
+
+    def _start(self, shape):
+        from ....frame_bus import FrameBusWriter  # Only when the suite runs this path
+        from ..gaussian_fitter_mp import GaussianFitterMP
+        if self.writer is not None and self.writer.shape != tuple(shape):
+            self.close()
+        if self.writer is None:
+            self.writer = FrameBusWriter(shape=shape, create=True)
+            self.fitter = GaussianFitterMP(mode="fit")
+            self.fitter.bus_name = self.writer.name
+            self.fitter.timeout_ms = self.timeout_ms
+            self.fitter.start()
+
+    def _fit(self, image, roi_coords):
+        r0, r1, c0, c1 = roi_coords
+        # Published as the detector sends it: int32 with masked pixels min_int32
+        raw = np.nan_to_num(image.astype(np.float64), nan=np.iinfo(np.int32).min)
+        raw = np.clip(raw, np.iinfo(np.int32).min, np.iinfo(np.int32).max).astype(np.int32)
+        t0 = time.perf_counter()
+        request = self.fitter.trigger_capture({"pos": [c0, r0], "size": [c1 - c0, r1 - r0]})
+        self.frame_nr += 1
+        self.writer.publish(raw, self.frame_nr)
+        values = self.fitter.wait_result(request, timeout=self.timeout_ms / 1000 + 5)
+        return values, (time.perf_counter() - t0) * 1e3
+
+    def __call__(self, frames, function):
+        if function is not super_gaussian2d_rotated:
+            return None
+        self._start(frames[0][0].shape)
+        self._fit(frames[0][0], frames[0][1])  # Warm-up
+        measurements = []
+        for image, roi_coords, _ in frames:
+            values, wall_ms = self._fit(image, roi_coords)
+            measurements.append((values, None, wall_ms, None))
+        return measurements
+
+    def close(self):
+        if self.fitter is not None:
+            self.fitter.stop()
+            self.fitter = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def _one_by_one(fit):
+    """Fitting path from fit(image, roi_coords, function) -> result, timed per frame"""
+    def path(frames, function):
+        fit(frames[0][0], frames[0][1], function)  # Warm-up
+        measurements = []
+        for image, roi_coords, _ in frames:
+            t0 = time.perf_counter()
+            try:
+                result = fit(image, roi_coords, function)
+            except Exception as e:
+                logging.warning(f"Fit failed: {e}")
+                measurements.append((None, None, (time.perf_counter() - t0) * 1e3, False))
+                continue
+            wall_ms = (time.perf_counter() - t0) * 1e3
+            measurements.append((dict(result.best_values), getattr(result, 'nfev', None), wall_ms, getattr(result, 'success', None)))
+        return measurements
+    return path
+
+
+# Fitting paths of the suite: path(frames, function) -> [(best_values or None, nfev or None, wall_ms, success or None)]
+FIT_PATHS = {
+    "lmfit": _one_by_one(lambda im, roi, f: fit_2d_gaussian_roi_NaN(im, *roi, function=f, engine="lmfit")),
+    "fast": _one_by_one(lambda im, roi, f: fit_2d_gaussian_roi_NaN(im, *roi, function=f, engine="fast")),
+    "fast-full-res": _one_by_one(lambda im, roi, f: fit_2d_gaussian_roi_NaN(im, *roi, function=f, engine="fast", pyramid=False)),
+    "fast-moments-seed": _one_by_one(lambda im, roi, f: fit_2d_gaussian_roi_NaN(im, *roi, function=f, engine="fast", initial="moments")),
+    "mp-worker": MPWorkerPath(),
+    "moments": _one_by_one(lambda im, roi, f: estimate_2d_gaussian_roi_moments(im, *roi, function=f)),
+    "pool": PoolPath(),
+}
+
+SUITE_ROIS = ((80, 60), (150, 100), (300, 200), (600, 400))
+SUITE_BEAMS = {"gaussian": None, "super-gaussian": 3.0}  # Beam model -> super-Gaussian order of the test beams
+SUITE_FUNCTIONS = {"gaussian2d_rotated": gaussian2d_rotated, "super_gaussian2d_rotated": super_gaussian2d_rotated}
+
+
+def _stats(values, digits=4):
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return None
+    return {"median": float(f"{np.median(values):.{digits}g}"),
+            "p95": float(f"{np.percentile(values, 95):.{digits}g}"),
+            "max": float(f"{np.max(values):.{digits}g}")}
+
+
+def _git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def suite(n_frames=10, rois=SUITE_ROIS, paths=tuple(FIT_PATHS), seed=0):
+    """
+    Every fitting path on the same test beams, for each ROI size, beam model and fitted function.
+
+    Returns the report: one entry per "function/beam/WxH/path" with the
+    wall time, function evaluations and absolute parameter errors against
+    the truth (median, p95, max), the number of failed fits (exception,
+    no result) and of fits the solver reports as not converged. The
+    pool and mp-worker paths return neither nfev nor convergence, and
+    mp-worker only has super_gaussian2d_rotated entries.
+    """
+    results = {}
+    try:
+        for width, height in rois:
+            for beam, n in SUITE_BEAMS.items():
+                rng = np.random.default_rng(seed)
+                frames = [make_beam(rng, roi=(width, height), n=n) for _ in range(n_frames)]
+                for function_name, function in SUITE_FUNCTIONS.items():
+                    for path in paths:
+                        key = f"{function_name}/{beam}/{width}x{height}/{path}"
+                        measurements = FIT_PATHS[path](frames, function)
+                        if measurements is None:
+                            continue  # The path does not fit this function
+                        errors = [compare(values, truth) for (values, _, _, _), (_, _, truth) in zip(measurements, frames)
+                                  if values is not None]
+                        nfev = [nfev for _, nfev, _, _ in measurements if nfev is not None]
+                        results[key] = {
+                            "wall_ms": _stats([wall_ms for _, _, wall_ms, _ in measurements]),
+                            "nfev": _stats(nfev),
+                            "failures": sum(values is None for values, _, _, _ in measurements),
+                            "not_converged": sum(success is False for _, _, _, success in measurements),
+                            "error": {name: _stats([abs(e[name]) for e in errors if name in e])
+                                      for name in sorted({name for e in errors for name in e})},
+                        }
+                        logging.info(f"{key:<64} {results[key]['wall_ms']['median']:9.2f} ms, "
+                                     f"nfev {results[key]['nfev']['median'] if nfev else '-':>6}, "
+                                     f"|xo err| {results[key]['error'].get('xo', {}).get('median', float('nan')):.3g}, "
+                                     f"failures {results[key]['failures']}, not converged {results[key]['not_converged']}")
+    finally:
+        for path in paths:
+            if hasattr(FIT_PATHS[path], 'close'):
+                FIT_PATHS[path].close()
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "version": _git_version(),
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                        "processor": platform.processor()},
+        "settings": {"frames": n_frames, "seed": seed, "rois": [list(roi) for roi in rois], "paths": list(paths),
+                     "beams": SUITE_BEAMS},
+        "results": results,
+    }
+
+
+def compare_reports(report, baseline, slower=1.25, less_accurate=1.5, tolerance=1e-3):
+    """
+    Log the changes of `report` against `baseline`; returns the keys whose accuracy regressed.
+
+    A case is slower when its median wall time grew by the factor `slower`
+    (logged only, timings depend on the machine), and less accurate when a
+    median parameter error grew by `less_accurate` and by more than
+    `tolerance`, or when it has more failures.
+    """
+    for name in ("frames", "seed"):
+        if report["settings"][name] != baseline["settings"].get(name):
+            logging.warning(f"Baseline ran with {name}={baseline['settings'].get(name)}, not {report['settings'][name]}: "
+                            "the test beams differ, errors are not comparable")
+    regressions = []
+    for key, new in report["results"].items():
+        old = baseline["results"].get(key)
+        if old is None:
+            continue
+        notes = []
+        ratio = new["wall_ms"]["median"] / max(old["wall_ms"]["median"], 1e-9)
+        if ratio > slower:
+            notes.append(f"{ratio:.2f}x slower")
+        elif ratio < 1 / slower:
+            notes.append(f"{1 / ratio:.2f}x faster")
+        accuracy = [f"{name} error {old['error'][name]['median']:.3g} -> {stats['median']:.3g}"
+                    for name, stats in new["error"].items()
+                    if stats and old["error"].get(name)
+                    and stats["median"] > less_accurate * old["error"][name]["median"] + tolerance]
+        if new["failures"] > old["failures"]:
+            accuracy.append(f"failures {old['failures']} -> {new['failures']}")
+        if accuracy:
+            regressions.append(key)
+        if notes or accuracy:
+            logging.info(f"{key}: " + ", ".join(notes + accuracy))
+    logging.info(f"{len(regressions)} of {len(report['results'])} cases less accurate than {baseline.get('version')}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the beam fitting engines")
+    parser.add_argument("-n", "--frames", type=int, default=None, help="Number of test beams (20, 10 per case with --suite)")
+    parser.add_argument("--roi", type=int, nargs=2, default=[150, 100], help="ROI width height in pixels")
+    parser.add_argument("--gaussian", action="store_true", help="Fit gaussian2d_rotated instead of the super-Gaussian")
+    parser.add_argument("--engines", nargs="+", default=["lmfit", "fast"], help="Engines to compare, first is the reference")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--suite", action="store_true", help="Run all fitting paths over several ROI sizes and both models")
+    parser.add_argument("--suite-rois", type=int, nargs="+", default=None, help="ROI sizes of the suite as W H W H ...")
+    parser.add_argument("--paths", nargs="+", default=list(FIT_PATHS), choices=list(FIT_PATHS), help="Fitting paths of the suite")
+    parser.add_argument("--processes", type=int, default=None, help="Processes of the pool path (default: physical cores)")
+    parser.add_argument("--report", type=str, default=None, help="Write the suite report to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="Suite report of another version to compare with")
+    parser.add_argument("--check", action="store_true", help="Regression checks of the fast engine against lmfit, bounds active")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    if args.check:
+        if bound_checks(args.seed):
+            sys.exit(1)
+        return
+    if not args.suite:
+        function = gaussian2d_rotated if args.gaussian else super_gaussian2d_rotated
+        run(args.frames or 20, tuple(args.roi), function, tuple(args.engines), args.seed)
+        return
+
+    rois = SUITE_ROIS if args.suite_rois is None else tuple(zip(args.suite_rois[::2], args.suite_rois[1::2]))
+    FIT_PATHS["pool"].processes = args.processes
+    report = suite(args.frames or 10, rois, tuple(args.paths), args.seed)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        logging.info(f"Report written to {args.report}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare_reports(report, baseline):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Joint focus and stigmation of the beam (IL1, ILs x, ILs y) with a quadratic surrogate.
+
+The beam variance sigma_x**2 + sigma_y**2 grows with the square of the
+defocus and of the astigmatism, so over the lens settings it is close to a
+quadratic surface whose minimum is the focused, round beam.
+QuadraticFocusOptimizer measures a small design around the start, fits the
+surface and then measures at the predicted minimum, refitting after each
+measurement, until the prediction lands on a setting already measured;
+a last design around the minimum averages out the measurement noise.
+
+SyntheticLensResponse stands in for the microscope. Run this module to
+compare AutoFocusTask.model_based_autofocus (the optimizer) with
+AutoFocusTask.rapid_autofocus, both run on SyntheticMicroscope, and with
+axis_search, on random synthetic lenses:
+
+    python -m jungfrau_gui.ui_components.tem_controls.toolbox.focus_optimizer -n 200 --noise 0.05
+"""
+import time
+import logging
+import argparse
+import itertools
+import threading
+from types import SimpleNamespace
+from concurrent.futures import Future
+import numpy as np
+
+
+def beam_variance(best_values):
+    """Objective of the optimizer: sigma_x**2 + sigma_y**2 of a fit result"""
+    return float(best_values["sigma_x"])**2 + float(best_values["sigma_y"])**2
+
+
+class QuadraticFocusOptimizer:
+    """
+    Sequential minimisation of a measured value over integer lens settings, through a quadratic surrogate.
+
+    Usage is ask/tell: ask() gives the next setting to measure (a tuple of
+    ints), or None once done; tell(setting, value) reports the measurement,
+    None for a failed one. `step` is the initial spacing per lens (its
+    scale); the first measurements are the start and +-step on each lens.
+    The surrogate leaves out the cross terms of the lenses until there are
+    enough points to fit them; if it converges before, one setting per
+    pair of lenses is measured off the diagonal around the best. Each next setting is the minimum of the
+    surrogate, fitted with more weight on points near the best so far and
+    at most `radius` steps away from it; the radius doubles after an
+    improvement and halves otherwise. The search ends when the next setting
+    is within `min_step` of a measured one, when the radius falls below
+    `min_step`, or when only the measurements of the final stage are left
+    of `max_evals`; `reason` tells which. Single measurements near the
+    minimum are mostly noise, so the final stage measures +-`final_step`
+    steps on each lens around the minimum of the surrogate, refits it with
+    those and measures at its new minimum, which is the result.
+    """
+    def __init__(self, center, step, lower=None, upper=None, max_evals=20, min_step=1.0, radius=2.0, final_step=0.5):
+        self.center = np.asarray(center, dtype=np.float64)
+        self.step = np.asarray(step, dtype=np.float64)
+        self.dim = self.center.size
+        self.lower = np.full(self.dim, -np.inf) if lower is None else np.asarray(lower, dtype=np.float64)
+        self.upper = np.full(self.dim, np.inf) if upper is None else np.asarray(upper, dtype=np.float64)
+        self.max_evals = max_evals
+        self.min_step = min_step
+        self.radius = radius  # Trust region, in steps
+        self.final_step = final_step
+        self.points = []  # Settings measured (tuples of ints)
+        self.values = []  # Their values, None for failed measurements
+        self.predicted = None  # Surrogate value at the last proposed setting
+        self.incumbent = None  # Measured setting with the lowest surrogate value
+        self.final = None  # Setting measured last, at the minimum of the refitted surrogate: the result
+        self.reason = None
+        self._final_stage = None  # "design", then "minimum" once the search is over
+        self._search_reason = None
+        self._final_u = None  # Centre of the final design, in steps from the centre
+        self._cross = False  # Surrogate fitted with the cross terms of the lenses
+        self._design = [self._setting(self.center)]
+        for i in range(self.dim):
+            for sign in (-1, 1):
+                u = np.zeros(self.dim)
+                u[i] = sign
+                self._design.append(self._setting(self.center + u * self.step))
+
+    def _cross_design(self, setting):
+        """Settings off the diagonals of each pair of lenses around `setting`, a quarter of the trust region away"""
+        offset = max(self.radius / 4, 0.5) / np.sqrt(2)
+        design = []
+        for i, j in itertools.combinations(range(self.dim), 2):
+            u = np.zeros(self.dim)
+            u[i] = u[j] = offset
+            design.append(self._setting(np.asarray(setting) + u * self.step))
+        return design
+
+    def _setting(self, x):
+        return tuple(int(v) for v in np.round(np.clip(x, self.lower, self.upper)))
+
+    @property
+    def evaluations(self):
+        return len(self.points)
+
+    @property
+    def best(self):
+        """(setting, value) of the lowest measurement, or None"""
+        measured = [(v, p) for p, v in zip(self.points, self.values) if v is not None]
+        if not measured:
+            return None
+        value, point = min(measured)
+        return point, value
+
+    @property
+    def _final_evals(self):
+        """Measurements of the final stage"""
+        return 2 * self.dim + 1
+
+    def ask(self):
+        if self.reason is not None:
+            return None
+        if self.evaluations >= self.max_evals:
+            return self._done("maximum number of measurements")
+        while self._design:
+            setting = self._design.pop(0)
+            if setting not in self.points:
+                return setting
+        if self._final_stage == "design":
+            self._final_stage = "minimum"
+            self.final = self._final_minimum()
+            return self.final
+        if self._final_stage == "minimum":
+            return self._done(self._search_reason)
+        if self.best is None:
+            return self._done("no valid measurement")
+        if self.evaluations >= self.max_evals - self._final_evals:
+            return self._finish("maximum number of measurements")
+        if self.radius * np.min(self.step) < self.min_step:
+            return self._finish("trust region below min_step")
+        proposal = self._propose()
+        if proposal is None:
+            return self._done("not enough valid measurements for the surrogate")
+        if any(np.max(np.abs(np.subtract(proposal, p))) < self.min_step for p in self.points):
+            if proposal == self.incumbent and not self._cross:
+                # Converged on the surrogate without cross terms: measure around the best to fit them
+                self._design = self._cross_design(self.incumbent)
+                return self.ask()
+            if proposal == self.incumbent:
+                return self._finish("converged")
+            # Surrogate points at a setting already measured, but not the incumbent: look closer to it
+            self.radius /= 2
+            return self.ask()
+        return proposal
+
+    def tell(self, setting, value):
+        previous = self.best
+        self.points.append(tuple(setting))
+        self.values.append(None if value is None or not np.isfinite(value) else float(value))
+        if self._design or self._final_stage or previous is None or self.values[-1] is None:
+            return
+        if self.values[-1] < previous[1]:
+            self.radius = min(2 * self.radius, 4.0)
+        else:
+            self.radius /= 2
+
+    def _done(self, reason):
+        self.reason = reason
+        logging.debug(f"Focus optimizer done after {self.evaluations} measurements: {reason}")
+        return None
+
+    def _finish(self, reason):
+        """End of the search: measure the final design around the minimum of the surrogate, if the budget allows"""
+        if self.evaluations + self._final_evals > self.max_evals or self._surrogate(self._u(self.incumbent)) is None:
+            return self._done(reason)
+        self._search_reason = reason
+        self._final_stage = "design"
+        u_min = self._minimum(*self._surrogate(self._u(self.incumbent)), self._u(self.incumbent), 2.0)
+        for i in range(self.dim):
+            for sign in (-1, 1):
+                u = u_min.copy()
+                u[i] += sign * self.final_step
+                self._design.append(self._setting(self.center + u * self.step))
+        self._final_u = u_min
+        return self.ask()
+
+    def _final_minimum(self):
+        """Minimum of the surrogate refitted with the final design, at most 2 steps from the one it is centred on"""
+        fit = self._surrogate(self._final_u)
+        u_min = self._final_u if fit is None else self._minimum(*fit, self._final_u, 2.0)
+        return self._setting(self.center + u_min * self.step)
+
+    def _u(self, setting):
+        """Setting in steps from the centre"""
+        return (np.asarray(setting, dtype=np.float64) - self.center) / self.step
+
+    def _features(self, u, cross):
+        columns = [np.ones(len(u))] + [u[:, i] for i in range(self.dim)] + [u[:, i]**2 for i in range(self.dim)]
+        if cross:
+            columns += [u[:, i] * u[:, j] for i, j in itertools.combinations(range(self.dim), 2)]
+        return np.column_stack(columns)
+
+    def _surrogate(self, u_best, radius=1.0):
+        """
+        (coefficients, cross) of the surrogate fitted around `u_best`, in steps from the centre;
+        None without enough valid measurements.
+        """
+        measured = [(p, v) for p, v in zip(self.points, self.values) if v is not None]
+        u = np.array([self._u(p) for p, _ in measured])
+        y = np.array([v for _, v in measured])
+        n_full = 1 + 2 * self.dim + self.dim * (self.dim - 1) // 2
+        cross = len(y) >= n_full + 1
+        features = self._features(u, cross)
+        if len(y) < features.shape[1]:
+            return None
+        # Points far from the best count less: the surface is only locally quadratic. Measurement
+        # errors grow with the beam size, so large values count less too (relative errors)
+        weights = 1 / (1 + np.sum((u - u_best)**2, axis=1) / (2 * radius)**2) / np.maximum(np.abs(y), 1e-12)
+        coeffs, *_ = np.linalg.lstsq(features * weights[:, None], y * weights, rcond=None)
+        return coeffs, cross
+
+    def _minimum(self, coeffs, cross, u_best, radius):
+        """Minimum of the surrogate, at most `radius` steps from `u_best`"""
+        gradient = coeffs[1:1 + self.dim]
+        hessian = np.diag(2 * coeffs[1 + self.dim:1 + 2 * self.dim])
+        if cross:
+            for k, (i, j) in enumerate(itertools.combinations(range(self.dim), 2)):
+                hessian[i, j] = hessian[j, i] = coeffs[1 + 2 * self.dim + k]
+        # Directions of negative curvature are given a small positive one
+        eigenvalues, eigenvectors = np.linalg.eigh(hessian)
+        eigenvalues = np.maximum(eigenvalues, 1e-3 * max(np.max(np.abs(eigenvalues)), 1e-12))
+        u_min = -eigenvectors @ ((eigenvectors.T @ gradient) / eigenvalues)
+        delta = u_min - u_best
+        distance = np.linalg.norm(delta)
+        if distance > radius:
+            u_min = u_best + delta * radius / distance
+        return u_min
+
+    def _propose(self):
+        fit = self._surrogate(self._u(self.incumbent or self.best[0]), self.radius)
+        if fit is None:
+            return None
+        coeffs, cross = fit
+        self._cross = cross
+        measured = [(p, v) for p, v in zip(self.points, self.values) if v is not None]
+        y = np.array([v for _, v in measured])
+        # With noisy measurements the lowest one is often just lucky: of the measurements close
+        # to it, take the one the surrogate puts lowest (not a far one it extrapolates badly)
+        fitted = np.where(y <= 1.25 * np.min(y), self._features(np.array([self._u(p) for p, _ in measured]), cross) @ coeffs, np.inf)
+        self.incumbent = measured[int(np.argmin(fitted))][0]
+        # Minimum of the surrogate within the trust region around the best measurement
+        u_min = self._minimum(coeffs, cross, self._u(self.incumbent), self.radius)
+        self.predicted = float((self._features(u_min[None, :], cross) @ coeffs)[0])
+        return self._setting(self.center + u_min * self.step)
+
+    def minimize(self, measure, time_budget_s=None):
+        """Run ask/tell with value = measure(setting) until done or out of time; returns summary()"""
+        start = time.perf_counter()
+        while (setting := self.ask()) is not None:
+            if time_budget_s is not None and time.perf_counter() - start > time_budget_s:
+                self._done("time budget exceeded")
+                break
+            self.tell(setting, measure(setting))
+        return self.summary(time.perf_counter() - start)
+
+    @property
+    def result(self):
+        """
+        (setting, measured value) of the final measurement, or of the incumbent if the final stage
+        did not complete, or before the surrogate exists of the lowest measurement
+        """
+        if self.final is not None and self.final in self.points:
+            value = self.values[len(self.points) - 1 - self.points[::-1].index(self.final)]
+            if value is not None:
+                return self.final, value
+        if self.incumbent is None:
+            return self.best
+        return self.incumbent, self.values[self.points.index(self.incumbent)]
+
+    def summary(self, elapsed_s=None):
+        best = self.result
+        return {
+            "setting": None if best is None else best[0],
+            "value": None if best is None else best[1],
+            "measurements": self.evaluations,
+            "failed_measurements": sum(v is None for v in self.values),
+            "elapsed_time": elapsed_s,
+            "reason": self.reason,
+        }
+
+
+class SyntheticLensResponse:
+    """
+    Beam against (IL1, ILs x, ILs y), to test focusing without a microscope.
+
+    A spot of `sigma0` pixels is broadened by the defocus
+    d = focus_gain * (il1 - il1_focus) + coupling * (ils_x - ils_focus[0])
+    and by the astigmatism A = stig_gain * (ils - ils_focus):
+
+        sigma_x,y**2 = sigma0**2 + (d +- |A|)**2,  theta = angle(A) / 2
+
+    measure() returns best_values as the fitter does, sigmas with a
+    relative Gaussian `noise`, and counts its calls.
+    """
+    def __init__(self, il1_focus, ils_focus, sigma0=8.0, focus_gain=0.6, stig_gain=0.25, coupling=0.05, noise=0.01, rng=None):
+        self.il1_focus = il1_focus
+        self.ils_focus = np.asarray(ils_focus, dtype=np.float64)
+        self.sigma0 = sigma0
+        self.focus_gain = focus_gain
+        self.stig_gain = stig_gain
+        self.coupling = coupling
+        self.noise = noise
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.calls = 0
+
+    def sigmas(self, il1, ils_x, ils_y):
+        """Noise-free (sigma_x, sigma_y, theta in degrees)"""
+        ils_offset = np.array([ils_x, ils_y], dtype=np.float64) - self.ils_focus
+        defocus = self.focus_gain * (il1 - self.il1_focus) + self.coupling * ils_offset[0]
+        astig = self.stig_gain * ils_offset
+        magnitude = np.hypot(*astig)
+        sigma_a = np.sqrt(self.sigma0**2 + (defocus + magnitude)**2)
+        sigma_b = np.sqrt(self.sigma0**2 + (defocus - magnitude)**2)
+        theta = np.degrees(np.arctan2(astig[1], astig[0]) / 2)
+        if sigma_a < sigma_b:
+            sigma_a, sigma_b, theta = sigma_b, sigma_a, theta - 90 if theta > 0 else theta + 90
+        return sigma_a, sigma_b, theta
+
+    @property
+    def best_variance(self):
+        return 2 * self.sigma0**2
+
+    def measure(self, il1, ils_x, ils_y):
+        self.calls += 1
+        sigma_x, sigma_y, theta = self.sigmas(il1, ils_x, ils_y)
+        sigma_x *= 1 + self.noise * self.rng.standard_normal()
+        sigma_y *= 1 + self.noise * self.rng.standard_normal()
+        return {"amplitude": 1000.0 * (self.sigma0**2 / (sigma_x * sigma_y)), "xo": 515.0, "yo": 257.0,
+                "sigma_x": sigma_x, "sigma_y": sigma_y, "theta": theta}
+
+
+class SyntheticMicroscope:
+    """
+    TEMClient and GaussianFitterMP stand-ins on a SyntheticLensResponse, to run AutoFocusTask unchanged.
+
+    SetILFocus/SetILs move the synthetic lenses; trigger_capture() measures
+    the beam at the current setting (mode "moments", the settle waits of
+    the task, does not count as a measurement) and returns a finished
+    request. `fits` counts the measurements.
+    """
+    def __init__(self, lens, setting):
+        self.lens = lens
+        self.setting = [int(v) for v in setting]
+        self.fits = 0
+        self.fitting_process = self  # check_process_alive()
+
+    def is_alive(self):
+        return True
+
+    def SetILFocus(self, il1):
+        self.setting[0] = int(il1)
+
+    def SetILs(self, ils_x, ils_y):
+        self.setting[1:] = [int(ils_x), int(ils_y)]
+
+    def trigger_capture(self, roi, lens_state=None, settle=None, mode=None):
+        request = Future()
+        request.lens_state = lens_state
+        request.captured = threading.Event()
+        request.captured.set()
+        request.settled = True if settle else None
+        if mode != "moments":
+            self.fits += 1
+        request.set_result(self.lens.measure(*self.setting))
+        return request
+
+    def wait_result(self, request, timeout=2.0):
+        return request.result(timeout=timeout)
+
+    def cancel_pending(self):
+        pass
+
+
+def run_autofocus(method, lens, start, **kwargs):
+    """
+    Run AutoFocusTask.`method` ("rapid_autofocus", "model_based_autofocus") on a synthetic microscope.
+
+    The task code runs as in the GUI, with the lenses and the fitter
+    replaced by SyntheticMicroscope, so this needs the GUI's dependencies.
+    Returns (setting the lenses are left at, measurements).
+    """
+    from PySide6.QtCore import QObject
+    from ..task.beam_focus_task import AutoFocusTask, SETTLE_CRITERIA
+
+    class SyntheticAutoFocusTask(AutoFocusTask):
+        def __init__(self, microscope):
+            QObject.__init__(self)  # Without Task.__init__: no control worker
+            self.client = self.beam_fitter = microscope
+            self.control = SimpleNamespace(sweepingWorkerReady=True)
+            self.settle_criteria = SETTLE_CRITERIA
+            self.lens_parameters = {"il1": int(start[0]), "ils": [int(start[1]), int(start[2])]}
+            self.results = []
+            self.best_result = None
+            self._current_mode = None
+            self._best_focus = self._best_stigmation = self._best_combined = None
+
+        def current_roi(self):
+            return {"pos": [440, 207], "size": [150, 100]}
+
+    microscope = SyntheticMicroscope(lens, start)
+    logging.disable(logging.CRITICAL)  # The task logs every step
+    try:
+        getattr(SyntheticAutoFocusTask(microscope), method)(int(start[0]), [int(start[1]), int(start[2])], **kwargs)
+    finally:
+        logging.disable(logging.NOTSET)
+    return tuple(microscope.setting), microscope.fits
+
+
+def axis_search(measure, center, steps=((50, 7), (100, 5), (100, 5), (30, 4))):
+    """
+    Idealised one-lens-at-a-time search: the sequence of rapid_autofocus (IL1, ILs x, ILs y, IL1 again) on the beam variance.
+
+    Unlike rapid_autofocus, every step minimises the same objective as the
+    optimizer (rapid_autofocus chooses the stigmation by roundness), so it
+    is the best case of sampling one lens at a time.
+
+    Each (half_range, points) of `steps` samples one lens around the
+    current best, takes the vertex of a parabola through the samples
+    (the best sample if it does not open upward or falls outside) and
+    measures there. Returns (setting, value, measurements).
+    """
+    setting = list(center)
+    count = 0
+    best_value = None
+    for axis, (half_range, points) in zip((0, 1, 2, 0), steps):
+        samples = np.round(setting[axis] + np.linspace(-half_range, half_range, points)).astype(int)
+        values = []
+        for v in samples:
+            trial = list(setting)
+            trial[axis] = int(v)
+            values.append(beam_variance(measure(*trial)))
+            count += 1
+        a, b, _ = np.polyfit(samples, values, 2)
+        vertex = -b / (2 * a) if a > 0 else None
+        if vertex is None or not samples[0] <= vertex <= samples[-1]:
+            vertex = samples[int(np.argmin(values))]
+        setting[axis] = int(round(vertex))
+        best_value = beam_variance(measure(*setting))
+        count += 1
+    return tuple(setting), best_value, count
+
+
+def compare(n_lenses=100, seed=0, noise=0.01):
+    """
+    Model-based autofocus against rapid_autofocus and axis_search on `n_lenses` random synthetic lenses.
+
+    All start from the same setting, on the same lens with the same noise
+    sequence. rapid_autofocus keeps the roundest beam of its stigmation
+    scan, and a synthetic beam in focus is round whatever the astigmatism,
+    so it mostly ends far from the optimum here. Returns one row per lens: measurements and beam variance
+    above the optimum (noise-free, at the setting the lenses are left at)
+    for each method, in that order.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(n_lenses):
+        start = np.array([21780, 32920, 32776])
+        focus = start + rng.uniform(-40, 40, 3).round()
+        sigma0 = rng.uniform(5, 12)
+        noise_seed = int(rng.integers(2**32))
+        row = []
+        for method in ("model_based_autofocus", "rapid_autofocus", "axis_search"):
+            lens = SyntheticLensResponse(focus[0], focus[1:], sigma0=sigma0, noise=noise, rng=np.random.default_rng(noise_seed))
+            if method == "axis_search":
+                setting, _, count = axis_search(lens.measure, start)
+            else:
+                setting, count = run_autofocus(method, lens, start)
+            row += [count, sum(s**2 for s in lens.sigmas(*setting)[:2]) / lens.best_variance - 1]
+        rows.append(row)
+
+    rows = np.array(rows)
+    logging.info(f"Over {n_lenses} synthetic lenses (noise {noise:.0%}):")
+    for k, name in enumerate(("model-based (quadratic surrogate)", "rapid_autofocus", "axis_search")):
+        count, excess = rows[:, 2 * k], rows[:, 2 * k + 1]
+        logging.info(f"  {name:<34} {np.median(count):.0f} measurements (max {count.max():.0f}), beam variance above "
+                     f"the optimum: median {np.median(excess):.1%}, p90 {np.percentile(excess, 90):.1%}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the autofocus methods on synthetic lenses")
+    parser.add_argument("-n", "--lenses", type=int, default=100, help="Number of random synthetic lenses")
+    parser.add_argument("--noise", type=float, default=0.01, help="Relative noise of the measured sigmas")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    compare(args.lenses, args.seed, args.noise)
+
+
+if __name__ == "__main__":
+    main()
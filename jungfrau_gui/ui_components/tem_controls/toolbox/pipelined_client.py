@@ -0,0 +1,136 @@
+import json
+import time
+import logging
+import threading
+import zmq
+
+
+def server_call(method_name, args):
+    """
+    Function of the TEM server behind a client call: client._send_message(name, *args)
+    asks the server for `name` directly, client.<name>(*args) for `name`.
+    """
+    if method_name == "_send_message":
+        return args[0], tuple(args[1:])
+    return method_name, tuple(args)
+
+
+def encode_request(function, args):
+    """Request in the JSON format of the stand-in TEM server (toolbox/tem_standin_server.py)"""
+    return json.dumps({"function": function, "args": list(args)}).encode()
+
+
+def decode_reply(frame):
+    return json.loads(frame)
+
+
+class PipelinedTEMClient:
+    """
+    Benchmark client for the stand-in TEM server that sends a batch of queries
+    back-to-back and then collects the answers, so a batch costs about one
+    network round trip plus the server time instead of one round trip per
+    query.
+
+    A DEALER socket sends each request with the empty delimiter frame a
+    REQ socket would add. A REP server therefore handles them one after the
+    other and answers in the order of the batch. A server that does not
+    answer every request of the first batch within `probe_timeout_s` in
+    this JSON format is taken as not supporting pipelining. From then on
+    `supported` is False and call_batch() returns None, and the caller
+    falls back to sequential calls.
+
+    Benchmark only: the requests use the JSON format of
+    tem_standin_server.py, not the wire format of simple_tem's TEMClient,
+    so the GUI does not use this client and it cannot talk to the
+    microscope's TEM server. The stand-in measures what pipelining the
+    #more queries would gain.
+    """
+    def __init__(self, host, port, timeout_s=1.0, probe_timeout_s=2.0):
+        self.endpoint = f"tcp://{host}:{port}"
+        self.timeout_s = timeout_s
+        self.probe_timeout_s = probe_timeout_s
+        self.supported = None  # Unknown until the first batch
+        self.context = zmq.Context.instance()
+        self.socket = None
+        self._lock = threading.Lock()  # One batch on the socket at a time
+        self.batches = 0
+        self.resets = 0
+
+    def _connect(self):
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.endpoint)
+
+    def call_batch(self, calls, timeout_s=None):
+        """
+        Values of the client calls [(method_name, args), ...], each with the time
+        of its answer since the batch was sent, [(value, seconds), ...]; None for
+        the value of a query not answered in time. None if the server does not
+        support pipelining.
+        """
+        if self.supported is False:
+            return None
+        if not calls:
+            return []
+        # A single request tells nothing about pipelining, the first batch of several does
+        probing = self.supported is None and len(calls) > 1
+        timeout_s = self.probe_timeout_s if probing else (timeout_s or self.timeout_s)
+        with self._lock:
+            results, undecodable = self._exchange(calls, timeout_s)
+        self.batches += 1
+        if probing:
+            if len(results) < len(calls) or undecodable:
+                self.supported = False
+                logging.warning(f"TEM server at {self.endpoint} does not answer pipelined queries, querying one at a time")
+                return None
+            self.supported = True
+            logging.info(f"TEM server at {self.endpoint} answers pipelined queries")
+        if len(results) < len(calls):
+            logging.warning(f"Pipelined TEM batch: {len(calls) - len(results)} of {len(calls)} queries not answered "
+                            f"within {timeout_s:.1f} s")
+            results += [(None, timeout_s)] * (len(calls) - len(results))
+        return results
+
+    def call(self, method_name, args=(), timeout_s=None):
+        """Value of one client call (None if not answered in time), a plain request/reply round trip"""
+        with self._lock:
+            results, _ = self._exchange([(method_name, args)], timeout_s or self.timeout_s)
+        return results[0][0] if results else None
+
+    def _exchange(self, calls, timeout_s):
+        if self.socket is None:
+            self._connect()
+        tic = time.perf_counter()
+        results = []
+        undecodable = 0
+        try:
+            for method_name, args in calls:
+                self.socket.send_multipart([b"", encode_request(*server_call(method_name, args))])
+            deadline = tic + timeout_s
+            while len(results) < len(calls):
+                remaining_ms = int(1e3 * (deadline - time.perf_counter()))
+                if remaining_ms <= 0 or not self.socket.poll(remaining_ms):
+                    break
+                frames = self.socket.recv_multipart()
+                try:
+                    value = decode_reply(frames[-1])
+                except ValueError:
+                    logging.warning(f"Pipelined TEM batch: undecodable answer {frames[-1][:40]!r}")
+                    value = None
+                    undecodable += 1
+                results.append((value, time.perf_counter() - tic))
+        except zmq.ZMQError as e:
+            logging.error(f"Pipelined TEM batch failed: {e}")
+        if len(results) < len(calls):
+            # Answers still on their way belong to the abandoned batch: a new socket does not get them
+            self.close()
+            self.resets += 1
+        return results, undecodable
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.socket = None
+
+    def __str__(self) -> str:
+        return "PipelinedTEMClient"
@@ -0,0 +1,90 @@
+import time
+import numpy as np
+
+
+class SettleDetector:
+    """
+    Tells from the moment estimates (roi_moments) of consecutive frames when the beam has
+    settled after a lens change.
+
+    The beam is settled once `frames` consecutive estimates each moved by
+    less than `max_shift` pixels and changed each sigma by less than the
+    fraction `max_sigma_change` of the previous one. Both tolerances are
+    widened to `noise_sigmas` times the shot noise of the estimates: with N
+    counts in the beam (amplitude * 2 pi sigma_x sigma_y) the centroid of
+    one frame scatters by sigma / sqrt(N) and each sigma by a fraction
+    1 / sqrt(2 N), so a weak beam at rest is not taken for a moving one.
+    Frames without an
+    estimate (no signal in the ROI) start the count again. `timeout_s`
+    after the detector was created (or reset) it gives up: expired()
+    becomes True and the caller proceeds with the last frame.
+
+    Keyword arguments only, so the criteria can be sent as a dict (see
+    GaussianFitterMP.trigger_capture).
+    """
+    def __init__(self, *, max_shift=0.5, max_sigma_change=0.02, frames=2, timeout_s=1.0, noise_sigmas=3.0):
+        self.max_shift = max_shift
+        self.max_sigma_change = max_sigma_change
+        self.noise_sigmas = noise_sigmas
+        self.frames = frames
+        self.timeout_s = timeout_s
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.previous = None
+        self.stable = 0  # Consecutive estimates within tolerance of their predecessor
+        self.seen = 0
+
+    def update(self, values):
+        """Estimate of the next frame (roi_moments dict, or None); True once the beam has settled"""
+        self.seen += 1
+        if values is None:
+            self.previous, self.stable = None, 0
+            return False
+        if self.previous is not None and self._close(self.previous, values):
+            self.stable += 1
+        else:
+            self.stable = 0
+        self.previous = values
+        return self.settled
+
+    @staticmethod
+    def counts(values):
+        """Counts in the beam of a roi_moments estimate"""
+        return values['amplitude'] * 2 * np.pi * values['sigma_x'] * values['sigma_y']
+
+    def tolerances(self, old, new):
+        """(shift in pixels, relative sigma change) allowed between the estimates old and new"""
+        counts = min(self.counts(old), self.counts(new))
+        if not counts > 0:
+            return self.max_shift, self.max_sigma_change
+        # Difference of two independent estimates: sqrt(2) times the noise of one
+        noise_shift = np.sqrt(2) * max(old['sigma_x'], old['sigma_y']) / np.sqrt(counts)
+        noise_sigma = 1 / np.sqrt(counts)
+        return (max(self.max_shift, self.noise_sigmas * noise_shift),
+                max(self.max_sigma_change, self.noise_sigmas * noise_sigma))
+
+    def _close(self, old, new):
+        max_shift, max_sigma_change = self.tolerances(old, new)
+        if np.hypot(new['xo'] - old['xo'], new['yo'] - old['yo']) > max_shift:
+            return False
+        # Compare the semi-axes, not sigma_x/sigma_y: they swap when the beam goes through round
+        for a, b in zip(sorted((old['sigma_x'], old['sigma_y'])), sorted((new['sigma_x'], new['sigma_y']))):
+            if abs(b - a) > max_sigma_change * a:
+                return False
+        return True
+
+    @property
+    def settled(self):
+        return self.stable >= self.frames
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def expired(self):
+        return self.elapsed >= self.timeout_s
+
+    def __repr__(self):
+        return f"SettleDetector(settled={self.settled}, frames seen={self.seen}, {self.elapsed * 1e3:.0f} ms)"
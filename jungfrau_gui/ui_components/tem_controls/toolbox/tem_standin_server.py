@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the TEM server, to measure pipelined queries offline.
+
+It answers the queries of tools.MORE_QUERIES / INFO_QUERIES / INIT_QUERIES
+with fixed plausible values in the JSON format of PipelinedTEMClient. Each
+query takes `server_ms` of server time, handled one at a time like the real
+server. Each answer is delayed by `rtt_ms` on top, without blocking the
+server, as a network round trip would be. With pipelining=False it behaves
+like a server that reads one request at a time: a request arriving while an
+answer is pending is dropped.
+
+The benchmark runs the #more plan sequentially (one round trip per query)
+and pipelined (one batch). It is a measurement only: the GUI queries the
+microscope one call at a time through simple_tem's TEMClient, whose wire
+format PipelinedTEMClient does not speak.
+
+    python -m jungfrau_gui.ui_components.tem_controls.toolbox.tem_standin_server --rtt-ms 2 --server-ms 0.3
+"""
+import json
+import time
+import heapq
+import logging
+import argparse
+import threading
+import numpy as np
+import zmq
+
+from . import tool as tools
+from ..query_plan import QueryPlan
+from .pipelined_client import PipelinedTEMClient
+
+VALUES = {
+    "GetStagePosition": [120.5, -340.2, 15.0, 0.3, 0.0],
+    "GetStageStatus": [0, 0, 0, 0, 0],
+    "GetMagValue": [20000, "X", "X20k"],
+    "GetFunctionMode": [0, "MAG"],
+    "GetBeamBlank": 0,
+    "Getf1OverRateTxNum": 2,
+    "GetApertureSize_CL": 2,
+    "GetApertureSize_SA": 1,
+    "GetApertureKind": 1,
+    "GetAperturePosition": [1024, 2048],
+    "GetSpotSize": 3,
+    "GetAlpha": 2,
+    "GetCL3": 40000,
+    "GetIL1": 21902,
+    "GetOLf": 32768,
+    "GetIL3": 30000,
+    "GetOLc": 32768,
+    "GetILs": [32768, 32768],
+    "GetPLA": [32768, 32768],
+    "GetMovementValueMeasurementMethod": 0,
+    "GetHtValue": 200000.0,
+}
+
+
+class StandInTEMServer(threading.Thread):
+    """ROUTER socket on `port` answering the TEM queries; stop() ends it"""
+    def __init__(self, port=0, rtt_ms=2.0, server_ms=0.3, pipelining=True):
+        super().__init__(name="Stand-in TEM server", daemon=True)
+        self.rtt_s = rtt_ms / 1e3
+        self.server_s = server_ms / 1e3
+        self.pipelining = pipelining
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        if port:
+            self.socket.bind(f"tcp://127.0.0.1:{port}")
+            self.port = port
+        else:
+            self.port = self.socket.bind_to_random_port("tcp://127.0.0.1")
+        self._stopping = threading.Event()
+        self.answered = 0
+        self.dropped = 0
+
+    def answer(self, request):
+        message = json.loads(request)
+        if self.server_s:
+            time.sleep(self.server_s)
+        return VALUES.get(message["function"])
+
+    def run(self):
+        pending = []  # Heap of (due time, order, frames) of the answers on their way
+        order = 0
+        busy = set()  # Peers with an answer pending, when pipelining is off
+        while not self._stopping.is_set():
+            timeout_ms = 50 if not pending else max(0.0, 1e3 * (pending[0][0] - time.perf_counter()))
+            if self.socket.poll(timeout_ms):
+                peer, *envelope, request = self.socket.recv_multipart()
+                if not self.pipelining and peer in busy:
+                    self.dropped += 1
+                    continue
+                busy.add(peer)
+                reply = json.dumps(self.answer(request)).encode()
+                heapq.heappush(pending, (time.perf_counter() + self.rtt_s, order, [peer, *envelope, reply]))
+                order += 1
+            while pending and pending[0][0] <= time.perf_counter():
+                frames = heapq.heappop(pending)[2]
+                self.socket.send_multipart(frames)
+                busy.discard(frames[0])
+                self.answered += 1
+        self.socket.close(linger=0)
+
+    def stop(self):
+        self._stopping.set()
+        self.join(1)
+
+
+def benchmark(repeats=20, rtt_ms=2.0, server_ms=0.3, pipelining=True, queries=tools.MORE_QUERIES):
+    """Mean and max wall time (ms) of the plan of `queries`, sequential and pipelined"""
+    server = StandInTEMServer(rtt_ms=rtt_ms, server_ms=server_ms, pipelining=pipelining)
+    server.start()
+    client = PipelinedTEMClient("127.0.0.1", server.port)
+
+    plan = QueryPlan("#more", queries, tools.full_mapping, client.call)
+    calls = [(q.method_name, q.args) for q in plan.queries]
+
+    def pipelined():
+        tic = time.perf_counter()
+        answers = client.call_batch(calls)
+        if answers is None:  # No pipelining: one query at a time
+            return plan.run(), time.perf_counter() - tic
+        return {q.query: val for q, (val, _) in zip(plan.queries, answers)}, time.perf_counter() - tic
+
+    def sequential():
+        results = plan.run()
+        return results, plan.last_run_s
+
+    report = {}
+    try:
+        for name, run in (("sequential", sequential), ("pipelined", pipelined)):
+            times, failures = [], 0
+            for _ in range(repeats):
+                results, elapsed = run()
+                times.append(1e3 * elapsed)
+                failures += sum(v is None for v in results.values())
+            report[name] = {"mean_ms": float(np.mean(times)), "max_ms": float(np.max(times)), "failures": failures}
+    finally:
+        client.close()
+        server.stop()
+    report["pipelining_supported"] = client.supported
+    report["queries"] = len(queries)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in TEM server and benchmark of pipelined queries")
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="Simulated network round trip per answer")
+    parser.add_argument("--server-ms", type=float, default=0.3, help="Server time per query")
+    parser.add_argument("-n", "--repeats", type=int, default=20, help="Runs of the #more plan per mode")
+    parser.add_argument("--no-pipelining", action="store_true", help="Serve one request at a time (client falls back)")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Only run the stand-in server on PORT")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.serve:
+        server = StandInTEMServer(args.serve, args.rtt_ms, args.server_ms, not args.no_pipelining)
+        server.start()
+        print(f"Stand-in TEM server on tcp://127.0.0.1:{server.port}, Ctrl-C to stop")
+        try:
+            while server.is_alive():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            server.stop()
+        return
+
+    report = benchmark(args.repeats, args.rtt_ms, args.server_ms, not args.no_pipelining)
+    print(f"#more ({report['queries']} queries), RTT {args.rtt_ms} ms, server {args.server_ms} ms per query, "
+          f"pipelining supported: {report['pipelining_supported']}")
+    for name in ("sequential", "pipelined"):
+        r = report[name]
+        print(f"  {name:<10} mean {r['mean_ms']:7.2f} ms   max {r['max_ms']:7.2f} ms   failed queries {r['failures']}")
+    print(f"  speed-up   {report['sequential']['mean_ms'] / report['pipelined']['mean_ms']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
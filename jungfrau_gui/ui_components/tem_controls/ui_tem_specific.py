@@ -250,6 +250,9 @@ class TEMTasks(QGroupBox):
             self.beamAutofocus.setEnabled(False)
             self.fast_autofocus_checkbox = QCheckBox("fast", self)
             self.fast_autofocus_checkbox.setChecked(True)
+            self.model_autofocus_checkbox = QCheckBox("model", self)
+            self.model_autofocus_checkbox.setChecked(False)
+            self.model_autofocus_checkbox.setToolTip("Focus and stigmate jointly with a quadratic model of the beam size (fewer lens moves)")
 
         self.popup_checkbox = self.parent.checkbox
         self.plotDialog = self.parent.plotDialog
@@ -322,6 +325,7 @@ class TEMTasks(QGroupBox):
             layout_Beam_buttons.addWidget(self.btnGaussianFit           ,0,0,1,4)
             layout_Beam_buttons.addWidget(self.beamAutofocus            ,0,4,1,4)
             layout_Beam_buttons.addWidget(self.fast_autofocus_checkbox  ,0,8,1,1)
+            layout_Beam_buttons.addWidget(self.model_autofocus_checkbox ,0,9,1,1)
         else:
             layout_Beam_buttons.addWidget(self.btnGaussianFit           ,0,0)
 
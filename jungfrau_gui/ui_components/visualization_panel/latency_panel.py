@@ -0,0 +1,74 @@
+import time
+import logging
+import numpy as np
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtWidgets import (QGroupBox, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
+                               QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog)
+
+from ...latency import STAGES
+
+
+class LatencyPanel(QGroupBox):
+    """Rolling p50/p95/p99 of each display stage of a LatencyTracker, refreshed once per second."""
+    COLUMNS = ("n", "p50 ms", "p95 ms", "p99 ms")
+
+    def __init__(self, tracker, parent=None):
+        super().__init__(parent)
+        self.tracker = tracker
+        self.initUI()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+
+    def initUI(self):
+        layout = QVBoxLayout()
+        layout.setContentsMargins(2, 2, 2, 2)
+
+        self.table = QTableWidget(len(STAGES), len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setVerticalHeaderLabels(STAGES)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.setMaximumHeight(26 * (len(STAGES) + 1))
+        for row in range(len(STAGES)):
+            for col in range(len(self.COLUMNS)):
+                item = QTableWidgetItem("-")
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, col, item)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        self.frames_label = QLabel("0 frames", self)
+        reset_button = QPushButton("Reset", self)
+        reset_button.clicked.connect(self.reset)
+        dump_button = QPushButton("Dump CSV", self)
+        dump_button.clicked.connect(self.dump_csv)
+        buttons.addWidget(self.frames_label, 2)
+        buttons.addWidget(reset_button, 1)
+        buttons.addWidget(dump_button, 1)
+        layout.addLayout(buttons)
+
+        self.setLayout(layout)
+
+    def refresh(self):
+        if not self.table.isVisible():
+            return
+        summary = self.tracker.summary()
+        for row, stage in enumerate(STAGES):
+            n, p50, p95, p99 = summary[stage]
+            values = (str(n),) + tuple("-" if np.isnan(v) else f"{v:.2f}" for v in (p50, p95, p99))
+            for col, text in enumerate(values):
+                self.table.item(row, col).setText(text)
+        self.frames_label.setText(f"{min(self.tracker.count, self.tracker.window)} frames in window")
+
+    def reset(self):
+        self.tracker.reset()
+        self.refresh()
+
+    def dump_csv(self):
+        default = time.strftime("latency_%Y%m%d-%H%M%S.csv", time.localtime())
+        path, _ = QFileDialog.getSaveFileName(self, "Save latency samples", default, "CSV files (*.csv)")
+        if path:
+            n = self.tracker.dump_csv(path)
+            logging.info(f"Wrote {n} frame latencies to {path}")
@@ -1,6 +1,4 @@
-import logging
-import numpy as np 
-from ... import globals
+import time
 
 from PySide6.QtCore import QObject, Signal, Slot
 
@@ -8,22 +6,36 @@ from PySide6.QtCore import QObject, Signal, Slot
 class Reader(QObject):
     finished = Signal(object, object)  # Signal to indicate completion and carry results
 
-    def __init__(self, receiver):
+    def __init__(self, slot, accumulator=None, renderer=None, histogram=None):
         super(Reader, self).__init__()
         self.task_name = "Stream Reader"
-        self.receiver = receiver
+        self.slot = slot
+        self.accumulator = accumulator  # FrameAccumulator fed with each displayed frame, None when off
+        self.show_sum = False  # Display the rolling sum instead of the single frame
+        self.renderer = renderer  # FrameRenderer producing the display indices, so the GUI thread only uploads them
+        self.histogram = histogram  # FrameHistogram for auto-contrast and the histogram widget
     
     # @profile
     @Slot()
     def run(self):
-        image, frame_nb = self.receiver.get_frame_jfj()  # Retrieve image and header
+        frame = self.slot.take()  # Newest frame left by the ingest thread, never blocks
+        if frame is None:
+            self.finished.emit(None, None)
+            return
+        if frame.stamps is not None:
+            frame.stamps["taken"] = time.perf_counter_ns()
                
-        if globals.accframes > 0:
-            logging.info(f'{globals.accframes} frames to add ')
-            tmp = np.copy(image)
-            globals.acc_image += tmp
-            globals.accframes -= 1            
-        self.finished.emit(image, frame_nb)  # Emit signal with results
+        accumulator = self.accumulator
+        if accumulator is not None:
+            accumulator.push(frame.array)
+            if self.show_sum:
+                # The frame is not shared yet, its buffer can take the sum: no extra frame-sized array
+                accumulator.read_sum(out=frame.array)
+        if self.histogram is not None:
+            frame.histogram = self.histogram.compute(frame.array)
+        if self.renderer is not None and self.renderer.render(frame) and frame.stamps is not None:
+            frame.stamps["rendered"] = time.perf_counter_ns()
+        self.finished.emit(frame, frame.frame_nr)  # Emit signal with results, the receiver of the signal owns the frame
 
     def __str__(self) -> str:
         return "Stream Reader"
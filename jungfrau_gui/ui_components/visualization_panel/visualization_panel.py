@@ -11,6 +11,10 @@ from PySide6.QtWidgets import ( QGroupBox, QVBoxLayout, QHBoxLayout, QLineEdit,
 from epoc import ConfigurationClient, auth_token, redis_host
 
 from .reader import Reader
+from .latency_panel import LatencyPanel
+from ...latency import LatencyTracker
+from ...stream_ingest import StreamIngest, FrameBusIngest
+from ...frame_accumulator import FrameAccumulator
 
 from ... import globals
 from ...ui_components.toggle_button import ToggleButton
@@ -58,6 +62,11 @@ class VisualizationPanel(QGroupBox):
         self.cfg =  ConfigurationClient(redis_host(), token=auth_token())
         self.receiver_client =  None
         self.jfjoch_client = None
+        self.displayed_frame = None  # Pooled FrameBuffer currently shown by imageItem
+        self.latency = LatencyTracker()
+        self.pending_paint = None  # (frame_nr, stamps) of the frame set on imageItem but not painted yet
+        self.accumulator = FrameAccumulator((globals.nrow, globals.ncol), depth=0)  # Rolling sum of the streamed frames, no rings while Off
+        self.hook_image_paint()
         self.lut = cfg_jf.lut()
 
         # Thread pool for running check tasks in separate threads
@@ -133,6 +142,33 @@ class VisualizationPanel(QGroupBox):
         time_interval_layout.addWidget(time_interval)
         time_interval_layout.addWidget(self.update_interval)
         section_visual.addLayout(time_interval_layout)
+
+        rolling_sum = QLabel("Rolling sum (frames):", self)
+        self.rolling_sum = QSpinBox(self)
+        self.rolling_sum.setRange(0, self.accumulator.max_depth)  # Longest window fitting in memory, at most 1000
+        self.rolling_sum.setSpecialValueText("Off")
+        self.rolling_sum.setValue(0)
+        self.rolling_sum.setKeyboardTracking(False)
+        self.rolling_sum.setToolTip("Display the sum of the last N frames of the stream (Off: single frames)")
+        # Resizing reallocates the window: applied once the value settles, not at every arrow step
+        self.rolling_sum_timer = QTimer(self)
+        self.rolling_sum_timer.setSingleShot(True)
+        self.rolling_sum_timer.setInterval(300)
+        self.rolling_sum_timer.timeout.connect(lambda: self.set_rolling_sum(self.rolling_sum.value()))
+        self.rolling_sum.valueChanged.connect(lambda _: self.rolling_sum_timer.start())
+        self.rolling_sum.editingFinished.connect(self.apply_rolling_sum)
+        rolling_sum_layout = QHBoxLayout()
+        rolling_sum_layout.addWidget(rolling_sum)
+        rolling_sum_layout.addWidget(self.rolling_sum)
+        section_visual.addLayout(rolling_sum_layout)
+
+        self.latency_panel = LatencyPanel(self.latency, self)
+        self.latency_panel.setTitle("Display latency")
+        self.latency_panel.setCheckable(True)
+        self.latency_panel.setChecked(False)
+        self.latency_panel.toggled.connect(lambda on: self.latency_panel.table.setVisible(on))
+        self.latency_panel.table.setVisible(False)
+        section_visual.addWidget(self.latency_panel)
         
         if globals.dev:
             frame_sum = QLabel("Frames summed:", self)
@@ -683,9 +719,17 @@ class VisualizationPanel(QGroupBox):
 
     def toggle_viewStream(self):
         if not self.stream_view_button.started:
+            # The ingest thread drains the stream continuously, the reader only picks up its latest frame
+            if globals.framebus:
+                self.ingest = FrameBusIngest(globals.framebus, self.parent.receiver.pool)
+            else:
+                self.ingest = StreamIngest(self.parent.receiver)
+            self.ingest.start()
             self.thread_read = QThread()
             self.thread_read.setObjectName("Frame_Reader Thread")
-            self.streamReader = Reader(self.parent.receiver)
+            self.streamReader = Reader(self.ingest.slot, renderer=self.parent.imageItem.renderer,
+                                       histogram=self.parent.imageItem.histogram)
+            self.set_rolling_sum(self.rolling_sum.value())
             self.parent.threadWorkerPairs.append((self.thread_read, self.streamReader))                              
             self.initializeWorker(self.thread_read, self.streamReader) # Initialize the worker thread and fitter
             self.thread_read.start()
@@ -713,6 +757,7 @@ class VisualizationPanel(QGroupBox):
             # Properly stop and cleanup worker and thread  
             self.parent.stopWorker(self.thread_read, self.streamReader)
             self.streamReader, self.thread_read = thread_manager.reset_worker_and_thread(self.streamReader, self.thread_read)
+            self.ingest.stop()
             # Wait for thread to actually stop
             if self.thread_read is not None:
                 logging.info("** Read-thread forced to sleep **")
@@ -720,6 +765,28 @@ class VisualizationPanel(QGroupBox):
             if self.parent.autoContrastBtn.started:
                 self.parent.toggle_autoContrast()
 
+    def apply_rolling_sum(self):
+        if self.rolling_sum_timer.isActive():
+            self.rolling_sum_timer.stop()
+            self.set_rolling_sum(self.rolling_sum.value())
+
+    def set_rolling_sum(self, depth):
+        # The reader pushes into the accumulator from its thread; resize() allocates outside its lock
+        reader = getattr(self, 'streamReader', None)
+        if depth == 0:
+            if reader is not None:
+                reader.show_sum = False
+                reader.accumulator = None
+            if self.accumulator.depth:
+                self.accumulator.resize(0)  # Frees the rings
+                logging.info("Rolling sum off")
+            return
+        self.accumulator.resize(depth)  # Only resets when the depth does not change
+        logging.info(f"Displaying the rolling sum of {self.accumulator.depth} frames")
+        if reader is not None:
+            reader.accumulator = self.accumulator
+            reader.show_sum = True
+
     def initializeWorker(self, thread, worker):
         thread_manager.move_worker_to_thread(thread, worker)
         worker.finished.connect(self.updateUI)
@@ -733,7 +800,36 @@ class VisualizationPanel(QGroupBox):
             self.readerWorkerReady = False
             QMetaObject.invokeMethod(self.streamReader, "run", Qt.QueuedConnection)
 
-    def updateUI(self, image, frame_nr):
-        self.parent.imageItem.setImage(image, autoRange = False, autoLevels = False, autoHistogramRange = False)
+    def hook_image_paint(self):
+        # Wrap ImageItem.paint to stamp when a streamed frame actually reaches the screen
+        imageItem = self.parent.imageItem
+        original_paint = imageItem.paint
+        def timed_paint(*args, **kwargs):
+            original_paint(*args, **kwargs)
+            if self.pending_paint is not None:
+                frame_nr, stamps = self.pending_paint
+                self.pending_paint = None
+                stamps["painted"] = time.perf_counter_ns()
+                self.latency.record(frame_nr, stamps)
+        imageItem.paint = timed_paint
+
+    def updateUI(self, frame, frame_nr):
+        if frame is None:
+            # No new frame since the last tick, keep the current one on screen
+            return
+        stamps = frame.stamps
+        if stamps is not None:
+            stamps["gui"] = time.perf_counter_ns()
+        self.parent.imageItem.setFrame(frame)
+        if stamps is not None:
+            stamps["set_image"] = time.perf_counter_ns()
+            if self.pending_paint is not None:
+                # Replaced before it was painted, keep what was measured
+                self.latency.record(*self.pending_paint)
+            self.pending_paint = (frame_nr, stamps)
+        # The pooled buffer on screen is held until the next frame replaces it
+        previous, self.displayed_frame = self.displayed_frame, frame
+        if previous is not None:
+            previous.release()
         if frame_nr is not None:
-            self.parent.statusBar().showMessage(f'Frame: {frame_nr}')
\ No newline at end of file
+            self.parent.statusBar().showMessage(f'Frame: {frame_nr}   [{self.ingest.stats}]')
\ No newline at end of file
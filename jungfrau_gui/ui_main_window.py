@@ -11,17 +11,16 @@ from PySide6.QtCore import Qt, QObject, QEvent, QTimer
 from PySide6.QtGui import QShortcut, QKeySequence
 from .ui_components.visualization_panel.visualization_panel import VisualizationPanel
 from .ui_components.tem_controls.tem_controls import TemControls
+from .ui_components.tem_controls.toolbox.fit_beam_intensity import create_roi_coord_tuple
 from .ui_components.file_operations.file_operations import FileOperations
 from .ui_components.utils import create_gaussian
 from .ui_components.toggle_button import ToggleButton
+from .ui_components.stream_image_item import StreamImageItem
 
 import jungfrau_gui.ui_threading_helpers as thread_manager
 
 from importlib import resources
 
-from boost_histogram import Histogram
-from boost_histogram.axis import Regular
-
 from epoc import ConfigurationClient, auth_token, redis_host
 
 from PySide6.QtGui import QFont
@@ -85,7 +84,7 @@ class ApplicationWindow(QMainWindow):
         self.dock.addWidget(self.glWidget)
         
         self.histogram = pg.HistogramLUTItem()
-        self.imageItem = pg.ImageItem()
+        self.imageItem = StreamImageItem()
         # self.imageItem.setOpts(nanMask=True)
         self.plot.addItem(self.imageItem)
         self.histogram.setImageItem(self.imageItem)
@@ -114,6 +113,7 @@ class ApplicationWindow(QMainWindow):
         self.roi.addScaleHandle([0.5, 0], [0.5, 0.5])
         self.roi.addScaleHandle([1, 0.5], [0.5, 0.5])
         self.roi.sigRegionChanged.connect(self.roiChanged)
+        self.roi_coords = create_roi_coord_tuple(self.roi.pos(), self.roi.size())
 
         # Initial data (optional)
         data = create_gaussian(1000, globals.ncol, globals.nrow, 30, 15, np.deg2rad(35))
@@ -241,40 +241,13 @@ class ApplicationWindow(QMainWindow):
             self.prev_low_thresh = None
             self.prev_high_thresh = None
 
-    # Cache for computed values to avoid unnecessary recalculations
-    @property
-    def cached_image_data(self):
-        if not hasattr(self, '_cached_image') or self._cached_image is None or id(self.imageItem.image) != self._cached_image_id:
-            self._cached_image = self.imageItem.image
-            self._cached_image_id = id(self.imageItem.image)
-            # Pre-compute the filtered data to avoid repeated filtering
-            self._filtered_data = self._cached_image[self._cached_image < np.iinfo('int32').max-1]
-        return self._filtered_data
-
-    def applyAutoContrast(self, histo_boost=False):
-        # Early exit if image doesn't exist
-        if self.imageItem.image is None or self.imageItem.image.size == 0:
+    def applyAutoContrast(self):
+        # 1% - 99.999% of the valid pixels, from the histogram computed with the frame on the reader thread
+        levels = self.imageItem.contrastLevels((0.01, 0.99999))
+        if levels is None:
             return
-        
-        if histo_boost:
-            # Use a more efficient histogram approach 
-            data_flat = self.cached_image_data
-            
-            # Use numpy's histogram function instead of custom Histogram class
-            hist, bin_edges = np.histogram(data_flat, bins=1000)
-            cumsum = np.cumsum(hist)
-            total = cumsum[-1]
-            
-            # Find thresholds using numpy's optimized functions
-            low_idx = np.searchsorted(cumsum, total * 0.01)
-            high_idx = np.searchsorted(cumsum, total * 0.99999)
-            
-            low_thresh = bin_edges[low_idx]
-            high_thresh = bin_edges[high_idx]
-        else:
-            # Use numpy's optimized percentile function directly on filtered data
-            low_thresh, high_thresh = np.percentile(self.cached_image_data, (1, 99.999))
-        
+        low_thresh, high_thresh = levels
+
         # Only update the levels if thresholds differ significantly
         if self._should_update_levels_fast(low_thresh, high_thresh):
             self.histogram.setLevels(low_thresh, high_thresh)
@@ -316,6 +289,11 @@ class ApplicationWindow(QMainWindow):
         self.roi.setPos([correctedPosX, correctedPosY], update=False)
         self.roi.setSize([correctedSizeX, correctedSizeY], update=False)
         logging.debug(f"ROI Position: {self.roi.pos()}, Size: {self.roi.size()}")
+        # Dragging emits for sub-pixel moves too, the fit plan only depends on the pixel bounds
+        roi_coords = create_roi_coord_tuple(self.roi.pos(), self.roi.size())
+        if roi_coords != self.roi_coords:
+            self.roi_coords = roi_coords
+            self.tem_controls.invalidateFitPlan()
 
     def imageHoverEvent(self, event):
         im = self.imageItem.image
@@ -4,7 +4,8 @@ import logging
 import numpy as np
 from . import globals
 import cbor2
-from .decoder import tag_hook
+from .decoder import tag_hook, decode_image_message, FastDecodeError
+from .frame_pool import FramePool
 
 
 # Receiver of the ZMQ stream
@@ -12,11 +13,16 @@ class ZmqReceiver:
     def __init__(self, endpoint, 
                  timeout_ms = 10, 
                  dtype = np.float32,
-                 hwm = 2):
+                 hwm = 2,
+                 pool_size = 6,
+                 fast_decode = True):
         self.endpoint = endpoint
         self.timeout_ms = timeout_ms
         self.dt = dtype
         self.hwm = hwm
+        self.fast_decode = fast_decode
+        # Decoded frames live in reusable buffers, released by their consumers
+        self.pool = FramePool((globals.nrow, globals.ncol), dtype=dtype, size=pool_size)
         self.context = zmq.Context()
         self.socket = None
         self.setup_socket()
@@ -47,42 +53,94 @@ class ZmqReceiver:
     @log_first_success
     def get_frame_jfj(self):
         if not globals.exit_flag.value:
-            try:
-                msg = self.socket.recv()
-                msg = cbor2.loads(msg, tag_hook=tag_hook)
-                logging.debug(f"*********** message type is: {msg['type']} **************")
-                if msg['type'] == "start":
-                    # Process and log the header message
-                    logging.debug(f"Received header: {msg}")
-                    return None, None
-                elif msg['type'] == "image": 
-                    # Process data messages   
-                    logging.debug(f"Got: {msg['series_id']}:{[msg['image_id']]}")
-                    raw_data = msg['data']['default']
-                    frame_nr = msg['image_id']
-                    
-                    # Identify invalid values (min_int32)
-                    min_int32 = np.iinfo(np.int32).min
-                    mask = (raw_data == min_int32)
-
-                    image = raw_data.astype(self.dt).reshape(globals.nrow, globals.ncol)
-                    
-                    #Replace invalid values with np.nan
-                    image[mask] = np.nan
-                    
-                    return image, frame_nr
-                elif msg['type'] == "end":
-                    logging.debug(f"Received End message: {msg}")
-                    return None, None
-                else:
-                    logging.warning(f"Unindentified message type: {msg['type']}")
-                    return None, None
-            except zmq.error.Again:
-                # self.reconnect()
+            msg = self.recv_message()
+            if msg is None:
                 return None, None
+            frame, frame_nr = self.decode_message(msg)
+            if frame is None:
+                return None, None
+            # Hand out a plain array, the pooled buffer goes straight back
+            image = frame.array.copy()
+            frame.release()
+            return image, frame_nr
+
+    def recv_message(self, flags=0):
+        """
+        Receive one raw CBOR message from the socket.
+
+        Blocks for at most `timeout_ms` (or not at all with flags=zmq.NOBLOCK)
+        and returns None when nothing is queued.
+        """
+        try:
+            return self.socket.recv(flags=flags)
+        except zmq.error.Again:
+            # self.reconnect()
+            return None
+        except Exception as e:
+            logging.error(f"An unexpected error occurred: {e}")
+            return None
+
+    def decode_message(self, msg, t_recv=None):
+        """
+        Decode a raw CBOR message into (frame, frame_nr); (None, None) for non-image messages.
+
+        `frame` is a FrameBuffer of self.pool: the caller owns it and must release() it.
+        Image messages go through the fast path of decoder.py, anything else (or an
+        image message it cannot parse) through cbor2.
+        The frame carries perf_counter_ns() stamps of each step (see latency.py),
+        `t_recv` being when the message came off the socket.
+        """
+        t0 = time.perf_counter_ns()
+        stamps = {"recv": t_recv if t_recv is not None else t0, "decode_start": t0}
+        if self.fast_decode:
+            try:
+                image = decode_image_message(msg, stamps=stamps)
+                if image is not None:
+                    stamps["decoded"] = time.perf_counter_ns()
+                    return self.fill_frame(image.data, image.image_id, stamps)
+            except FastDecodeError as e:
+                logging.debug(f"Fast decode failed ({e}), falling back to cbor2")
             except Exception as e:
                 logging.error(f"An unexpected error occurred: {e}")
                 return None, None
+        try:
+            msg = cbor2.loads(msg, tag_hook=tag_hook)
+            logging.debug(f"*********** message type is: {msg['type']} **************")
+            if msg['type'] == "start":
+                # Process and log the header message
+                logging.debug(f"Received header: {msg}")
+                return None, None
+            elif msg['type'] == "image": 
+                # Process data messages   
+                logging.debug(f"Got: {msg['series_id']}:{[msg['image_id']]}")
+                stamps["decoded"] = time.perf_counter_ns()
+                return self.fill_frame(msg['data']['default'], msg['image_id'], stamps)
+            elif msg['type'] == "end":
+                logging.debug(f"Received End message: {msg}")
+                return None, None
+            else:
+                logging.warning(f"Unindentified message type: {msg['type']}")
+                return None, None
+        except Exception as e:
+            logging.error(f"An unexpected error occurred: {e}")
+            return None, None
+
+    def fill_frame(self, raw_data, frame_nr, stamps=None):
+        frame = self.pool.acquire()
+        if frame is None:
+            logging.debug(f"No free frame buffer, dropping frame {frame_nr} ({self.pool.misses} dropped so far)")
+            return None, None
+
+        # Cast to float and replace invalid values (min_int32) with np.nan, in place
+        try:
+            self.pool.fill(frame, raw_data, frame_nr)
+        except Exception:
+            frame.release()
+            raise
+        if stamps is not None:
+            stamps["converted"] = time.perf_counter_ns()
+        frame.stamps = stamps
+        return frame, frame_nr
 
     def reconnect(self):
         """Attempt to reconnect to the server."""